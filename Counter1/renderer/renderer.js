@@ -86,6 +86,41 @@ function startDiscoveryListener() {
   }
 }
 
+// POST with an Idempotency-Key: retries (and double-clicks while a call is
+// still in flight) reuse the same key, so the server returns the first result
+// instead of calling a second token.
+const inFlight = {};
+
+function postIdempotent(path, body, { retries = 3, timeoutMs = 1500 } = {}) {
+  const slot = path + JSON.stringify(body);
+  if (inFlight[slot]) return inFlight[slot].then((r) => r.clone());
+
+  const key = crypto.randomUUID();
+  const attempt = async () => {
+    let lastErr;
+    for (let i = 0; i <= retries; i++) {
+      const ctrl = new AbortController();
+      const timer = setTimeout(() => ctrl.abort(), timeoutMs);
+      try {
+        return await fetch(`${baseUrl}${path}`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json", "Idempotency-Key": key },
+          body: JSON.stringify(body),
+          signal: ctrl.signal
+        });
+      } catch (e) {
+        lastErr = e;
+      } finally {
+        clearTimeout(timer);
+      }
+    }
+    throw lastErr;
+  };
+
+  inFlight[slot] = attempt().finally(() => { delete inFlight[slot]; });
+  return inFlight[slot].then((r) => r.clone());
+}
+
 async function refresh() {
   try {
     const res = await fetch(`${baseUrl}/api/queue?dept=welfare`, { cache: "no-store" });
@@ -124,11 +159,7 @@ async function nextWalkin() {
       return;
     }
 
-    const res = await fetch(`${baseUrl}/api/call-next`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ dept: "welfare", counter, mode: "walkin", dest_stage })
-    });
+    const res = await postIdempotent("/api/call-next", { dept: "welfare", counter, mode: "walkin", dest_stage });
 
     const data = await res.json();
     if (data.token_no === null) {
@@ -155,11 +186,7 @@ async function nextToken() {
       return;
     }
 
-    const res = await fetch(`${baseUrl}/api/call-next`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ dept: "welfare", counter, dest_stage })
-    });
+    const res = await postIdempotent("/api/call-next", { dept: "welfare", counter, dest_stage });
 
     if (!res.ok) {
       const text = await res.text();
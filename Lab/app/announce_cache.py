@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+import wave
+from collections import OrderedDict
+
+from audio_engine import Clip, ClipCache, ENGINE_CHANNELS, ENGINE_RATE, ENGINE_SAMPWIDTH, decode_wav
+
+
+class AnnouncementCache:
+    """
+    Pre-mixed announcements: ding + token + counter rendered into ONE clip.
+
+    Rendered clips are kept in a size-bounded LRU in memory and as WAV files in
+    cache_dir (also size-bounded, oldest files removed first), so a recall or a
+    restart plays the whole announcement as a single clip with no gaps.
+    """
+
+    def __init__(self, clips: ClipCache, cache_dir: str, mem_limit_bytes: int = 32 * 1024 * 1024,
+                 disk_limit_bytes: int = 256 * 1024 * 1024, gap_ms: int = 120):
+        self.clips = clips
+        self.cache_dir = cache_dir
+        self.mem_limit_bytes = mem_limit_bytes
+        self.disk_limit_bytes = disk_limit_bytes
+        self.gap_ms = gap_ms
+
+        self._mem = OrderedDict()     # digest -> Clip
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ------------------ keys ------------------
+
+    def _digest(self, parts) -> str:
+        h = hashlib.sha1()
+        h.update(f"{ENGINE_RATE}/{ENGINE_CHANNELS}/{ENGINE_SAMPWIDTH}/{self.gap_ms}".encode())
+        for p in parts:
+            if isinstance(p, Clip):
+                # in-memory piece (e.g. assembled digits): key on its audio
+                h.update(f"|clip:{p.name}:".encode())
+                h.update(hashlib.sha1(p.pcm).digest())
+                continue
+            try:
+                st = os.stat(p)
+                stamp = f"{st.st_size}:{int(st.st_mtime)}"
+            except OSError:
+                stamp = "missing"
+            # asset changes (new recording) → new key
+            h.update(f"|{os.path.abspath(p)}:{stamp}".encode())
+        return h.hexdigest()
+
+    # ------------------ public ------------------
+
+    def get(self, parts: list, name: str = "") -> Clip | None:
+        """
+        Returns the pre-mixed clip for these parts (WAV paths or Clips), rendering it on a miss.
+        None if no part could be decoded.
+        """
+        digest = self._digest(parts)
+
+        with self._lock:
+            clip = self._mem.get(digest)
+            if clip is not None:
+                self._mem.move_to_end(digest)
+                return clip
+
+        path = os.path.join(self.cache_dir, f"{digest}.wav")
+        clip = None
+        if os.path.exists(path):
+            try:
+                clip = decode_wav(path)   # already engine format → no conversion
+                os.utime(path)            # mark as recently used for disk eviction
+            except Exception:
+                clip = None
+
+        if clip is None:
+            clip = self._render(parts, name)
+            if clip is None:
+                return None
+            self._write_disk(path, clip)
+
+        clip.name = name or clip.name
+        self._remember(digest, clip)
+        return clip
+
+    def prerender(self, parts: list, name: str = ""):
+        """Renders in the background so a later get() is a cache hit."""
+        threading.Thread(target=self._safe_get, args=(parts, name), daemon=True).start()
+
+    # ------------------ internals ------------------
+
+    def _safe_get(self, parts, name):
+        try:
+            self.get(parts, name)
+        except Exception as e:
+            print(f"[AUDIO] prerender failed ({name}): {e}")
+
+    def _render(self, parts, name) -> Clip | None:
+        gap = b"\x00" * (int(ENGINE_RATE * self.gap_ms / 1000) * ENGINE_SAMPWIDTH)
+        chunks = []
+        for p in parts:
+            clip = p if isinstance(p, Clip) else self.clips.get(p)
+            if clip is None:
+                print("[AUDIO] missing:", p)
+                continue
+            if chunks:
+                chunks.append(gap)
+            chunks.append(clip.pcm)
+        if not chunks:
+            return None
+        return Clip(b"".join(chunks), ENGINE_RATE, name)
+
+    def _remember(self, digest, clip):
+        with self._lock:
+            if digest in self._mem:
+                return
+            self._mem[digest] = clip
+            self._mem_bytes += len(clip.pcm)
+            while self._mem_bytes > self.mem_limit_bytes and len(self._mem) > 1:
+                _, old = self._mem.popitem(last=False)
+                self._mem_bytes -= len(old.pcm)
+
+    def _write_disk(self, path, clip):
+        tmp = path + ".tmp"
+        try:
+            with wave.open(tmp, "wb") as w:
+                w.setnchannels(ENGINE_CHANNELS)
+                w.setsampwidth(ENGINE_SAMPWIDTH)
+                w.setframerate(ENGINE_RATE)
+                w.writeframes(clip.pcm)
+            os.replace(tmp, path)
+        except Exception as e:
+            print("[AUDIO] could not cache announcement:", e)
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        try:
+            files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".wav")]
+            stats = sorted(((os.stat(f).st_mtime, os.stat(f).st_size, f) for f in files))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, f in stats:
+            if total <= self.disk_limit_bytes:
+                break
+            try:
+                os.remove(f)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,148 @@
+"""
+Client side of an unreachable server.
+
+    Backoff           jittered exponential retry delays, so clients don't all
+                      hit a restarted server in the same second
+    CircuitBreaker    after a few failures in a row stop trying until the
+                      backoff delay has passed, then let ONE request test it
+    LastKnownState    last status + what was announced, kept on disk, so a
+                      reconnect or a client restart neither repeats nor
+                      skips announcements
+"""
+import json
+import os
+import random
+import threading
+import time
+from datetime import date
+
+
+class Backoff:
+    """Full jitter: delay is random in [0, min(cap, base * factor**attempt)]."""
+
+    def __init__(self, base: float = 0.5, cap: float = 15.0, factor: float = 2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        ceiling = min(self.cap, self.base * (self.factor ** self.attempt))
+        self.attempt += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class CircuitBreaker:
+    """
+    closed     requests go through; each failure still waits a backoff delay
+    open       failure_threshold failures in a row: nothing is sent until the
+               delay has passed
+    half_open  one trial request; success closes, failure opens again with a
+               longer delay
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str = "server", failure_threshold: int = 3, backoff: Backoff | None = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff or Backoff()
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                return False
+            if self.state == self.OPEN:
+                self.state = self.HALF_OPEN
+            return True
+
+    def wait_time(self) -> float:
+        """Seconds until allow() will say yes."""
+        with self._lock:
+            return max(0.0, self._retry_at - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"[{self.name}] reachable again")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._retry_at = 0.0
+            self.backoff.reset()
+
+    def failure(self) -> bool:
+        """Records a failed request. Returns True when the circuit opens."""
+        with self._lock:
+            self.failures += 1
+            delay = self.backoff.next_delay()
+            self._retry_at = time.monotonic() + delay
+
+            opened = self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold)
+            if opened:
+                if self.state == self.CLOSED:
+                    print(f"[{self.name}] unreachable after {self.failures} tries, backing off")
+                self.state = self.OPEN
+            return opened
+
+
+class LastKnownState:
+    """
+    One JSON file: {key: {"saved_at", "session_date", ...}}. A stage's entry
+    is only handed back on the same day and while younger than max_age_s;
+    older state would announce calls nobody is waiting for any more.
+    """
+
+    def __init__(self, path: str, max_age_s: float = 300.0):
+        self.path = path
+        self.max_age_s = max_age_s
+        self._data = {}
+        self._written = {}      # key -> (json, time) of the last write (skip identical writes)
+        self._lock = threading.Lock()
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print("[STATE] unreadable state file, starting fresh:", e)
+
+    def load(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._data.get(key)
+        if not entry:
+            return None
+        if entry.get("session_date") != date.today().isoformat():
+            return None
+        if time.time() - entry.get("saved_at", 0) > self.max_age_s:
+            return None
+        return entry
+
+    def save(self, key: str, **fields):
+        raw = json.dumps(fields, sort_keys=True, default=str)
+        now = time.time()
+        with self._lock:
+            last_raw, last_at = self._written.get(key, (None, 0.0))
+            if last_raw == raw and now - last_at < self.max_age_s / 4:
+                return   # unchanged and recent enough on disk
+            self._data[key] = dict(fields, saved_at=now, session_date=date.today().isoformat())
+            self._written[key] = (raw, now)
+
+            tmp = self.path + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._data, f)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                print("[STATE] could not write state file:", e)
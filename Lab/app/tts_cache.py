@@ -0,0 +1,171 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+IS_WINDOWS = sys.platform.startswith("win")
+IS_MAC = sys.platform == "darwin"
+
+# ✅ Safe import for SAPI (pythoncom comes with pywin32)
+try:
+    import pythoncom
+    import win32com.client
+except Exception:
+    pythoncom = None
+    win32com = None
+
+SSFM_CREATE_FOR_WRITE = 3
+
+
+def _ps_escape(s: str) -> str:
+    return s.replace("'", "''")
+
+
+class TTSCache:
+    """
+    Render-to-file TTS: every distinct phrase is synthesized once into
+    cache_dir/<sha1>.wav (content addressed by voice settings + text).
+
+    Live announcements then only play cached WAVs; nothing is synthesized
+    while a patient is waiting for their number.
+    """
+
+    def __init__(self, cache_dir: str, voice_hint: str = "zira", rate: int = 0, volume: int = 100):
+        self.cache_dir = cache_dir
+        self.voice_hint = voice_hint
+        self.rate = rate
+        self.volume = volume
+        self.backend = self._pick_backend()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ------------------ lookup ------------------
+
+    def path_for(self, text: str) -> str:
+        key = f"{self.backend}|{self.voice_hint}|{self.rate}|{self.volume}|{text.strip().lower()}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".wav")
+
+    def cached(self, text: str) -> str | None:
+        """Path of the rendered phrase, or None if it isn't rendered yet (never blocks)."""
+        p = self.path_for(text)
+        return p if os.path.exists(p) else None
+
+    def get(self, text: str) -> str | None:
+        """Path of the rendered phrase, rendering it now on a miss."""
+        p = self.cached(text)
+        if p is not None:
+            return p
+        self.warm([text])
+        return self.cached(text)
+
+    # ------------------ rendering ------------------
+
+    def warm(self, phrases):
+        """Renders every phrase that isn't cached yet (one batch per backend)."""
+        todo = []
+        seen = set()
+        for text in phrases:
+            p = self.path_for(text)
+            if p not in seen and not os.path.exists(p):
+                seen.add(p)
+                todo.append((text, p))
+        if not todo or self.backend is None:
+            return 0
+
+        with self._lock:
+            try:
+                if self.backend == "sapi":
+                    self._render_sapi(todo)
+                elif self.backend == "powershell":
+                    self._render_powershell(todo)
+                elif self.backend == "say":
+                    self._render_say(todo)
+                elif self.backend == "espeak":
+                    self._render_espeak(todo)
+            except Exception as e:
+                print(f"[TTS] render failed ({self.backend}): {e}")
+
+        done = sum(1 for _, p in todo if os.path.exists(p))
+        print(f"[TTS] cached {done}/{len(todo)} phrases ({self.backend})")
+        return done
+
+    def _pick_backend(self):
+        if IS_WINDOWS:
+            return "sapi" if win32com is not None else "powershell"
+        if IS_MAC:
+            return "say"
+        if shutil.which("espeak-ng") or shutil.which("espeak"):
+            return "espeak"
+        return None
+
+    def _render_sapi(self, todo):
+        # warm() runs on a background thread; COM has to be initialised per thread
+        pythoncom.CoInitialize()
+        try:
+            self._speak_sapi(todo)
+        finally:
+            pythoncom.CoUninitialize()
+
+    def _speak_sapi(self, todo):
+        # own function so the COM objects are released before CoUninitialize
+        voice = win32com.client.Dispatch("SAPI.SpVoice")
+        voice.Rate = self.rate
+        voice.Volume = self.volume
+        for v in voice.GetVoices():
+            if self.voice_hint in v.GetDescription().lower():
+                voice.Voice = v
+                break
+
+        for text, path in todo:
+            tmp = path + ".tmp.wav"
+            stream = win32com.client.Dispatch("SAPI.SpFileStream")
+            stream.Open(tmp, SSFM_CREATE_FOR_WRITE)
+            voice.AudioOutputStream = stream
+            voice.Speak(text, 0)
+            voice.WaitUntilDone(-1)
+            stream.Close()
+            os.replace(tmp, path)
+
+    def _render_powershell(self, todo):
+        # ONE PowerShell process (and one System.Speech load) for the whole batch
+        lines = [
+            "Add-Type -AssemblyName System.Speech; ",
+            "$s = New-Object System.Speech.Synthesis.SpeechSynthesizer; ",
+            f"$s.Volume = {self.volume}; ",
+            f"$s.Rate = {self.rate}; ",
+        ]
+        for text, path in todo:
+            lines.append(f"$s.SetOutputToWaveFile('{_ps_escape(path + '.tmp.wav')}'); ")
+            lines.append(f"$s.Speak('{_ps_escape(text)}'); ")
+        lines.append("$s.SetOutputToNull(); ")
+
+        subprocess.run(
+            ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", "".join(lines)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            creationflags=0x08000000
+        )
+        for _, path in todo:
+            if os.path.exists(path + ".tmp.wav"):
+                os.replace(path + ".tmp.wav", path)
+
+    def _render_say(self, todo):
+        for text, path in todo:
+            tmp = path + ".tmp.wav"
+            subprocess.run(
+                ["say", "--file-format=WAVE", "--data-format=LEI16@22050", "-o", tmp, text],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            if os.path.exists(tmp):
+                os.replace(tmp, path)
+
+    def _render_espeak(self, todo):
+        exe = shutil.which("espeak-ng") or shutil.which("espeak")
+        for text, path in todo:
+            tmp = path + ".tmp.wav"
+            subprocess.run([exe, "-w", tmp, text], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if os.path.exists(tmp):
+                os.replace(tmp, path)
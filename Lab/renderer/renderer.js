@@ -62,6 +62,41 @@ function startDiscoveryListener() {
   }
 }
 
+// POST with an Idempotency-Key: retries (and double-clicks while a call is
+// still in flight) reuse the same key, so the server returns the first result
+// instead of calling a second token.
+const inFlight = {};
+
+function postIdempotent(path, body, { retries = 3, timeoutMs = 1500 } = {}) {
+  const slot = path + JSON.stringify(body);
+  if (inFlight[slot]) return inFlight[slot].then((r) => r.clone());
+
+  const key = crypto.randomUUID();
+  const attempt = async () => {
+    let lastErr;
+    for (let i = 0; i <= retries; i++) {
+      const ctrl = new AbortController();
+      const timer = setTimeout(() => ctrl.abort(), timeoutMs);
+      try {
+        return await fetch(`${baseUrl}${path}`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json", "Idempotency-Key": key },
+          body: JSON.stringify(body),
+          signal: ctrl.signal
+        });
+      } catch (e) {
+        lastErr = e;
+      } finally {
+        clearTimeout(timer);
+      }
+    }
+    throw lastErr;
+  };
+
+  inFlight[slot] = attempt().finally(() => { delete inFlight[slot]; });
+  return inFlight[slot].then((r) => r.clone());
+}
+
 async function refresh() {
   try {
     const res = await fetch(`${baseUrl}/api/queue?dept=${dept}&stage=${stage}`, { cache: "no-store" });
@@ -89,11 +124,7 @@ async function nextToken() {
   if (btn) btn.disabled = true;
 
   try {
-    const res = await fetch(`${baseUrl}/api/call-next`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ dept, stage, counter, mode: "auto" })
-    });
+    const res = await postIdempotent("/api/call-next", { dept, stage, counter, mode: "auto" });
 
     const data = await res.json();
 
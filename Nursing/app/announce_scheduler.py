@@ -0,0 +1,146 @@
+import threading
+import time
+
+
+class Announcement:
+    __slots__ = ("seq", "key", "recall", "item", "name", "enqueued_at", "deadline")
+
+    def __init__(self, seq, key, recall, item, name, enqueued_at, deadline):
+        self.seq = seq
+        self.key = key
+        self.recall = recall
+        self.item = item
+        self.name = name
+        self.enqueued_at = enqueued_at
+        self.deadline = deadline
+
+
+class AnnouncementScheduler:
+    """
+    Replaces the plain FIFO in front of the audio worker.
+
+    - Each announcement has a counter key: a newer call for the same counter
+      replaces the one still waiting (it keeps its place in the line), so
+      three quick NEXT clicks are read out once, with the latest token.
+    - Recalls go before normal calls; a repeated recall for a counter is merged.
+    - Anything still waiting after max_age_s is dropped (the display already
+      shows it), so a backlog after a network blip can't delay the current call.
+    """
+
+    def __init__(self, max_age_s: float = 20.0):
+        self.max_age_s = max_age_s
+
+        self._pending = []      # Announcement, in arrival order
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._unfinished = 0
+
+        self._served = 0
+        self._merged = 0
+        self._expired = 0
+        self._last_wait_ms = None
+        self._max_wait_ms = 0.0
+
+    # ------------------ producer ------------------
+
+    def put(self, item, key=None, recall: bool = False, name: str = "", max_age_s: float | None = None):
+        """key=None → never merged (plain clips, TTS)."""
+        now = time.monotonic()
+        age = self.max_age_s if max_age_s is None else max_age_s
+
+        with self._cond:
+            if key is not None:
+                old = self._find(key, recall)
+                if old is not None:
+                    # superseded: keep the slot, play the newest content
+                    old.item = item
+                    old.name = name
+                    old.deadline = now + age
+                    self._merged += 1
+                    return
+
+                if not recall:
+                    # a recall of the previous token is stale once the counter moved on
+                    stale = self._find(key, True)
+                    if stale is not None:
+                        self._pending.remove(stale)
+                        self._unfinished -= 1
+                        self._merged += 1
+
+            self._seq += 1
+            self._pending.append(Announcement(self._seq, key, recall, item, name, now, now + age))
+            self._unfinished += 1
+            self._cond.notify()
+
+    def _find(self, key, recall):
+        for a in self._pending:
+            if a.key == key and a.recall == recall:
+                return a
+        return None
+
+    # ------------------ consumer ------------------
+
+    def get(self, timeout: float | None = None):
+        """Next item to play (recalls first, then arrival order). Blocks; None on timeout."""
+        end = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                self._drop_expired()
+                if self._pending:
+                    a = self._next()
+                    self._pending.remove(a)
+                    self._served += 1
+                    wait_ms = (time.monotonic() - a.enqueued_at) * 1000.0
+                    self._last_wait_ms = wait_ms
+                    self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+                    return a.item
+
+                if end is None:
+                    self._cond.wait()
+                else:
+                    left = end - time.monotonic()
+                    if left <= 0:
+                        return None
+                    self._cond.wait(left)
+
+    def task_done(self):
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self):
+        """Blocks until every queued item has been played or dropped."""
+        with self._cond:
+            while self._unfinished > 0:
+                self._cond.wait()
+
+    def _next(self) -> Announcement:
+        recalls = [a for a in self._pending if a.recall]
+        return recalls[0] if recalls else self._pending[0]
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        for a in [a for a in self._pending if a.deadline < now]:
+            print(f"[AUDIO] dropped stale announcement {a.name} ({(now - a.enqueued_at):.1f}s old)")
+            self._pending.remove(a)
+            self._unfinished -= 1
+            self._expired += 1
+        if self._unfinished <= 0:
+            self._cond.notify_all()
+
+    # ------------------ metrics ------------------
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            oldest = min((a.enqueued_at for a in self._pending), default=None)
+            return {
+                "depth": len(self._pending),
+                "lag_ms": round((now - oldest) * 1000.0, 1) if oldest is not None else 0.0,
+                "last_wait_ms": round(self._last_wait_ms, 1) if self._last_wait_ms is not None else None,
+                "max_wait_ms": round(self._max_wait_ms, 1),
+                "served": self._served,
+                "merged": self._merged,
+                "expired": self._expired,
+            }
@@ -7,10 +7,13 @@ import configparser
 import os
 import sys
 
-from audio import announce_token
+from audio import announce_token, audio_metrics, init_audio_engine, warm_tts_cache
+from latency import LatencyRecorder, call_order
+from server_locator import ServerLocator
+from resilience import Backoff, CircuitBreaker, LastKnownState
 
-DISCOVERY_PORT = 9999
 SERVER_BASE = None
+STATUS_WAIT_S = 25     # /api/status/wait parks the request up to this long
 
 
 def app_dir():
@@ -23,45 +26,66 @@ def app_dir():
 cfg = configparser.ConfigParser()
 cfg.read(os.path.join(app_dir(), "config.ini"))
 USE_TTS = cfg.getboolean("audio", "use_tts", fallback=True)
+AUDIO_ENGINE = cfg.get("audio", "engine", fallback="auto")        # auto | sounddevice | winsound | file | null | legacy
+AUDIO_SINK_PATH = cfg.get("audio", "sink_path", fallback="")      # for engine = file
+AUDIO_DEVICE = cfg.get("audio", "device", fallback="") or None
+
+# call → announcement latency histogram, exported as JSON (python latency.py latency.json)
+LATENCY = LatencyRecorder()
+LATENCY_PATH = cfg.get("latency", "export_path", fallback=os.path.join(app_dir(), "latency.json"))
+
+# unreachable server: jittered backoff + circuit breaker; last state kept on disk
+BREAKER = CircuitBreaker(
+    "SERVER",
+    failure_threshold=cfg.getint("network", "failure_threshold", fallback=3),
+    backoff=Backoff(cap=cfg.getfloat("network", "backoff_cap", fallback=15.0)),
+)
+STATE = LastKnownState(
+    cfg.get("state", "path", fallback=os.path.join(app_dir(), "last_state.json")),
+    max_age_s=cfg.getfloat("state", "max_age_seconds", fallback=300),
+)
 
 
 # ===================== DISCOVERY =====================
-def listen_for_server():
+def _on_server(base):
+    # ServerLocator picked a (new) server, or None when nothing answers
     global SERVER_BASE
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", DISCOVERY_PORT))
+    SERVER_BASE = base
 
-    while True:
-        data, _ = sock.recvfrom(2048)
-        try:
-            payload = json.loads(data.decode())
-
-            if payload.get("service") in ("Reception-QMS"):
-                ip = payload["ip"]
-                port = payload["port"]
-                new_base = f"http://{ip}:{port}"
 
-                if SERVER_BASE != new_base:
-                    SERVER_BASE = new_base
-                    print(f"✅ Server discovered: {SERVER_BASE}")
-
-        except Exception:
-            pass
+# probe/response discovery: fastest answering server, failover when it stops
+LOCATOR = ServerLocator(
+    service=cfg.get("discovery", "service", fallback="Test-QMS"),
+    on_change=_on_server,
+    probe_interval=cfg.getfloat("discovery", "probe_interval", fallback=5.0),
+)
 
 # ===================== AUDIO POLLER =====================
 def poll_nursing_audio():
     global SERVER_BASE
-    last_serving = {}
-    last_recall_seq = 0
+    # resume from the last run (same day, recent) so a restart doesn't repeat calls
+    saved = STATE.load("nursing") or {}
+    last_serving = dict(saved.get("announced") or {})
+    last_recall_seq = saved.get("recall_seq", 0)
+    version = None
+    session = requests.Session()   # keep-alive between long polls
 
     while True:
         try:
             if not SERVER_BASE:
                 time.sleep(0.5)
                 continue
+            if not BREAKER.allow():
+                time.sleep(BREAKER.wait_time())
+                continue
 
-            url = f"{SERVER_BASE}/api/status?dept=welfare&stage=nursing"
-            status = requests.get(url, timeout=2).json()
+            url = f"{SERVER_BASE}/api/status/wait?dept=welfare&stage=nursing"
+            t_send = time.time()
+            status = session.get(url, params={"since": version, "timeout": STATUS_WAIT_S}, timeout=STATUS_WAIT_S + 5).json()
+            t_recv = time.time()
+            version = status.get("version")
+            BREAKER.success()
+            LATENCY.clock(status, t_send, t_recv)
 
             serving = status.get("serving", {}) or {}
 
@@ -77,23 +101,31 @@ def poll_nursing_audio():
                 token = serving.get(rc)
                 if token:
                     print(f"🔁 Nursing recall: {rc} -> {token}")
-                    announce_token(USE_TTS, token, rc)
+                    announce_token(USE_TTS, token, rc, recall=True)
 
-            for counter, token in serving.items():
+            for counter, token in sorted(serving.items(), key=lambda ct: call_order(status, ct[0])):
                 if token and last_serving.get(counter) != token:
                     last_serving[counter] = token
                     print(f"🔊 Nursing call: {counter} -> {token}")
-                    announce_token(USE_TTS, token, counter)
+                    announce_token(USE_TTS, token, counter, on_start=LATENCY.on_call("nursing", counter, status, t_recv))
 
-            time.sleep(0.7)
+            STATE.save("nursing", status=status, announced=last_serving, recall_seq=last_recall_seq)
 
         except Exception as e:
             print("❌ Audio poll error:", e)
-            time.sleep(1)
+            BREAKER.failure()
+            LOCATOR.report_failure(SERVER_BASE)
+            version = None
 
 
 def main():
-    threading.Thread(target=listen_for_server, daemon=True).start()
+    # audio device + TTS warm-up only when running as the poller, not on import
+    init_audio_engine(AUDIO_ENGINE, AUDIO_SINK_PATH, AUDIO_DEVICE)
+    if USE_TTS:
+        warm_tts_cache()   # digit words → tts_cache/ before the first call
+
+    LOCATOR.start()
+    LATENCY.start_autoexport(LATENCY_PATH, extra=audio_metrics)
     poll_nursing_audio()
 
 
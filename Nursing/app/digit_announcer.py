@@ -0,0 +1,103 @@
+import array
+import os
+import threading
+
+from audio_engine import Clip, ENGINE_RATE, decode_wav
+
+
+def trim_silence(samples: array.array, threshold: int = 600, pad_frames: int = 0) -> array.array:
+    """Drops leading/trailing samples quieter than threshold (keeps pad_frames of each)."""
+    n = len(samples)
+    start = 0
+    while start < n and abs(samples[start]) < threshold:
+        start += 1
+    end = n
+    while end > start and abs(samples[end - 1]) < threshold:
+        end -= 1
+    if start >= end:
+        return array.array("h")
+    return samples[max(0, start - pad_frames):min(n, end + pad_frames)]
+
+
+def crossfade_concat(pieces: list[array.array], xfade_frames: int) -> array.array:
+    """Joins pieces, overlapping each joint by xfade_frames with a linear fade."""
+    out = array.array("h")
+    for piece in pieces:
+        if not out or xfade_frames <= 0:
+            out.extend(piece)
+            continue
+
+        x = min(xfade_frames, len(out), len(piece))
+        tail_start = len(out) - x
+        for i in range(x):
+            t = (i + 1) / (x + 1)
+            out[tail_start + i] = int(out[tail_start + i] * (1.0 - t) + piece[i] * t)
+        out.extend(piece[x:])
+    return out
+
+
+class DigitAnnouncer:
+    """
+    Speaks any token number from the recorded digit clips 0.wav – 9.wav.
+
+    Each digit is decoded once, trimmed of silence and kept in memory; a token
+    is assembled by crossfading its digits, so 1001, 2xxx walk-in and 3xxx lab
+    tokens are all announced correctly without TTS.
+    """
+
+    def __init__(self, audio_dir: str, crossfade_ms: int = 25, gap_ms: int = 40,
+                 silence_threshold: int = 600, pad_ms: int = 15, digit_path=None):
+        self.audio_dir = audio_dir
+        # digit -> WAV path (or None if not available yet); default: audio_dir/<d>.wav
+        self._digit_path = digit_path or (lambda d: os.path.join(audio_dir, f"{d}.wav"))
+        self.xfade_frames = int(ENGINE_RATE * crossfade_ms / 1000)
+        self.gap_frames = int(ENGINE_RATE * gap_ms / 1000)
+        self.silence_threshold = silence_threshold
+        self.pad_frames = int(ENGINE_RATE * pad_ms / 1000)
+
+        self._digits = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return all(self._path(d) is not None for d in "0123456789")
+
+    def _path(self, d: str) -> str | None:
+        p = self._digit_path(d)
+        return p if p and os.path.exists(p) else None
+
+    def preload(self):
+        for d in "0123456789":
+            self._digit(d)
+
+    def _digit(self, d: str) -> array.array | None:
+        with self._lock:
+            if d in self._digits:
+                return self._digits[d]
+
+        path = self._path(d)
+        if path is None:
+            # not cached: the file may show up later (e.g. rendered TTS)
+            return None
+
+        try:
+            raw = decode_wav(path).samples()
+            samples = trim_silence(raw, self.silence_threshold, self.pad_frames)
+            # a short pause after each digit keeps "one, zero, zero, five" readable
+            samples.extend(array.array("h", bytes(2 * self.gap_frames)))
+        except Exception as e:
+            print(f"[AUDIO] could not load digit {d}: {e}")
+            samples = None
+
+        with self._lock:
+            self._digits[d] = samples
+        return samples
+
+    def token_clip(self, token_no: int) -> Clip | None:
+        """Returns the spoken digits of token_no as one clip, or None if a digit is missing."""
+        pieces = []
+        for d in str(int(token_no)):
+            s = self._digit(d)
+            if s is None or not len(s):
+                return None
+            pieces.append(s)
+        return Clip.from_samples(crossfade_concat(pieces, self.xfade_frames), ENGINE_RATE, f"digits:{int(token_no)}")
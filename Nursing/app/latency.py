@@ -0,0 +1,192 @@
+"""
+Call → announcement latency, per stage.
+
+The server stamps every call with an event id and its own timestamp
+(/api/status "calls"); the poller notes when it saw the call and the audio
+worker reports when playback actually started. Three segments are kept as
+histograms per stage:
+
+    server_to_client  call on the server → poller saw it (long-poll wake-up + network)
+    client_to_sound   poller saw it → first sample played (queue + playback start)
+    total             call on the server → first sample played
+
+The exported file also carries the announcement queue (depth, lag) of the
+client ("audio") or of each announcer zone ("zones").
+
+    python latency.py [latency.json]     # print an exported file
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# upper bounds in ms; the last bucket is open ended
+BUCKETS_MS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+SEGMENTS = ("server_to_client", "client_to_sound", "total")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms: float):
+        ms = max(0.0, ms)
+        i = 0
+        while i < len(BUCKETS_MS) and ms > BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p: float) -> float | None:
+        """Upper bound of the bucket holding the p-th percentile (never above the max seen)."""
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return round(min(float(BUCKETS_MS[i]), self.max_ms), 1) if i < len(BUCKETS_MS) else round(self.max_ms, 1)
+        return round(self.max_ms, 1)
+
+    def to_dict(self) -> dict:
+        labels = [f"<={b}" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class LatencyRecorder:
+    """
+    rec.clock(status, t_send, t_recv)                  after each /api/status(/wait)
+    on_start = rec.on_call(stage, counter, status, t_recv)
+    announce_token(..., on_start=on_start)             → recorded when playback starts
+    """
+
+    def __init__(self, max_pending: int = 200):
+        self._hist = {}                  # stage -> {segment: Histogram}
+        self._offset_s = 0.0             # server clock - local clock
+        self._clock_samples = 0
+        self._pending = OrderedDict()    # event_id -> seen (calls that never played drop out)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+
+    def clock(self, status: dict, t_send: float, t_recv: float):
+        """Estimates the server clock offset from one request (midpoint of the round trip)."""
+        server_ts = status.get("server_ts")
+        if server_ts is None:
+            return
+        # long poll: the time the request sat parked on the server is not network
+        t_send = min(t_recv, t_send + float(status.get("waited_ms") or 0) / 1000.0)
+        offset = float(server_ts) - (t_send + t_recv) / 2.0
+        with self._lock:
+            # smooth out jitter of single requests
+            self._offset_s = offset if not self._clock_samples else 0.8 * self._offset_s + 0.2 * offset
+            self._clock_samples += 1
+
+    def on_call(self, stage: str, counter: str, status: dict, seen_at: float):
+        """Callback for the audio worker (None if the server didn't stamp this call)."""
+        call = (status.get("calls") or {}).get(counter)
+        if not call or call.get("event_id") is None:
+            return None
+
+        event_id = call["event_id"]
+        with self._lock:
+            called_local = float(call["called_ts"]) - self._offset_s
+            self._pending[event_id] = seen_at
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+        def _started(_t=None):
+            self._record(stage, event_id, called_local, time.time())
+
+        return _started
+
+    def _record(self, stage, event_id, called_local, started):
+        with self._lock:
+            seen = self._pending.pop(event_id, None)
+            if seen is None:
+                return
+            hist = self._hist.setdefault(stage, {s: Histogram() for s in SEGMENTS})
+            hist["server_to_client"].add((seen - called_local) * 1000.0)
+            hist["client_to_sound"].add((started - seen) * 1000.0)
+            hist["total"].add((started - called_local) * 1000.0)
+        print(f"[LATENCY] {stage} call #{event_id}: {(started - called_local) * 1000.0:.0f} ms to sound")
+
+    # ------------------ export ------------------
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "generated_at": time.time(),
+                "clock_offset_ms": round(self._offset_s * 1000.0, 1),
+                "stages": {
+                    stage: {seg: h.to_dict() for seg, h in segs.items()}
+                    for stage, segs in self._hist.items()
+                },
+            }
+
+    def export(self, path: str, extra=None):
+        """extra: optional callable -> dict of more sections for the file (e.g. audio queue stats)."""
+        data = self.snapshot()
+        if extra:
+            data.update(extra())
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    def start_autoexport(self, path: str, interval: float = 30.0, extra=None):
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.export(path, extra=extra)
+                except Exception as e:
+                    print("[LATENCY] export failed:", e)
+
+        threading.Thread(target=_loop, daemon=True).start()
+
+
+def call_order(status: dict, counter: str):
+    """Sort key: server call event id, so a batch is announced in the order it was called."""
+    call = (status.get("calls") or {}).get(counter) or {}
+    event_id = call.get("event_id")
+    return (event_id is None, event_id or 0)   # unstamped calls last
+
+
+def print_report(data: dict):
+    for stage, segs in sorted((data.get("stages") or {}).items()):
+        print(f"\n{stage}")
+        print(f"  {'segment':<18}{'count':>7}{'mean':>9}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>9}")
+        for seg in SEGMENTS:
+            h = segs.get(seg) or {}
+            cells = [h.get(k) for k in ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")]
+            cells = ["-" if v is None else f"{v:.0f}" for v in cells]
+            print(f"  {seg:<18}{h.get('count', 0):>7}{cells[0]:>9}{cells[1]:>8}{cells[2]:>8}{cells[3]:>8}{cells[4]:>9}")
+
+    # announcement queue of the client (audio) or of each announcer zone (zones)
+    queues = {"audio": data["audio"]} if data.get("audio") else dict(data.get("zones") or {})
+    for name, stats in sorted(queues.items()):
+        q = stats.get("queue") or {}
+        print(f"\nqueue {name}: depth={q.get('depth')} lag_ms={q.get('lag_ms')} max_wait_ms={q.get('max_wait_ms')} "
+              f"served={q.get('served')} merged={q.get('merged')} expired={q.get('expired')}")
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "latency.json"
+    with open(path, encoding="utf-8") as f:
+        print_report(json.load(f))
@@ -0,0 +1,227 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+
+DISCOVERY_PORT = 9999   # server beacons (every 3 s)
+PROBE_PORT = 9998       # our probes; servers answer straight away
+BEACON_TTL = 10.0       # a beacon-only server is gone after this many seconds of silence
+NEAR_MS = 5.0           # servers this close in RTT count as equally near; load decides
+
+
+class ServerLocator:
+    """
+    Finds the QMS server and keeps track of the best one.
+
+    - probe(): broadcasts {"service", "probe"} on PROBE_PORT (and to
+      127.0.0.1 for a server on this PC); every server answers at once with
+      its address and load. Round-trip time is measured per server.
+    - servers are ranked by RTT (smoothed, in NEAR_MS bands), then load,
+      then a per-client random order, so clients of a cluster spread over
+      its nodes instead of all picking the fastest; the current one is kept
+      as long as it answers, so clients don't flap between servers
+    - a cluster node also lists every healthy node in its answer; those are
+      known even if their own answer got lost
+    - once the current server carries rebalance_slack more load than the
+      best one, a client moves with a probability that grows with the gap,
+      so a node that comes back gets its share without everyone jumping
+    - a server that misses fail_after probes in a row, or that a client
+      reports with report_failure(), is dropped and the next best is used
+    - beacons on DISCOVERY_PORT are still accepted (servers without the
+      probe responder); those rank after servers with a measured RTT
+    - on_change(base) is called with "http://ip:port" (or None) when the
+      choice changes
+    """
+
+    def __init__(self, service: str = "Test-QMS", on_change=None, probe_interval: float = 5.0,
+                 probe_window: float = 0.3, fail_after: int = 2, rebalance_slack: int = 10):
+        self.service = service
+        self.on_change = on_change
+        self.probe_interval = probe_interval
+        self.probe_window = probe_window
+        self.fail_after = fail_after
+        self.rebalance_slack = rebalance_slack
+
+        self.base = None
+        self._servers = {}             # base -> {"rtt_ms", "load", "misses", "last_seen"}
+        self._order = {}               # base -> random tiebreak (fixed per client)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._found = threading.Event()
+        self._started = False
+        self._settled = False          # first full probe done (cold start took the first answer)
+
+    # ------------------ public ------------------
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+        threading.Thread(target=self._listen_beacons, daemon=True).start()
+
+    def wait(self, timeout: float | None = None) -> str | None:
+        """Blocks until a server is known (or timeout). Returns its base URL."""
+        self._found.wait(timeout)
+        return self.base
+
+    def report_failure(self, base: str | None):
+        """A request to base failed: mark it and probe again right away."""
+        if not base:
+            return
+        with self._lock:
+            info = self._servers.get(base)
+            if info is not None:
+                info["misses"] = max(info["misses"], self.fail_after)
+        self._choose()
+        self._wake.set()
+
+    def servers(self) -> list:
+        """[(base, info)] best first."""
+        with self._lock:
+            return sorted(((b, dict(i)) for b, i in self._servers.items()), key=lambda bi: self._rank(*bi))
+
+    # ------------------ probing ------------------
+
+    def _probe_loop(self):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                print("[DISCOVERY] probe failed:", e)
+            self._wake.wait(self.probe_interval)
+            self._wake.clear()
+
+    def probe(self):
+        probe_id = os.urandom(4).hex()
+        msg = json.dumps({"service": self.service, "probe": probe_id}).encode("utf-8")
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            t_sent = time.perf_counter()
+            for target in ("255.255.255.255", "127.0.0.1"):
+                try:
+                    sock.sendto(msg, (target, PROBE_PORT))
+                except OSError:
+                    pass
+
+            answered = set()
+            listed = {}                # base -> load, from cluster node lists
+            deadline = t_sent + self.probe_window
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data, _ = sock.recvfrom(2048)
+                except socket.timeout:
+                    break
+                rtt_ms = (time.perf_counter() - t_sent) * 1000.0
+                try:
+                    reply = json.loads(data.decode("utf-8"))
+                except Exception:
+                    continue
+                if reply.get("service") != self.service or reply.get("probe") != probe_id:
+                    continue
+
+                base = f"http://{reply['ip']}:{reply['port']}"
+                if base in answered:
+                    continue   # same server heard twice (broadcast + loopback)
+                answered.add(base)
+                self._seen(base, rtt_ms, reply.get("load"))
+                for node in reply.get("nodes") or ():
+                    listed[node["base"]] = node.get("load")
+                if self.base is None:
+                    self._choose()   # cold start: take the first answer, don't wait for the window
+        finally:
+            sock.close()
+
+        for base, load in listed.items():
+            if base not in answered:
+                self._seen(base, None, load)
+
+        with self._lock:
+            for base, info in self._servers.items():
+                if base not in answered and info["rtt_ms"] is not None:
+                    info["misses"] += 1
+        self._choose(rebalance=True, settle=not self._settled)
+        self._settled = True
+
+    def _listen_beacons(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("", DISCOVERY_PORT))
+        except OSError as e:
+            # another client on this PC owns the port; probes still work
+            print("[DISCOVERY] beacon port busy, probing only:", e)
+            return
+
+        while True:
+            try:
+                data, _ = sock.recvfrom(2048)
+                payload = json.loads(data.decode("utf-8"))
+                if payload.get("service") == self.service:
+                    self._seen(f"http://{payload['ip']}:{payload['port']}", None, None)
+                    if self.base is None:
+                        self._choose()
+            except Exception:
+                pass
+
+    # ------------------ ranking ------------------
+
+    def _seen(self, base: str, rtt_ms: float | None, load):
+        with self._lock:
+            info = self._servers.setdefault(base, {"rtt_ms": None, "load": None, "misses": 0, "last_seen": 0.0})
+            if rtt_ms is not None:
+                info["rtt_ms"] = rtt_ms if info["rtt_ms"] is None else 0.7 * info["rtt_ms"] + 0.3 * rtt_ms
+                info["misses"] = 0
+                info["load"] = load
+            elif info["rtt_ms"] is None:
+                info["misses"] = 0   # beacon-only / listed server is alive
+                if load is not None:
+                    info["load"] = load
+            info["last_seen"] = time.time()
+            self._order.setdefault(base, random.random())
+
+    def _rank(self, base, info):
+        near = int((info["rtt_ms"] or 0.0) // NEAR_MS)
+        return (info["rtt_ms"] is None, near, info["load"] or 0, self._order.get(base, 0.0))
+
+    def _choose(self, rebalance: bool = False, settle: bool = False):
+        with self._lock:
+            now = time.time()
+            alive = {
+                b: i for b, i in self._servers.items()
+                if i["misses"] < self.fail_after and (i["rtt_ms"] is not None or now - i["last_seen"] < BEACON_TTL)
+            }
+            current = self.base if self.base in alive else None
+            best = min(alive, key=lambda b: self._rank(b, alive[b])) if alive else None
+            if current is None or settle:
+                current = best
+            elif rebalance and best != current and self._should_move(alive[current], alive[best]):
+                current = best
+            changed = current != self.base
+            self.base = current
+
+        if current:
+            self._found.set()
+        if changed:
+            print(f"✅ Server selected: {current}" if current else "⚠️ No QMS server answering")
+            if self.on_change:
+                self.on_change(current)
+
+    def _should_move(self, cur, best) -> bool:
+        # only between equally near servers; the gap is shared out, so about
+        # half of the surplus moves per probe and the nodes even out
+        if cur["rtt_ms"] is None or best["rtt_ms"] is None:
+            return False
+        if int(cur["rtt_ms"] // NEAR_MS) != int(best["rtt_ms"] // NEAR_MS):
+            return False
+        gap = (cur["load"] or 0) - (best["load"] or 0)
+        if gap <= self.rebalance_slack:
+            return False
+        return random.random() < gap / (2.0 * (cur["load"] or 1))
@@ -0,0 +1,327 @@
+"""
+Central announcer: ONE process announces every stage of a department
+(reception, nursing, lab) instead of one poller + audio worker per app.
+
+    python announcer.py
+
+config.ini (next to this file):
+
+    [announcer]
+    dept = welfare
+    stages = reception, nursing, lab
+    wait_timeout = 25
+
+    ; optional: route stages to separate outputs
+    [zone:hall]
+    stages = reception
+    engine = sounddevice
+    device = Speakers (USB Audio)
+
+    [zone:clinic]
+    stages = nursing, lab
+    device = 3
+
+Without [zone:*] sections every stage plays on the [audio] output.
+It replaces Nursing/app and Lab/app; set [audio] announce = false on the
+reception kiosk so it doesn't speak as well.
+"""
+import configparser
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+import requests
+
+import audio
+from announce_cache import AnnouncementCache
+from announce_scheduler import AnnouncementScheduler
+from audio_engine import AudioEngine, make_sink
+from latency import LatencyRecorder, call_order
+from server_locator import ServerLocator
+from resilience import Backoff, CircuitBreaker, LastKnownState
+
+SERVER_BASE = None
+
+
+# ===================== CONFIG =====================
+cfg = configparser.ConfigParser()
+cfg.read(os.path.join(audio.app_dir(), "config.ini"))
+
+USE_TTS = cfg.getboolean("audio", "use_tts", fallback=True)
+DEPT = cfg.get("announcer", "dept", fallback="welfare")
+STAGES = [s.strip() for s in cfg.get("announcer", "stages", fallback="reception,nursing,lab").split(",") if s.strip()]
+# /api/status/all/wait parks the request until a stage changes (or this many seconds)
+WAIT_TIMEOUT = cfg.getfloat("announcer", "wait_timeout", fallback=25)
+
+LATENCY = LatencyRecorder()
+LATENCY_PATH = cfg.get("latency", "export_path", fallback=os.path.join(audio.app_dir(), "latency.json"))
+
+# unreachable server: jittered backoff + circuit breaker; per-stage dedupe state kept on disk
+BREAKER = CircuitBreaker(
+    "SERVER",
+    failure_threshold=cfg.getint("network", "failure_threshold", fallback=3),
+    backoff=Backoff(cap=cfg.getfloat("network", "backoff_cap", fallback=15.0)),
+)
+STATE = LastKnownState(
+    cfg.get("state", "path", fallback=os.path.join(audio.app_dir(), "announcer_state.json")),
+    max_age_s=cfg.getfloat("state", "max_age_seconds", fallback=300),
+)
+
+
+# ===================== DISCOVERY =====================
+def _on_server(base):
+    global SERVER_BASE
+    SERVER_BASE = base
+
+
+LOCATOR = ServerLocator(
+    service=cfg.get("discovery", "service", fallback="Test-QMS"),
+    on_change=_on_server,
+    probe_interval=cfg.getfloat("discovery", "probe_interval", fallback=5.0),
+)
+
+
+# ===================== STAGE STATE =====================
+class StageTracker:
+    """
+    Dedupe state of one stage: what each counter last announced and the last
+    recall seq seen. The first status only syncs (no burst of old calls on start).
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.last_announced = {}
+        self.last_recall_seq = 0
+        self._bootstrapped = False
+
+    def restore(self, saved: dict | None):
+        """Continue from a saved state (LastKnownState entry) instead of bootstrapping."""
+        if not saved:
+            return
+        self.last_announced = dict(saved.get("announced") or {})
+        self.last_recall_seq = saved.get("recall_seq", 0)
+        self._bootstrapped = True
+
+    def _recall_fields(self):
+        # nursing/lab recalls have one seq per stage on the server; each stage's
+        # status carries its own seq in the nursing_recall_* fields
+        if self.stage in ("nursing", "lab"):
+            return "nursing_recall_seq", "nursing_recall_counter"
+        return "recall_seq", "recall_counter"
+
+    def changes(self, status: dict) -> list:
+        """[(counter, token, recall)] to announce for this status, calls in server order."""
+        serving = status.get("serving", {}) or {}
+        seq_key, counter_key = self._recall_fields()
+        recall_seq = status.get(seq_key, 0) or 0
+
+        if not self._bootstrapped:
+            self.last_recall_seq = recall_seq
+            self.last_announced = {c: t for c, t in serving.items() if t}
+            self._bootstrapped = True
+            return []
+
+        out = []
+        changed = [c for c, t in serving.items() if t and self.last_announced.get(c) != t]
+        for counter in sorted(changed, key=lambda c: call_order(status, c)):
+            self.last_announced[counter] = serving[counter]
+            out.append((counter, serving[counter], False))
+
+        if recall_seq != self.last_recall_seq:
+            self.last_recall_seq = recall_seq
+            rc = status.get(counter_key)
+            # only a counter that is serving in this stage has something to repeat
+            if rc and serving.get(rc):
+                out.append((rc, serving[rc], True))
+
+        return out
+
+
+# ===================== ZONES =====================
+class Zone:
+    """One audio output with its own engine, announcement queue and worker."""
+
+    def __init__(self, name: str, engine: str = "auto", device=None, sink_path: str = ""):
+        self.name = name
+        self.queue = AnnouncementScheduler(max_age_s=audio.ANNOUNCE_MAX_AGE_S)
+        self.engine = None
+        self.cache = None
+
+        sink = make_sink(engine, sink_path, device)
+        if sink is not None:
+            self.engine = AudioEngine(sink)
+            self.engine.clips.preload(glob.glob(os.path.join(audio.AUDIO_DIR, "*.wav")))
+            self.cache = AnnouncementCache(
+                self.engine.clips,
+                os.path.join(audio.app_dir(), "announce_cache", name),
+                mem_limit_bytes=audio.ANNOUNCE_CACHE_MEM_MB * 1024 * 1024,
+                disk_limit_bytes=audio.ANNOUNCE_CACHE_DISK_MB * 1024 * 1024,
+            )
+            print(f"[AUDIO] zone {name}: {sink.name}" + (f" (device {device})" if device is not None else ""))
+        else:
+            print(f"[AUDIO] zone {name}: legacy player (device routing not available)")
+
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def announce(self, token_no: int, counter: str, recall: bool = False, on_start=None):
+        name = f"{token_no}@{counter}"
+        parts = audio._announcement_parts(USE_TTS, token_no, counter)
+        self.queue.put((parts, name, time.monotonic(), on_start), key=counter, recall=recall, name=name)
+
+    def stats(self) -> dict:
+        stats = self.engine.stats() if self.engine is not None else {}
+        stats["queue"] = self.queue.stats()
+        return stats
+
+    def _worker(self):
+        while True:
+            parts, name, call_t0, on_start = self.queue.get()
+            try:
+                self._play(parts, name, call_t0, on_start)
+            except Exception as e:
+                print(f"[AUDIO-ERROR] zone {self.name}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _play(self, parts, name, call_t0, on_start=None):
+        if self.engine is None:
+            # legacy player plays on the default output
+            for i, part in enumerate(parts):
+                if isinstance(part, tuple) and part[0] == "TTS":
+                    audio._tts_blocking(part[1])
+                else:
+                    audio._play(part, on_start=on_start if i == 0 else None)
+            return
+
+        if all(audio._is_renderable(p) for p in parts):
+            clip = self.cache.get(parts, name)
+            if clip is not None:
+                self.engine.play(clip, call_t0=call_t0, on_start=on_start)
+                self.engine.wait_idle()
+                return
+
+        for i, part in enumerate(parts):
+            if isinstance(part, tuple) and part[0] == "TTS":
+                self.engine.wait_idle()
+                audio._tts_blocking(part[1])
+            else:
+                self.engine.play(part, call_t0=call_t0 if i == 0 else None, on_start=on_start if i == 0 else None)
+        self.engine.wait_idle()
+
+
+def _device(value: str):
+    value = (value or "").strip()
+    if not value:
+        return None
+    return int(value) if value.isdigit() else value
+
+
+def build_zones() -> dict:
+    """stage -> Zone, from the [zone:*] sections (default: one zone for everything)."""
+    default_engine = cfg.get("audio", "engine", fallback="auto")
+    routes = {}
+
+    for section in cfg.sections():
+        if not section.startswith("zone:"):
+            continue
+        zone = Zone(
+            section.split(":", 1)[1],
+            engine=cfg.get(section, "engine", fallback=default_engine),
+            device=_device(cfg.get(section, "device", fallback="")),
+            sink_path=cfg.get(section, "sink_path", fallback=""),
+        )
+        for stage in cfg.get(section, "stages", fallback="").split(","):
+            if stage.strip():
+                routes[stage.strip()] = zone
+
+    missing = [s for s in STAGES if s not in routes]
+    if missing:
+        zone = Zone(
+            "main",
+            engine=default_engine,
+            device=_device(cfg.get("audio", "device", fallback="")),
+            sink_path=cfg.get("audio", "sink_path", fallback=""),
+        )
+        for stage in missing:
+            routes[stage] = zone
+
+    return routes
+
+
+def _zone_metrics(routes: dict) -> dict:
+    """Queue depth/lag + engine latency per zone for the latency export, one [AUDIO] line each."""
+    zones = {}
+    for zone in routes.values():
+        if zone.name not in zones:
+            zones[zone.name] = zone.stats()
+            audio.log_queue_stats(zones[zone.name]["queue"], zone=zone.name)
+    return {"zones": zones}
+
+
+# ===================== POLLER =====================
+def run():
+    routes = build_zones()
+    trackers = {s: StageTracker(s) for s in STAGES}
+    for stage, tracker in trackers.items():
+        tracker.restore(STATE.load(stage))
+    session = requests.Session()
+    version = None
+    if USE_TTS:
+        audio.warm_tts_cache()
+    LATENCY.start_autoexport(LATENCY_PATH, extra=lambda: _zone_metrics(routes))
+    warmed = set()   # counters whose spoken name ("Lab 1") is being cached
+
+    while True:
+        if not SERVER_BASE:
+            time.sleep(0.5)
+            continue
+        if not BREAKER.allow():
+            time.sleep(BREAKER.wait_time())
+            continue
+
+        try:
+            # ONE request for every stage, answered when one of them changes
+            t_send = time.time()
+            data = session.get(
+                f"{SERVER_BASE}/api/status/all/wait",
+                params={"dept": DEPT, "stages": ",".join(STAGES), "since": version, "timeout": WAIT_TIMEOUT},
+                timeout=WAIT_TIMEOUT + 5
+            ).json()
+            t_recv = time.time()
+            version = data.get("version")
+            BREAKER.success()
+            # parked time is server-side, not round trip
+            t_sent = t_send + float(data.get("waited_ms") or 0) / 1000.0
+
+            for stage, status in (data.get("stages") or {}).items():
+                tracker = trackers.get(stage)
+                if tracker is None:
+                    continue
+                LATENCY.clock(status, t_sent, t_recv)
+                new = set(status.get("serving") or {}) - warmed
+                if new and USE_TTS:
+                    warmed |= new
+                    audio.warm_tts_cache(counters=sorted(new))
+                for counter, token, recall in tracker.changes(status):
+                    print(f"{'🔁' if recall else '🔊'} {stage}: {counter} -> {token}")
+                    on_start = None if recall else LATENCY.on_call(stage, counter, status, t_recv)
+                    routes[stage].announce(token, counter, recall=recall, on_start=on_start)
+                STATE.save(stage, status=status, announced=tracker.last_announced, recall_seq=tracker.last_recall_seq)
+
+        except Exception as e:
+            print("❌ Announcer poll error:", e)
+            BREAKER.failure()
+            LOCATOR.report_failure(SERVER_BASE)
+            version = None
+
+
+def main():
+    LOCATOR.start()
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import sys
 import threading
 import configparser
-import requests
 import os
 import socket
 import json
+import uuid
+import time
 
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QPixmap
@@ -14,12 +15,17 @@ from PyQt5.QtWidgets import (
 )
 
 
-from printing import print_token
-from audio import announce_token
+from printing import print_token, init_printer
+from audio import announce_token, audio_metrics, init_audio_engine, warm_tts_cache
+from leasing import TokenLeaser
+from latency import LatencyRecorder, call_order
+from spooler import PrintSpooler, FAILED, ISSUING, PRINTED, PRINTING, QUEUED, RETRYING
+from kiosk_net import KioskNet
+from server_locator import ServerLocator
+from resilience import Backoff, CircuitBreaker, LastKnownState
 
 # ===================== DISCOVERY =====================
 
-DISCOVERY_PORT = 9999
 SERVER_BASE = None   # filled dynamically
 
 import socket
@@ -32,28 +38,10 @@ def is_local_server_running(port=8032):
     except:
         return False
 
-def listen_for_server():
+def _on_server(base):
+    # ServerLocator picked a (new) server, or None when nothing answers
     global SERVER_BASE
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("", DISCOVERY_PORT))
-
-    while True:
-        data, _ = sock.recvfrom(2048)
-        try:
-            payload = json.loads(data.decode())
-            if payload.get("service") == "Test-QMS":
-                ip = payload["ip"]
-                port = payload["port"]
-                new_base = f"http://{ip}:{port}"
-
-                global SERVER_BASE, SERVER_ONLINE
-                if SERVER_BASE != new_base:
-                    SERVER_BASE = new_base
-                    SERVER_ONLINE = True
-                    print(f"✅ Server discovered: {SERVER_BASE}")
-
-        except Exception:
-            pass
+    SERVER_BASE = base
 
 
 # ===================== CONFIG =====================
@@ -68,7 +56,91 @@ cfg = configparser.ConfigParser()
 cfg.read(os.path.join(app_dir(), "config.ini"))
 
 PRINTER_NAME = cfg.get("printer", "name", fallback="")
+PRINTER_BACKEND = cfg.get("printer", "backend", fallback="system")   # system | escpos
+PRINTER_TARGET = cfg.get("printer", "target", fallback="")          # tcp://ip:9100 | file:/path | /dev/usb/lp0
+PRINTER_WIDTH_DOTS = cfg.getint("printer", "width_dots", fallback=576)
+PRINTER_THRESHOLD = cfg.getint("printer", "threshold", fallback=160)
+PRINTER_DITHER = cfg.getboolean("printer", "dither", fallback=False)
 USE_TTS = cfg.getboolean("audio", "use_tts", fallback=True)
+AUDIO_ENGINE = cfg.get("audio", "engine", fallback="auto")        # auto | sounddevice | winsound | file | null | legacy
+AUDIO_SINK_PATH = cfg.get("audio", "sink_path", fallback="")      # for engine = file
+AUDIO_DEVICE = cfg.get("audio", "device", fallback="") or None
+ANNOUNCE = cfg.getboolean("audio", "announce", fallback=True)      # false → announcer.py speaks instead
+
+# call → announcement latency histogram, exported as JSON (python latency.py latency.json)
+LATENCY = LatencyRecorder()
+LATENCY_PATH = cfg.get("latency", "export_path", fallback=os.path.join(app_dir(), "latency.json"))
+
+# probe/response discovery: fastest answering server, failover when it stops
+LOCATOR = ServerLocator(
+    service=cfg.get("discovery", "service", fallback="Test-QMS"),
+    on_change=_on_server,
+    probe_interval=cfg.getfloat("discovery", "probe_interval", fallback=5.0),
+)
+
+# unreachable server: jittered backoff + circuit breaker; last state kept on disk
+BREAKER = CircuitBreaker(
+    "SERVER",
+    failure_threshold=cfg.getint("network", "failure_threshold", fallback=3),
+    backoff=Backoff(cap=cfg.getfloat("network", "backoff_cap", fallback=15.0)),
+)
+STATE = LastKnownState(
+    cfg.get("state", "path", fallback=os.path.join(app_dir(), "last_state.json")),
+    max_age_s=cfg.getfloat("state", "max_age_seconds", fallback=300),
+)
+
+# Short timeout + retries are safe: the server dedupes by Idempotency-Key
+PRINT_TIMEOUT = cfg.getfloat("network", "print_timeout", fallback=1.0)
+PRINT_RETRIES = cfg.getint("network", "print_retries", fallback=4)
+
+# Token leasing: print from a locally held block of numbers (no server round trip)
+USE_LEASES = cfg.getboolean("lease", "enabled", fallback=True)
+LEASE_BLOCK_SIZE = cfg.getint("lease", "block_size", fallback=5)
+KIOSK_ID = cfg.get("kiosk", "id", fallback=socket.gethostname())
+# issued-but-unreported leased tokens survive a restart here
+LEASE_JOURNAL = cfg.get("lease", "journal_path", fallback=os.path.join(app_dir(), "lease_journal.json"))
+
+# QR on the ticket → /t/{token} status page on the patient's phone
+TICKET_QR = cfg.getboolean("ticket", "qr", fallback=True)
+QR_BASE_URL = cfg.get("ticket", "qr_base_url", fallback="")   # default: discovered server
+
+def _lan_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # doesn't need to be reachable; just used to pick correct interface
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+    except Exception:
+        return "127.0.0.1"
+    finally:
+        s.close()
+
+def ticket_url(token_no: int) -> str | None:
+    if not TICKET_QR:
+        return None
+    base = QR_BASE_URL or SERVER_BASE
+    if not base:
+        return None
+    # a phone can't reach 127.0.0.1 → use this PC's LAN address
+    base = base.replace("127.0.0.1", _lan_ip()).replace("localhost", _lan_ip())
+    return f"{base.rstrip('/')}/t/{token_no}"
+
+# Background print spooler (jobs survive a restart via spool.json)
+SPOOL_PATH = cfg.get("spool", "path", fallback=os.path.join(app_dir(), "spool.json"))
+SPOOL_MAX_JOBS = cfg.getint("spool", "max_jobs", fallback=20)
+SPOOL_PRINT_RETRIES = cfg.getint("spool", "print_retries", fallback=3)
+
+# what the patient sees while their ticket is on its way (job status → text)
+PRINT_MESSAGES = {
+    QUEUED: "Getting your token…\nٹوکن حاصل کیا جا رہا ہے…",
+    ISSUING: "Getting your token…\nٹوکن حاصل کیا جا رہا ہے…",
+    PRINTING: "Printing token {token}…\nٹوکن {token} پرنٹ ہو رہا ہے…",
+    RETRYING: "Please wait, trying again…\nبراہ کرم انتظار کریں…",
+}
+PRINT_FAILED_MESSAGE = "Could not print. Please ask at reception.\nپرنٹ نہیں ہو سکا، استقبالیہ سے رابطہ کریں۔"
+NO_SERVER_MESSAGE = "Connecting to the server, please try again shortly.\nسرور سے رابطہ ہو رہا ہے، تھوڑی دیر بعد کوشش کریں۔"
+QUEUE_FULL_MESSAGE = "Busy, please try again in a moment.\nتھوڑی دیر بعد دوبارہ کوشش کریں۔"
+NOTICE_MS = 8000
 
 GREEN = "#16a34a"
 GREEN_DARK = "#0f7a35"
@@ -85,8 +157,44 @@ class TabletUI(QWidget):
         self.setStyleSheet("background: white;")
         self.last_announced = {}      # per-counter
         self.last_recall_seq = 0      # stable baseline
+
+        # restarted within a few minutes → dedupe against what we already announced
+        saved = STATE.load("reception")
+        if saved and ANNOUNCE:
+            self.last_announced = dict(saved.get("announced") or {})
+            self.last_recall_seq = saved.get("recall_seq", 0)
+            self._bootstrapped = True
         self._mode = "choose_service"  # or "doctor_appointment"
 
+        # all HTTP runs off the UI thread, over one keep-alive session
+        self.net = KioskNet(lambda: SERVER_BASE, dept="welfare", breaker=BREAKER)
+        self.net.statusReady.connect(self._on_status)
+        self.net.statusFailed.connect(self._on_status_failed)
+        self.net.start()
+
+        self.leaser = None
+        if USE_LEASES:
+            self.leaser = TokenLeaser(
+                lambda: SERVER_BASE,
+                dept="welfare",
+                kiosk_id=KIOSK_ID,
+                block_size=LEASE_BLOCK_SIZE,
+                session=self.net.session,
+                journal_path=LEASE_JOURNAL
+            )
+            self.leaser.start()
+
+        self.spooler = PrintSpooler(
+            issue=self._issue_token,
+            print_ticket=lambda token_no: print_token(PRINTER_NAME, token_no, "welfare", qr_url=ticket_url(token_no)),
+            spool_path=SPOOL_PATH,
+            max_jobs=SPOOL_MAX_JOBS,
+            print_retries=SPOOL_PRINT_RETRIES
+        )
+        self._print_job = None   # job the screen is waiting for
+        self.spooler.jobStatus.connect(self._on_print_status)
+        self.spooler.start()
+
         root = QVBoxLayout(self)
         root.setContentsMargins(0, 0, 0, 0)
 
@@ -228,10 +336,10 @@ class TabletUI(QWidget):
         # Show main window full-screen
         self.showFullScreen()
 
-        # ---- polling for audio ----
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.poll_audio)
-        self.timer.start(1500)
+        # ---- audio: long-poll /api/status/wait, answered in _on_status ----
+        if ANNOUNCE:
+            self.net.watch_status()
+            LATENCY.start_autoexport(LATENCY_PATH, extra=audio_metrics)
     # ===================== PRINT =====================
     # Inline doctor/lab and appointment flow
     def _set_printing_state(self, printing: bool):
@@ -240,6 +348,7 @@ class TabletUI(QWidget):
             self.labBtn.setEnabled(False)
             self.printBtn.setEnabled(False)
             self.printBtn.setText("PRINTING…\nپرنٹ ہو رہا ہے…")
+            self.sub.setText(PRINT_MESSAGES[QUEUED])
         else:
             # Reset to initial doctor/lab view
             self._mode = "choose_service"
@@ -287,29 +396,85 @@ class TabletUI(QWidget):
             self.labBtn.clicked.connect(self._print_lab)
 
     def _do_print(self, visit_type: str):
-        if not SERVER_BASE:
+        # a leased number prints without the server; otherwise it has to be found first
+        if not SERVER_BASE and not (self.leaser and self.leaser.remaining(visit_type) > 0):
             print("❌ Server not discovered yet")
+            self._set_printing_state(False)
+            self._show_notice(NO_SERVER_MESSAGE)
             return
 
-        self._set_printing_state(True)
-
-        try:
-            r = requests.post(
-                f"{SERVER_BASE}/api/print-token",
-                json={"dept": "welfare", "visit_type": visit_type},
-                timeout=3
-            )
-            data = r.json()
-            token_no = data.get("token_no")
-
-            if token_no:
-                print_token(PRINTER_NAME, token_no, "welfare")
+        # token + printing happen on the spooler thread; the UI follows its jobStatus
+        job_id = self.spooler.submit(visit_type)
+        if job_id is None:
+            print("❌ Print queue full")
+            self._set_printing_state(False)
+            self._show_notice(QUEUE_FULL_MESSAGE)
+            return
 
-        except Exception as e:
-            print("Print failed:", e)
+        self._print_job = job_id
+        self._set_printing_state(True)
 
-        finally:
-            QTimer.singleShot(1200, lambda: self._set_printing_state(False))
+    def _on_print_status(self, job_id: str, status: str, token_no: int):
+        if status == PRINTED:
+            print(f"🖨️ Printed token {token_no}")
+        elif status == FAILED:
+            print(f"❌ Print failed (job {job_id}, token {token_no or '-'})")
+
+        if job_id != self._print_job:
+            return   # resumed from the last run, nobody is waiting at the screen
+
+        if status in (PRINTED, FAILED):
+            self._print_job = None
+            self._set_printing_state(False)
+            if status == FAILED:
+                self._show_notice(PRINT_FAILED_MESSAGE)
+        elif status in PRINT_MESSAGES:
+            self.sub.setText(PRINT_MESSAGES[status].format(token=token_no))
+
+    def _show_notice(self, text: str):
+        """Message on the start screen, back to the usual prompt after NOTICE_MS unless the screen moved on."""
+        self.sub.setText(text)
+
+        def _restore():
+            if self._mode == "choose_service" and self._print_job is None and self.sub.text() == text:
+                self.sub.setText("Tap to select service")
+
+        QTimer.singleShot(NOTICE_MS, _restore)
+
+    def _issue_token(self, visit_type: str, key: str) -> int | None:
+        """Runs on the spooler thread. key is the job's Idempotency-Key."""
+        # Leased number → no server round trip, the leaser reports it in the background
+        token_no = self.leaser.take(visit_type) if self.leaser else None
+        if token_no is None:
+            if not SERVER_BASE:
+                raise RuntimeError("no leased number left and no server found")
+            token_no = self._post_print_token(visit_type, key).get("token_no")
+        return token_no
+
+    def _post_print_token(self, visit_type: str, key: str | None = None) -> dict:
+        """
+        POST /api/print-token with short timeouts and retries.
+        The same Idempotency-Key is sent on every attempt, so a retry after a
+        slow/lost response returns the token the server already issued.
+        """
+        key = key or uuid.uuid4().hex
+        last_error = None
+
+        for attempt in range(PRINT_RETRIES):
+            try:
+                r = self.net.session.post(
+                    f"{SERVER_BASE}/api/print-token",
+                    json={"dept": "welfare", "visit_type": visit_type},
+                    headers={"Idempotency-Key": key},
+                    timeout=PRINT_TIMEOUT
+                )
+                r.raise_for_status()
+                return r.json()
+            except Exception as e:
+                last_error = e
+                print(f"print-token attempt {attempt + 1} failed:", e)
+
+        raise last_error
 
     def _start_doctor_flow(self):
         """Switch UI to ask appointment question for doctor, inline."""
@@ -344,13 +509,13 @@ class TabletUI(QWidget):
         # Directly print as walk-in (no extra UI)
         self._do_print("lab")
 
-    def poll_audio(self):
-        if not SERVER_BASE:
-            return
+    def _on_status_failed(self, err: str):
+        print("poll_audio error:", err)
+        LOCATOR.report_failure(SERVER_BASE)   # next best server, if there is one
 
+    def _on_status(self, data: dict, t_send: float, t_recv: float):
         try:
-            r = requests.get(f"{SERVER_BASE}/api/status?dept=welfare", timeout=2)
-            data = r.json()
+            LATENCY.clock(data, t_send, t_recv)
 
             recall_seq = data.get("recall_seq", 0)
             serving = data.get("serving", {})
@@ -362,18 +527,19 @@ class TabletUI(QWidget):
                     if token:
                         self.last_announced[counter] = token
                 self._bootstrapped = True
+                self._remember(data)
                 return
 
-            # ---------- 1️⃣ NEXT TOKEN ----------
-            for counter, token in serving.items():
-                if not token:
-                    continue
+            # ---------- 1️⃣ NEXT TOKEN (every counter that changed, in call order) ----------
+            changed = [
+                (counter, token) for counter, token in serving.items()
+                if token and token != self.last_announced.get(counter)
+            ]
+            changed.sort(key=lambda ct: call_order(data, ct[0]))
 
-                last = self.last_announced.get(counter)
-                if token != last:
-                    self.last_announced[counter] = token
-                    announce_token(USE_TTS, token, counter)
-                    return
+            for counter, token in changed:
+                self.last_announced[counter] = token
+                announce_token(USE_TTS, token, counter, on_start=LATENCY.on_call("reception", counter, data, t_recv))
 
             # ---------- 2️⃣ RECALL ----------
             if recall_seq != self.last_recall_seq:
@@ -383,25 +549,48 @@ class TabletUI(QWidget):
                 if recall_counter:
                     token = serving.get(recall_counter)
                     if token:
-                        announce_token(USE_TTS, token, recall_counter)
-
-                return
+                        announce_token(USE_TTS, token, recall_counter, recall=True)
 
+            self._remember(data)
 
         except Exception as e:
             print("poll_audio error:", e)
 
-if __name__ == "__main__":
+    def _remember(self, data: dict):
+        STATE.save("reception", status=data, announced=self.last_announced, recall_seq=self.last_recall_seq)
+
+def main():
+    global SERVER_BASE
+
+    # devices + TTS warm-up only when running as the kiosk, not on import
+    init_printer(
+        PRINTER_BACKEND,
+        target=PRINTER_TARGET,
+        width_dots=PRINTER_WIDTH_DOTS,
+        threshold=PRINTER_THRESHOLD,
+        dither=PRINTER_DITHER,
+    )
+    init_audio_engine(AUDIO_ENGINE, AUDIO_SINK_PATH, AUDIO_DEVICE)
+    if USE_TTS and ANNOUNCE:
+        warm_tts_cache()   # digit words → tts_cache/ before the first call
+
     # ✅ 1) Try localhost first (same PC)
     if is_local_server_running(8032):
         SERVER_BASE = "http://127.0.0.1:8032"
         print("✅ Local server detected directly:", SERVER_BASE)
-    else:
-        # ✅ 2) If not local, then listen for UDP discovery (tablets / other PCs)
-        threading.Thread(target=listen_for_server, daemon=True).start()
+
+    # ✅ 2) Probe the LAN either way (answers arrive in one round trip); the
+    #       locator also moves us to another server if this one stops answering
+    LOCATOR.start()
+    if not SERVER_BASE:
+        LOCATOR.wait(1.0)
 
     app = QApplication(sys.argv)
     app.setFont(QFont("Segoe UI", 10))
     w = TabletUI()
     w.show()
     sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
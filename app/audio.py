@@ -1,9 +1,18 @@
 import subprocess
 import threading
-import queue
 import os
 import sys
 import re
+import glob
+import time
+import hashlib
+import tempfile
+
+from audio_engine import AudioEngine, Clip, make_sink
+from announce_cache import AnnouncementCache
+from announce_scheduler import AnnouncementScheduler
+from digit_announcer import DigitAnnouncer
+from tts_cache import TTSCache
 
 IS_WINDOWS = sys.platform.startswith("win")
 IS_MAC = sys.platform == "darwin"
@@ -15,10 +24,21 @@ except Exception:
     win32com = None
 
 
-_audio_q = queue.Queue()
+# Calls older than this are dropped instead of read out late
+ANNOUNCE_MAX_AGE_S = 20
+_audio_q = AnnouncementScheduler(max_age_s=ANNOUNCE_MAX_AGE_S)
 _worker_started = False
 _worker_lock = threading.Lock()
 
+# In-process engine (decoded clips + one open output). None → legacy per-clip player.
+_engine = None
+_engine_cfg = {"kind": "auto", "sink_path": "", "device": None}
+
+# Pre-mixed (ding + token + counter) announcements, memory + disk LRU
+_announce_cache = None
+ANNOUNCE_CACHE_MEM_MB = 32
+ANNOUNCE_CACHE_DISK_MB = 256
+
 _DIGITS = {
     "0": "zero", "1": "one", "2": "two", "3": "three", "4": "four",
     "5": "five", "6": "six", "7": "seven", "8": "eight", "9": "nine",
@@ -143,19 +163,109 @@ def _play_audio_blocking(path: str):
     # -------- Fallback --------
     print("[AUDIO]", p)
 
+def init_audio_engine(kind: str = "auto", sink_path: str = "", device=None):
+    """
+    Selects the playback backend before the first announcement:
+    auto | sounddevice | winsound | file | null | legacy
+    """
+    _engine_cfg.update(kind=kind, sink_path=sink_path, device=device)
+
+def _play(path, call_t0: float | None = None, on_start=None):
+    if _engine is not None:
+        _engine.play(path, call_t0=call_t0, on_start=on_start)   # non-blocking, back-to-back from memory
+        return
+
+    if isinstance(path, Clip):
+        # legacy player needs a file on disk
+        clip_path = os.path.join(tempfile.gettempdir(), f"qms_{hashlib.sha1(path.pcm).hexdigest()}.wav")
+        if not os.path.exists(clip_path):
+            with open(clip_path, "wb") as f:
+                f.write(path.to_wav_bytes())
+        path = clip_path
+    if on_start:
+        on_start(time.monotonic())
+    _play_audio_blocking(path)
+
+def _play_announcement(parts: list, name: str, call_t0: float, on_start=None):
+    # No live TTS part → play ONE pre-mixed clip (cached for recalls)
+    if _announce_cache is not None and all(_is_renderable(p) for p in parts):
+        clip = _announce_cache.get(parts, name)
+        if clip is not None:
+            _engine.play(clip, call_t0=call_t0, on_start=on_start)
+            return
+
+    # Otherwise part by part (live TTS / legacy player)
+    for i, part in enumerate(parts):
+        if isinstance(part, tuple) and part[0] == "TTS":
+            # keep order: let queued clips finish before speaking
+            if _engine is not None:
+                _engine.wait_idle()
+            _tts_blocking(part[1])
+        else:
+            # first clip of an announcement → measures call-to-sound latency
+            _play(part, call_t0=call_t0 if i == 0 else None, on_start=on_start if i == 0 else None)
+
+def _is_renderable(part) -> bool:
+    return isinstance(part, (str, Clip))
+
 def _audio_worker():
+    global _engine, _announce_cache
+    try:
+        sink = make_sink(_engine_cfg["kind"], _engine_cfg["sink_path"], _engine_cfg["device"])
+        if sink is not None:
+            _engine = AudioEngine(sink)
+            # decode every asset once, up front
+            _engine.clips.preload(glob.glob(os.path.join(AUDIO_DIR, "*.wav")))
+            _digit_announcer.preload()
+            _announce_cache = AnnouncementCache(
+                _engine.clips,
+                os.path.join(app_dir(), "announce_cache"),
+                mem_limit_bytes=ANNOUNCE_CACHE_MEM_MB * 1024 * 1024,
+                disk_limit_bytes=ANNOUNCE_CACHE_DISK_MB * 1024 * 1024,
+            )
+            print(f"[AUDIO] engine ready ({sink.name})")
+    except Exception as e:
+        print(f"[AUDIO] engine unavailable, using legacy player: {e}")
+        _engine = None
+        _announce_cache = None
+
     while True:
         item = _audio_q.get()
         try:
-            if isinstance(item, tuple) and item[0] == "TTS":
+            if isinstance(item, tuple) and item[0] == "ANNOUNCE":
+                _play_announcement(item[1], item[2], item[3], item[4])
+            elif isinstance(item, tuple) and item[0] == "TTS":
+                if _engine is not None:
+                    _engine.wait_idle()
                 _tts_blocking(item[1])
             else:
-                _play_audio_blocking(item)
+                _play(item)
+
+            # keep the backlog in the scheduler (where it can be merged), not in the engine
+            if _engine is not None:
+                _engine.wait_idle()
         except Exception as e:
             print(f"[AUDIO-ERROR] {e}")
         finally:
             _audio_q.task_done()
 
+def audio_stats() -> dict:
+    """Call-to-sound latency of the in-process engine + announcement queue depth/lag."""
+    stats = _engine.stats() if _engine is not None else {}
+    stats["queue"] = _audio_q.stats()
+    return stats
+
+def log_queue_stats(q: dict, zone: str | None = None):
+    where = f" zone={zone}" if zone else ""
+    print(f"[AUDIO]{where} queue depth={q['depth']} lag_ms={q['lag_ms']} max_wait_ms={q['max_wait_ms']} "
+          f"served={q['served']} merged={q['merged']} expired={q['expired']}")
+
+def audio_metrics() -> dict:
+    """audio_stats() as a section of the latency export, also logged as one [AUDIO] line."""
+    stats = audio_stats()
+    log_queue_stats(stats["queue"])
+    return {"audio": stats}
+
 def _start_worker_once():
     global _worker_started
     with _worker_lock:
@@ -177,52 +287,87 @@ COUNTER2_WAV = os.path.join(AUDIO_DIR, "Counter2.wav")
 COUNTER3_WAV = os.path.join(AUDIO_DIR, "Counter3.wav")
 COUNTER4_WAV = os.path.join(AUDIO_DIR, "Counter4.wav")
 NURSING_WAV = os.path.join(AUDIO_DIR, "Nursing.wav")
-
-TOKEN_START = 1001
-TOKEN_END   = 1090
-
-def _wrap_system_token(n: int) -> int:
-    if n > TOKEN_END:
-        return TOKEN_START
-    if n < TOKEN_START:
-        return TOKEN_START
-    return n
-
-def _pick_counter_audio(counter: str) -> str:
+LAB_WAV = os.path.join(AUDIO_DIR, "Lab.wav")    # optional recording; without it "Lab 1" is spoken
+_COUNTER_WAVS = {1: COUNTER1_WAV, 2: COUNTER2_WAV, 3: COUNTER3_WAV, 4: COUNTER4_WAV}
+
+# Any token number is spoken from the recorded digits 0.wav – 9.wav
+_digit_announcer = DigitAnnouncer(AUDIO_DIR)
+
+# use_tts: phrases are synthesized once into tts_cache/ and played from there;
+# digits come from the cached digit words, assembled like the recordings.
+_tts_cache = TTSCache(os.path.join(app_dir(), "tts_cache"))
+_tts_digits = DigitAnnouncer(AUDIO_DIR, digit_path=lambda d: _tts_cache.cached(_DIGITS[d]))
+
+def _counter_phrase(counter: str) -> str:
+    # "Counter3" → "Counter 3"
+    return re.sub(r"(\D+)(\d+)", r"\1 \2", (counter or "").strip())
+
+def warm_tts_cache(counters=()):
+    """
+    Renders the phrases live announcements need (digit words + counter names)
+    in the background, so no TTS runs while a token is being called.
+    Digit words cover every token range (appointment, walk-in, lab).
+    """
+    phrases = list(_DIGITS.values()) + [_counter_phrase(c) for c in counters]
+    threading.Thread(target=_tts_cache.warm, args=(phrases,), daemon=True).start()
+
+def _pick_counter_audio(counter: str) -> str | None:
+    """
+    Recording for the counter, or None when there is none (the counter's
+    name is spoken instead). Only reception counters map to CounterN.wav;
+    "Lab1" must never come out as "Counter 1".
+    """
     c = (counter or "").strip().lower()
     if "nursing" in c or "nurse" in c:
         return NURSING_WAV
-    if "1" in c:
-        return COUNTER1_WAV
-    if "2" in c:
-        return COUNTER2_WAV
-    if "3" in c:
-        return COUNTER3_WAV
-    if "4" in c:
-        return COUNTER4_WAV
+    if c.startswith("lab"):
+        return LAB_WAV
+    m = re.fullmatch(r"counter\s*(\d+)", c)
+    if m:
+        return _COUNTER_WAVS.get(int(m.group(1)))
+    return None
 
-    return COUNTER1_WAV  # safe default
 
+def _announcement_parts(use_tts: bool, token_no: int, counter: str) -> list:
+    """Ordered pieces of one announcement: WAV paths, Clips and ("TTS", text) items."""
+    counter_audio = _pick_counter_audio(counter)
 
-def announce_token(use_tts: bool, token_no: int, counter: str):
-    _start_worker_once()
+    if use_tts:
+        # ding + "Token Number" + cached TTS digits + counter
+        digits = _tts_digits.token_clip(int(token_no))
+        if digits is None:
+            # cache not warm yet → speak live
+            digits = ("TTS", ", ".join(_DIGITS[d] for d in str(int(token_no))))
 
-    counter_audio = _pick_counter_audio(counter)
+        return [DING_WAV, INTRO_WAV, digits, _counter_part(counter, counter_audio)]
 
-    # Always ding first
-    _audio_q.put(DING_WAV)
+    # ding + "Token Number" + recorded digits + counter
+    digits = _digit_announcer.token_clip(int(token_no))
+    if digits is None:
+        # digit recordings missing → still say the right number
+        digits = ("TTS", ", ".join(_DIGITS[d] for d in str(int(token_no))))
+    return [DING_WAV, INTRO_WAV, digits, _counter_part(counter, counter_audio)]
 
-    if use_tts:
-        # "Token Number" + TTS digits + counter
-        digit_words = ", ".join(_DIGITS[d] for d in str(int(token_no)))
-        _audio_q.put(INTRO_WAV)
-        _audio_q.put(("TTS", digit_words))
-        _audio_q.put(counter_audio)
-    else:
-        # ding + pre-recorded token wav + counter
-        system_token = _wrap_system_token(int(token_no))
-        token_wav = os.path.join(AUDIO_DIR, f"{system_token}.wav")
-        _audio_q.put(token_wav)
-        _audio_q.put(counter_audio)
-
-    # print("AUDIO announce_token called:", use_tts, token_no, counte
\ No newline at end of file
+
+def _counter_part(counter: str, counter_audio: str | None):
+    if counter_audio is not None and os.path.exists(counter_audio):
+        return counter_audio
+    # no recording for this counter → its cached name ("Lab 1"), spoken live on a miss
+    phrase = _counter_phrase(counter)
+    return _tts_cache.cached(phrase) or ("TTS", phrase)
+
+
+def announce_token(use_tts: bool, token_no: int, counter: str, recall: bool = False, on_start=None):
+    """on_start(t) is called when the first sample of this announcement plays."""
+    _start_worker_once()
+
+    # one pending announcement per counter: a newer call replaces a waiting one
+    name = f"{token_no}@{counter}"
+    parts = _announcement_parts(use_tts, token_no, counter)
+    _audio_q.put(("ANNOUNCE", parts, name, time.monotonic(), on_start), key=counter, recall=recall, name=name)
+
+    # Same counter usually calls token+1 next → have it mixed before it's needed
+    if _announce_cache is not None:
+        nxt = _announcement_parts(use_tts, int(token_no) + 1, counter)
+        if all(_is_renderable(p) for p in nxt):
+            _announce_cache.prerender(nxt, f"{int(token_no) + 1}@{counter}")
@@ -0,0 +1,350 @@
+import array
+import io
+import os
+import queue
+import sys
+import threading
+import time
+import wave
+
+IS_WINDOWS = sys.platform.startswith("win")
+
+# ✅ Optional: persistent PortAudio output stream
+try:
+    import sounddevice
+except Exception:
+    sounddevice = None
+
+try:
+    import winsound
+except Exception:
+    winsound = None
+
+# Every clip is converted to this once, so clips can be written back-to-back
+# into one open output stream.
+ENGINE_RATE = 44100
+ENGINE_CHANNELS = 1
+ENGINE_SAMPWIDTH = 2
+
+
+# ===================== PCM =====================
+
+class Clip:
+    """Decoded audio: signed 16-bit mono PCM at ENGINE_RATE."""
+
+    __slots__ = ("pcm", "rate", "name", "_wav")
+
+    def __init__(self, pcm: bytes, rate: int = ENGINE_RATE, name: str = ""):
+        self.pcm = pcm
+        self.rate = rate
+        self.name = name
+        self._wav = None
+
+    @property
+    def frames(self) -> int:
+        return len(self.pcm) // ENGINE_SAMPWIDTH
+
+    @property
+    def duration(self) -> float:
+        return self.frames / float(self.rate)
+
+    def samples(self) -> array.array:
+        a = array.array("h")
+        a.frombytes(self.pcm)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return a
+
+    @classmethod
+    def from_samples(cls, samples: array.array, rate: int = ENGINE_RATE, name: str = ""):
+        if sys.byteorder == "big":
+            samples = array.array("h", samples)
+            samples.byteswap()
+        return cls(samples.tobytes(), rate, name)
+
+    def to_wav_bytes(self) -> bytes:
+        if self._wav is None:
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as w:
+                w.setnchannels(ENGINE_CHANNELS)
+                w.setsampwidth(ENGINE_SAMPWIDTH)
+                w.setframerate(self.rate)
+                w.writeframes(self.pcm)
+            self._wav = buf.getvalue()
+        return self._wav
+
+
+def _to_int16(raw: bytes, sampwidth: int) -> array.array:
+    if sampwidth == 2:
+        a = array.array("h")
+        a.frombytes(raw)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return a
+
+    if sampwidth == 1:
+        # 8-bit WAV is unsigned
+        return array.array("h", ((b - 128) << 8 for b in raw))
+
+    if sampwidth == 3:
+        # keep the top 16 bits of each little-endian 24-bit sample
+        mv = memoryview(raw)
+        hi = mv[2::3]
+        mid = mv[1::3]
+        return array.array("h", (((h << 8) | m) - 65536 if h & 0x80 else ((h << 8) | m) for h, m in zip(hi, mid)))
+
+    if sampwidth == 4:
+        a = array.array("i")
+        a.frombytes(raw)
+        if sys.byteorder == "big":
+            a.byteswap()
+        return array.array("h", (s >> 16 for s in a))
+
+    raise ValueError(f"unsupported sample width: {sampwidth}")
+
+
+def _to_mono(samples: array.array, channels: int) -> array.array:
+    if channels == 1:
+        return samples
+    return array.array("h", (
+        sum(samples[i:i + channels]) // channels
+        for i in range(0, len(samples), channels)
+    ))
+
+
+def _resample(samples: array.array, src_rate: int, dst_rate: int) -> array.array:
+    if src_rate == dst_rate or not samples:
+        return samples
+
+    # linear interpolation is plenty for speech prompts
+    n_out = int(len(samples) * dst_rate / src_rate)
+    step = src_rate / dst_rate
+    last = len(samples) - 1
+    out = array.array("h", bytes(2 * n_out))
+    for i in range(n_out):
+        pos = i * step
+        j = int(pos)
+        if j >= last:
+            out[i] = samples[last]
+            continue
+        frac = pos - j
+        out[i] = int(samples[j] + (samples[j + 1] - samples[j]) * frac)
+    return out
+
+
+def decode_wav(path: str) -> Clip:
+    """Reads any PCM WAV and normalizes it to the engine format."""
+    with wave.open(path, "rb") as w:
+        channels = w.getnchannels()
+        sampwidth = w.getsampwidth()
+        rate = w.getframerate()
+        raw = w.readframes(w.getnframes())
+
+    samples = _to_mono(_to_int16(raw, sampwidth), channels)
+    samples = _resample(samples, rate, ENGINE_RATE)
+    return Clip.from_samples(samples, ENGINE_RATE, os.path.basename(path))
+
+
+class ClipCache:
+    """Decodes each WAV once; later plays come straight from memory."""
+
+    def __init__(self):
+        self._clips = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Clip | None:
+        p = os.path.abspath(path)
+        with self._lock:
+            clip = self._clips.get(p)
+        if clip is not None:
+            return clip
+        if not os.path.exists(p):
+            return None
+
+        clip = decode_wav(p)
+        with self._lock:
+            self._clips[p] = clip
+        return clip
+
+    def preload(self, paths):
+        for p in paths:
+            try:
+                self.get(p)
+            except Exception as e:
+                print(f"[AUDIO] could not decode {p}: {e}")
+
+
+# ===================== SINKS =====================
+
+class NullSink:
+    """Discards audio. realtime=True sleeps for the clip length like a real device."""
+
+    name = "null"
+
+    def __init__(self, realtime: bool = False):
+        self.realtime = realtime
+
+    def write(self, clip: Clip):
+        if self.realtime:
+            time.sleep(clip.duration)
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """Appends everything played to one WAV file (for tests / headless machines)."""
+
+    name = "file"
+
+    def __init__(self, path: str, realtime: bool = False):
+        self.path = path
+        self.realtime = realtime
+        self._w = wave.open(path, "wb")
+        self._w.setnchannels(ENGINE_CHANNELS)
+        self._w.setsampwidth(ENGINE_SAMPWIDTH)
+        self._w.setframerate(ENGINE_RATE)
+
+    def write(self, clip: Clip):
+        self._w.writeframes(clip.pcm)
+        if self.realtime:
+            time.sleep(clip.duration)
+
+    def close(self):
+        self._w.close()
+
+
+class SoundDeviceSink:
+    """One PortAudio output stream kept open for the life of the process."""
+
+    name = "sounddevice"
+
+    def __init__(self, device=None):
+        self._stream = sounddevice.RawOutputStream(
+            samplerate=ENGINE_RATE,
+            channels=ENGINE_CHANNELS,
+            dtype="int16",
+            device=device,
+        )
+        self._stream.start()
+
+    def write(self, clip: Clip):
+        # blocks until the device has taken the data → clips play back-to-back
+        self._stream.write(clip.pcm)
+
+    def close(self):
+        self._stream.stop()
+        self._stream.close()
+
+
+class WinsoundSink:
+    """In-process playback from memory on Windows (no PowerShell per clip)."""
+
+    name = "winsound"
+
+    def write(self, clip: Clip):
+        winsound.PlaySound(clip.to_wav_bytes(), winsound.SND_MEMORY)
+
+    def close(self):
+        pass
+
+
+def make_sink(kind: str = "auto", path: str = "", device=None):
+    """
+    kind: auto | sounddevice | winsound | file | null | legacy
+    Returns None for "legacy" (or when no in-process backend exists), meaning
+    the caller keeps the old per-clip player.
+    """
+    kind = (kind or "auto").strip().lower()
+
+    if kind == "null":
+        return NullSink()
+    if kind == "file":
+        return FileSink(path or "announcements.wav")
+    if kind == "legacy":
+        return None
+
+    if kind in ("auto", "sounddevice") and sounddevice is not None:
+        try:
+            return SoundDeviceSink(device=device or None)
+        except Exception as e:
+            print("[AUDIO] sounddevice unavailable:", e)
+
+    if kind in ("auto", "winsound") and IS_WINDOWS and winsound is not None:
+        return WinsoundSink()
+
+    return None
+
+
+# ===================== ENGINE =====================
+
+class AudioEngine:
+    """
+    Plays decoded clips back-to-back from memory on one sink, on its own thread.
+
+    play() returns immediately. A clip queued with call_t0 (time.monotonic() of
+    the call) records call-to-sound latency when it starts playing.
+    """
+
+    def __init__(self, sink, clips: ClipCache | None = None):
+        self.sink = sink
+        self.clips = clips or ClipCache()
+        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies_ms = []
+        self._max_samples = 500
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def play(self, clip_or_path, call_t0: float | None = None, on_start=None):
+        clip = clip_or_path
+        if not isinstance(clip, Clip):
+            clip = self.clips.get(clip_or_path)
+            if clip is None:
+                print("[AUDIO] missing:", clip_or_path)
+                return
+        self._q.put((clip, call_t0, on_start))
+
+    def wait_idle(self):
+        """Blocks until every queued clip has been written to the sink."""
+        self._q.join()
+
+    def _run(self):
+        while True:
+            clip, call_t0, on_start = self._q.get()
+            try:
+                started = time.monotonic()
+                if call_t0 is not None:
+                    self._record_latency((started - call_t0) * 1000.0)
+                if on_start:
+                    on_start(started)
+                self.sink.write(clip)
+            except Exception as e:
+                print(f"[AUDIO-ERROR] {e}")
+            finally:
+                self._q.task_done()
+
+    def _record_latency(self, ms: float):
+        with self._lock:
+            self._latencies_ms.append(ms)
+            if len(self._latencies_ms) > self._max_samples:
+                del self._latencies_ms[0]
+        print(f"[AUDIO] call→sound {ms:.0f} ms ({self.sink.name})")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lat = sorted(self._latencies_ms)
+            last = self._latencies_ms[-1] if lat else None
+        if not lat:
+            return {"sink": self.sink.name, "count": 0}
+        return {
+            "sink": self.sink.name,
+            "count": len(lat),
+            "last_ms": round(last, 1),
+            "p50_ms": round(lat[len(lat) // 2], 1),
+            "max_ms": round(lat[-1], 1),
+        }
+
+    def close(self):
+        self.wait_idle()
+        self.sink.close()
@@ -0,0 +1,64 @@
+"""
+Tickets rendered per second, without and with the cached template.
+
+    python bench_printing.py                 # 384x500 (macOS / preview size)
+    python bench_printing.py --width 576 --height 750 -n 200
+
+    python bench_printing.py --escpos        # + full ESC/POS path to a file sink
+
+"uncached" clears the font/template caches before every ticket, which is
+what every print used to cost (fonts + logo loaded and the page redrawn).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import printing
+
+
+def _rate(n: int, width: int, height: int, cached: bool) -> float:
+    printing._clear_template_cache()
+    t0 = time.perf_counter()
+    for i in range(n):
+        if not cached:
+            printing._clear_template_cache()
+        printing._generate_token_image(1001 + i, "welfare", width, height)
+    return n / (time.perf_counter() - t0)
+
+
+def _escpos_ms(n: int, width: int, height: int, dither: bool) -> float:
+    """Average ms per ticket: render + 1-bit raster + write to a file sink."""
+    out = os.path.join(tempfile.gettempdir(), "bench_escpos.bin")
+    printing.init_printer("escpos", target=f"file:{out}", width_dots=width, dither=dither)
+    t0 = time.perf_counter()
+    try:
+        for i in range(n):
+            img = printing._generate_token_image(1001 + i, "welfare", width, height)
+            printing._escpos_send(printing.escpos_raster(img, dither=dither), printing._printer_cfg["target"])
+        return (time.perf_counter() - t0) * 1000.0 / n
+    finally:
+        os.remove(out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ticket rendering")
+    ap.add_argument("--width", type=int, default=384)
+    ap.add_argument("--height", type=int, default=500)
+    ap.add_argument("-n", type=int, default=100, help="tickets per run")
+    ap.add_argument("--escpos", action="store_true", help="also time the ESC/POS backend")
+    args = ap.parse_args()
+
+    before = _rate(args.n, args.width, args.height, cached=False)
+    after = _rate(args.n, args.width, args.height, cached=True)
+    print(f"{args.width}x{args.height}, {args.n} tickets")
+    print(f"  uncached: {before:8.1f} tickets/s")
+    print(f"  cached:   {after:8.1f} tickets/s  ({after / before:.1f}x)")
+
+    if args.escpos:
+        print(f"  escpos threshold: {_escpos_ms(args.n, args.width, args.height, False):6.1f} ms/ticket")
+        print(f"  escpos dithered:  {_escpos_ms(args.n, args.width, args.height, True):6.1f} ms/ticket")
+
+
+if __name__ == "__main__":
+    main()
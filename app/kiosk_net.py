@@ -0,0 +1,80 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from resilience import CircuitBreaker
+
+
+class KioskNet(QObject):
+    """
+    All kiosk HTTP off the Qt UI thread, over ONE keep-alive session.
+
+    - watch_status(): from then on the worker thread long-polls
+      /api/status/wait and emits statusReady(data, t_send, t_recv) as soon as
+      a call/recall happens (and once per wait_timeout when nothing does), or
+      statusFailed(error); Qt delivers both on the UI thread. Failures back
+      off through the circuit breaker (jittered), so a restarted server isn't
+      stormed.
+    - session: the same pooled session for the print spooler and the token
+      leaser (their own background threads; urllib3's pool is thread-safe).
+    """
+
+    statusReady = pyqtSignal(dict, float, float)
+    statusFailed = pyqtSignal(str)
+
+    def __init__(self, server_base, dept: str = "welfare", wait_timeout: float = 25.0,
+                 breaker: CircuitBreaker | None = None):
+        super().__init__()
+        self._server_base = server_base      # callable -> "http://ip:port" or None
+        self.dept = dept
+        self.wait_timeout = wait_timeout
+        self.breaker = breaker or CircuitBreaker("SERVER")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._watching = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def watch_status(self):
+        """Starts continuous long polling of /api/status/wait."""
+        self._watching.set()
+
+    def _run(self):
+        self._watching.wait()
+        version = None
+        while True:
+            base = self._server_base()
+            if not base:
+                time.sleep(0.5)
+                continue
+            if not self.breaker.allow():
+                time.sleep(self.breaker.wait_time())
+                continue
+
+            try:
+                t_send = time.time()
+                r = self.session.get(
+                    f"{base}/api/status/wait",
+                    params={"dept": self.dept, "since": version, "timeout": self.wait_timeout},
+                    timeout=self.wait_timeout + 5
+                )
+                r.raise_for_status()
+                data = r.json()
+                version = data.get("version")
+                self.breaker.success()
+                self.statusReady.emit(data, t_send, time.time())
+            except Exception as e:
+                version = None
+                self.breaker.failure()
+                self.statusFailed.emit(str(e))
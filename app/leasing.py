@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+import requests
+
+
+class TokenLeaser:
+    """
+    Kiosk-side token numbering.
+
+    The server leases this kiosk a small contiguous block of numbers per visit
+    type (/api/lease-tokens). take() hands out the next number instantly with no
+    network call; a background thread reports issued tokens in batches
+    (/api/report-tokens) and tops the blocks up before they run out.
+
+    Leases belong to one session day: a block from yesterday is thrown away
+    (the server closes it at rollover), never issued.
+
+    With journal_path, leases and issued-but-unreported tokens are kept on
+    disk (written before take() returns), so a restart reports them instead of
+    losing patients who already hold a ticket. Tokens the server refuses (a
+    lease from a day that has rolled over) are not dropped: they stay in the
+    journal under "rejected" for reconciliation.
+
+    A refill keeps its Idempotency-Key (journaled too) until the server has
+    answered it, so a lease whose response was lost is handed back on the
+    retry instead of a second block leaking until rollover.
+    """
+
+    def __init__(self, server_base, dept: str = "welfare", kiosk_id: str = "kiosk",
+                 block_size: int = 5, refill_at: int = 2, flush_interval: float = 0.5,
+                 visit_types=("appointment", "walkin", "lab"), session=None,
+                 journal_path: str | None = None, max_rejected: int = 500):
+        self._server_base = server_base      # callable -> "http://ip:port" or None
+        self.dept = dept
+        self.kiosk_id = kiosk_id
+        self.block_size = block_size
+        self.refill_at = refill_at
+        self.flush_interval = flush_interval
+        self.visit_types = tuple(visit_types)
+        self.journal_path = journal_path
+        self.max_rejected = max_rejected
+
+        self._lock = threading.Lock()
+        self._leases = {vt: [] for vt in self.visit_types}   # vt -> [lease dicts], oldest first
+        self._pending = []                                    # [(lease_id, token_no, issued_at)]
+        self._inflight = []                                   # batch being reported right now (still journaled)
+        self._rejected = []                                   # [{"lease_id", "token_no", "issued_at", "reason"}]
+        self._refill_keys = {}                                # vt -> {"key", "session_date"} of the pending refill
+        self._wake = threading.Event()
+        self._session = session or requests.Session()   # may be shared with the kiosk's other HTTP
+        self._thread = None
+        self._load()
+
+    # ------------------ public ------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def take(self, visit_type: str) -> int | None:
+        """
+        Returns the next leased number for visit_type, or None if no block is
+        available right now (caller falls back to /api/print-token).
+        """
+        today = date.today().isoformat()
+        with self._lock:
+            leases = self._leases.get(visit_type)
+            if leases is None:
+                return None
+
+            # drop exhausted / stale blocks
+            while leases and (leases[0]["next_no"] > leases[0]["end_no"] or leases[0]["session_date"] != today):
+                leases.pop(0)
+            if not leases:
+                self._wake.set()
+                return None
+
+            lease = leases[0]
+            token_no = lease["next_no"]
+            lease["next_no"] += 1
+            self._pending.append((lease["lease_id"], token_no, datetime.now()))
+            self._save()   # on disk before the number is printed
+
+        self._wake.set()
+        return token_no
+
+    def remaining(self, visit_type: str) -> int:
+        with self._lock:
+            return sum(l["end_no"] - l["next_no"] + 1 for l in self._leases.get(visit_type, []))
+
+    # ------------------ background ------------------
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            base = self._server_base()
+            if not base:
+                continue
+
+            try:
+                self._flush(base)
+                self._refill(base)
+            except Exception as e:
+                print("lease sync error:", e)
+                time.sleep(1)
+
+    def _flush(self, base: str):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._inflight = batch
+        if not batch:
+            return
+
+        by_lease = {}
+        for lease_id, token_no, issued_at in batch:
+            by_lease.setdefault(lease_id, []).append(
+                {"token_no": token_no, "issued_at": issued_at.isoformat()}
+            )
+
+        failed = []
+        rejected = []
+        for lease_id, tokens in by_lease.items():
+            try:
+                r = self._session.post(
+                    f"{base}/api/report-tokens",
+                    json={"lease_id": lease_id, "tokens": tokens},
+                    timeout=3
+                )
+                r.raise_for_status()
+                data = r.json()
+                if not data.get("ok"):
+                    # lease closed at rollover: those patients already hold tickets from a past day
+                    reason = data.get("reason")
+                    numbers = ", ".join(str(t["token_no"]) for t in tokens)
+                    print(f"⚠️ lease {lease_id} rejected ({reason}), tokens {numbers} kept for reconciliation")
+                    rejected.extend(dict(t, lease_id=lease_id, reason=reason) for t in tokens)
+                    self._forget_lease(lease_id)
+            except Exception as e:
+                print("report-tokens failed:", e)
+                failed.extend(
+                    (lease_id, t["token_no"], datetime.fromisoformat(t["issued_at"])) for t in tokens
+                )
+
+        with self._lock:
+            # keep order: failed reports go back in front of newer ones
+            self._pending = failed + self._pending
+            self._inflight = []
+            self._rejected = (self._rejected + rejected)[-self.max_rejected:]
+            self._save()
+
+    def rejected(self) -> list:
+        """Tokens the server refused, oldest first (for reconciliation)."""
+        with self._lock:
+            return [dict(r) for r in self._rejected]
+
+    def _refill(self, base: str):
+        today = date.today().isoformat()
+        for vt in self.visit_types:
+            if self.remaining(vt) > self.refill_at:
+                continue
+
+            with self._lock:
+                pending = self._refill_keys.get(vt)
+                if not pending or pending["session_date"] != today:
+                    pending = self._refill_keys[vt] = {"key": uuid.uuid4().hex, "session_date": today}
+                    self._save()   # on disk before the server can commit the block
+
+            r = self._session.post(
+                f"{base}/api/lease-tokens",
+                json={"dept": self.dept, "visit_type": vt, "kiosk_id": self.kiosk_id, "count": self.block_size},
+                headers={"Idempotency-Key": pending["key"]},
+                timeout=3
+            )
+            if 400 <= r.status_code < 500 and r.status_code != 409:
+                # refused outright, nothing was leased: the next refill starts over
+                with self._lock:
+                    self._refill_keys.pop(vt, None)
+                    self._save()
+            r.raise_for_status()
+            lease = r.json()
+            lease["next_no"] = lease["start_no"]
+
+            with self._lock:
+                self._refill_keys.pop(vt, None)
+                self._leases[vt].append(lease)
+                self._save()
+            print(f"🎫 Leased {vt} {lease['start_no']}-{lease['end_no']}")
+
+    def _forget_lease(self, lease_id: int):
+        with self._lock:
+            for leases in self._leases.values():
+                leases[:] = [l for l in leases if l["lease_id"] != lease_id]
+
+    # ------------------ persistence ------------------
+
+    def _load(self):
+        if not self.journal_path:
+            return
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print("[LEASE] unreadable journal, starting empty:", e)
+            return
+
+        today = date.today().isoformat()
+        for vt, leases in data.get("leases", {}).items():
+            if vt in self._leases:
+                self._leases[vt] = [l for l in leases if l.get("session_date") == today]
+        # unreported tokens are sent whatever their day; the server sorts out stale ones
+        self._pending = [
+            (lease_id, token_no, datetime.fromisoformat(issued_at))
+            for lease_id, token_no, issued_at in data.get("pending", [])
+        ]
+        self._rejected = data.get("rejected", [])[-self.max_rejected:]
+        self._refill_keys = {vt: k for vt, k in data.get("refill_keys", {}).items()
+                             if vt in self._leases and k.get("session_date") == today}
+        if self._pending:
+            print(f"[LEASE] {len(self._pending)} unreported token(s) from last run, reporting")
+        if self._rejected:
+            print(f"[LEASE] {len(self._rejected)} rejected token(s) awaiting reconciliation in {self.journal_path}")
+
+    def _save(self):
+        # caller holds self._lock
+        if not self.journal_path:
+            return
+        data = {
+            "leases": self._leases,
+            "pending": [(lease_id, token_no, issued_at.isoformat())
+                        for lease_id, token_no, issued_at in self._inflight + self._pending],
+            "rejected": self._rejected,
+            "refill_keys": self._refill_keys,
+        }
+        tmp = self.journal_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.journal_path)
+        except Exception as e:
+            print("[LEASE] could not write journal:", e)
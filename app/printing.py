@@ -3,7 +3,34 @@ from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 import sys
 import subprocess
+import socket
+from functools import lru_cache
 
+# ✅ Optional: QR code linking to the token's status page
+try:
+    import qrcode
+except Exception:
+    qrcode = None
+
+# system = GDI on Windows / PNG + open elsewhere, escpos = raw raster bytes to the printer
+_printer_cfg = {"backend": "system", "target": "", "width_dots": 576, "threshold": 160, "dither": False}
+
+def init_printer(backend: str = "system", target: str = "", width_dots: int = 576,
+                 threshold: int = 160, dither: bool = False):
+    """
+    backend: system | escpos
+    target (escpos): tcp://host[:9100] | file:/path/out.bin | device path (/dev/usb/lp0, COM3, \\\\.\\LPT1)
+    width_dots: printable dots per line (384 for 58 mm, 576 for 80 mm heads)
+    """
+    _printer_cfg.update(
+        backend=(backend or "system").strip().lower(),
+        target=(target or "").strip(),
+        width_dots=width_dots,
+        threshold=threshold,
+        dither=dither,
+    )
+
+@lru_cache(maxsize=32)
 def _load_font(path: str, size: int):
     # fallback to default PIL font if Arial isn't available on some machines
     try:
@@ -11,7 +38,13 @@ def _load_font(path: str, size: int):
     except Exception:
         return ImageFont.load_default()
 
-def _generate_token_image(token_no: int, dept: str, width: int, height: int):
+@lru_cache(maxsize=8)
+def _ticket_template(width: int, height: int):
+    """
+    Everything that is the same on every ticket of this size, drawn once:
+    white page + logo + "TOKEN NO" label.
+    Returns (background, (font_big, font_time), y of token, y of time, scale).
+    """
     img = Image.new("RGB", (width, height), "white")
     draw = ImageDraw.Draw(img)
 
@@ -45,22 +78,51 @@ def _generate_token_image(token_no: int, dept: str, width: int, height: int):
     )
     y += int(50 * scale)
 
+    y_token = y
+    y_time = y + int(110 * scale)
+
+    return img, (font_big, font_time), y_token, y_time, scale
+
+def _clear_template_cache():
+    """Drops cached fonts/templates (e.g. after logo.png was replaced)."""
+    _ticket_template.cache_clear()
+    _load_font.cache_clear()
+
+@lru_cache(maxsize=256)
+def _qr_image(url: str, size: int):
+    """QR bitmap for url, at most size px, scaled by whole pixels per module (crisp on thermal)."""
+    if qrcode is None:
+        return None
+    qr = qrcode.QRCode(border=2, box_size=1, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white").get_image().convert("RGB")
+    modules = img.size[0]
+    k = max(1, size // modules)
+    return img.resize((modules * k, modules * k), Image.NEAREST)
+
+def _generate_token_image(token_no: int, dept: str, width: int, height: int, qr_url: str | None = None):
+    background, (font_big, font_time), y_token, y_time, scale = _ticket_template(width, height)
+
+    # only the per-ticket parts are drawn here
+    img = background.copy()
+    draw = ImageDraw.Draw(img)
+
     # ---- TOKEN NUMBER ----
     draw.text(
-        (width // 2, y),
+        (width // 2, y_token),
         str(token_no),
         fill="black",
         font=font_big,
         anchor="mm"
     )
-    y += int(110 * scale)
 
     # ---- DATE & TIME ----
     now = datetime.now().strftime("%d %b %Y  |  %I:%M %p")
 
     # Optional: add a tiny "stroke" to make it extra crisp on thermal printers
     draw.text(
-        (width // 2, y),
+        (width // 2, y_time),
         now,
         fill="black",
         font=font_time,
@@ -69,10 +131,83 @@ def _generate_token_image(token_no: int, dept: str, width: int, height: int):
         stroke_fill="black"
     )
 
+    # ---- QR (status page on the patient's phone) ----
+    if qr_url:
+        qr = _qr_image(qr_url, int(110 * scale))
+        if qr is not None:
+            img.paste(qr, ((width - qr.size[0]) // 2, y_time + int(22 * scale)))
+
     return img
 
 
-def print_token(printer_name: str, token_no: int, dept: str):
+# ===================== ESC/POS =====================
+
+ESC = b"\x1b"
+GS = b"\x1d"
+_RASTER_BAND = 256   # rows per GS v 0 block (some printers cap the block height)
+
+def _to_1bit(img, threshold: int = 160, dither: bool = False):
+    """Mode "1" image where a set bit is a black dot."""
+    gray = img.convert("L")
+    if dither:
+        # Floyd-Steinberg in C; invert so black → 1
+        return gray.point(lambda v: 255 - v).convert("1")
+    # lookup table applied in C over the whole image (no per-pixel Python loop)
+    return gray.point(lambda v: 255 if v < threshold else 0, mode="1")
+
+def escpos_raster(img, threshold: int = 160, dither: bool = False, cut: bool = True) -> bytes:
+    """Ticket image → ESC/POS bytes (init, GS v 0 raster bands, feed, cut)."""
+    bits = _to_1bit(img, threshold, dither)
+    width, height = bits.size
+    row_bytes = (width + 7) // 8
+
+    out = [ESC + b"@"]
+    for top in range(0, height, _RASTER_BAND):
+        band = bits.crop((0, top, width, min(height, top + _RASTER_BAND)))
+        rows = band.size[1]
+        out.append(GS + b"v0\x00" + bytes((row_bytes & 0xFF, row_bytes >> 8, rows & 0xFF, rows >> 8)))
+        out.append(band.tobytes())   # packed MSB first, rows padded to whole bytes
+
+    out.append(ESC + b"d\x04")           # feed 4 lines
+    if cut:
+        out.append(GS + b"V\x42\x00")   # partial cut
+    return b"".join(out)
+
+def _escpos_send(data: bytes, target: str):
+    if target.startswith("tcp://"):
+        host, _, port = target[len("tcp://"):].partition(":")
+        with socket.create_connection((host, int(port or 9100)), timeout=3) as sock:
+            sock.sendall(data)
+        return
+
+    if target.startswith("file:"):
+        # test sink: tickets are appended one after another
+        with open(target[len("file:"):], "ab") as f:
+            f.write(data)
+        return
+
+    # device file (/dev/usb/lp0, COM3, \\.\LPT1, shared printer path)
+    with open(target, "wb", buffering=0) as f:
+        f.write(data)
+
+def _print_escpos(token_no: int, dept: str, qr_url: str | None = None) -> bool:
+    cfg = _printer_cfg
+    try:
+        width = int(cfg["width_dots"])
+        img = _generate_token_image(token_no, dept, width, int(width * (500 / 384)), qr_url)
+        _escpos_send(escpos_raster(img, cfg["threshold"], cfg["dither"]), cfg["target"])
+        return True
+    except Exception as e:
+        print("PRINT ERROR (ESC/POS):", e)
+        return False
+
+
+def print_token(printer_name: str, token_no: int, dept: str, qr_url: str | None = None) -> bool:
+    """Returns True once the ticket was handed to the printer (False → caller may retry)."""
+    # ---------- ESC/POS: raw raster straight to the printer (any OS, no dialog) ----------
+    if _printer_cfg["backend"] == "escpos":
+        return _print_escpos(token_no, dept, qr_url)
+
     # ---------- WINDOWS: silent direct print ----------
     if sys.platform.startswith("win"):
         try:
@@ -97,7 +232,7 @@ def print_token(printer_name: str, token_no: int, dept: str):
             if target_h > printable_h and printable_h > 0:
                 target_h = printable_h
 
-            img = _generate_token_image(token_no, dept, target_w, target_h)
+            img = _generate_token_image(token_no, dept, target_w, target_h, qr_url)
 
             hDC.StartDoc("PAD Token")
             hDC.StartPage()
@@ -108,10 +243,11 @@ def print_token(printer_name: str, token_no: int, dept: str):
             hDC.EndPage()
             hDC.EndDoc()
             hDC.DeleteDC()
-            return
+            return True
 
         except Exception as e:
             print("PRINT ERROR (Windows):", e)
+            return False
 
     # ---------- macOS: save + open print dialog ----------
     try:
@@ -125,13 +261,14 @@ def print_token(printer_name: str, token_no: int, dept: str):
         )
 
         # Use your original 384x500 design (perfect for thermal)
-        img = _generate_token_image(token_no, dept, 384, 500)
+        img = _generate_token_image(token_no, dept, 384, 500, qr_url)
         img.save(out_path, "PNG")
 
         print(f"[PRINT] macOS print file generated: {out_path}")
 
         # Open print dialog (user selects printer)
         subprocess.run(["open", out_path], check=False)
+        return True
 
     except Exception as e:
         print("PRINT ERROR (macOS):", e)
@@ -139,3 +276,4 @@ def print_token(printer_name: str, token_no: int, dept: str):
             img.save("print_failed.png")
         except Exception:
             pass
+        return False
@@ -0,0 +1,378 @@
+"""
+Headless load test: hundreds of virtual kiosks / displays against a real
+server, in one process (asyncio, stdlib HTTP), no Qt, no audio, no printer.
+
+    python simulate_clients.py --server http://127.0.0.1:8032 --kiosks 20 --displays 30 --duration 60
+
+--server takes a comma separated list for a cluster: clients and counters
+are spread round robin over the nodes, so a call made on one node must be
+announced by displays parked on the others.
+
+    kiosk      prints a walk-in ticket every --print-interval s (Idempotency-Key,
+               like the spooler) and long-polls the reception status like
+               TabletUI
+    display    long-polls /api/status/wait for one stage like the Nursing/Lab
+               pollers (stages taken round robin from --stages)
+    counters   one task per counter presses NEXT every --call-interval s; every
+               call it gets back is what each display of that stage must announce
+
+Announcement decisions use the same StageTracker as announcer.py (first status
+only syncs, recalls via recall_seq / nursing_recall_seq, calls in event order);
+the "speaker" just records what would have been said and when.
+
+Reported per client and overall: call → announce latency (server clock,
+offset estimated per client), missed calls, duplicated announcements,
+request errors. --json writes the full result.
+
+Counters keep calling while the test runs, so run it against a test database.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from announcer import StageTracker
+from latency import Histogram
+
+COUNTERS = {
+    "reception": ["Counter1", "Counter2", "Counter3", "Counter4"],
+    "nursing": ["Nurse1"],
+    "lab": ["Lab1"],
+}
+
+
+# ===================== HTTP =====================
+class AsyncHTTP:
+    """Minimal HTTP/1.1 keep-alive client on asyncio streams (one connection per client)."""
+
+    def __init__(self, base: str):
+        u = urlsplit(base)
+        self.host = u.hostname
+        self.port = u.port or 80
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    async def request(self, method: str, path: str, params: dict | None = None, body=None,
+                      headers: dict | None = None, timeout: float = 10.0):
+        """Returns (status_code, parsed JSON or None)."""
+        if params:
+            path += "?" + urlencode({k: v for k, v in params.items() if v is not None})
+        try:
+            return await asyncio.wait_for(self._send(method, path, body, headers or {}), timeout)
+        except BaseException:
+            await self.close()   # half-read response: never reuse this connection
+            raise
+
+    async def _send(self, method, path, body, headers):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", "Connection: keep-alive"]
+        if body is not None:
+            lines += ["Content-Type: application/json", f"Content-Length: {len(data)}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("server closed the connection")
+        code = int(status_line.split()[1])
+
+        resp_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            payload = b""
+            while True:
+                size = int((await self._reader.readline()).strip() or b"0", 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                payload += await self._reader.readexactly(size)
+                await self._reader.readline()
+        else:
+            payload = await self._reader.readexactly(int(resp_headers.get("content-length", "0")))
+
+        if resp_headers.get("connection", "").lower() == "close":
+            await self.close()
+
+        try:
+            return code, json.loads(payload) if payload else None
+        except ValueError:
+            return code, None
+
+
+# ===================== CLIENTS =====================
+class SimClient:
+    """One virtual display (or the display half of a kiosk): long-poll + StageTracker."""
+
+    def __init__(self, name: str, base: str, dept: str, stage: str, wait_timeout: float):
+        self.name = name
+        self.dept = dept
+        self.stage = stage
+        self.wait_timeout = wait_timeout
+        self.http = AsyncHTTP(base)
+
+        self.tracker = StageTracker(stage)
+        self.ready = asyncio.Event()       # first status seen (baseline synced)
+        self.latency = Histogram()
+        self.announced = {}                # (counter, token) -> times announced (calls only)
+        self.recalls = 0
+        self.requests = 0
+        self.errors = 0
+        self._offset_s = 0.0               # server clock - local clock
+        self._clock_samples = 0
+
+    def _clock(self, status: dict, t_send: float, t_recv: float):
+        # same estimate as LatencyRecorder.clock (parked time is not network)
+        if status.get("server_ts") is None:
+            return
+        t_send = min(t_recv, t_send + float(status.get("waited_ms") or 0) / 1000.0)
+        offset = float(status["server_ts"]) - (t_send + t_recv) / 2.0
+        self._offset_s = offset if not self._clock_samples else 0.8 * self._offset_s + 0.2 * offset
+        self._clock_samples += 1
+
+    def _announce(self, status: dict, counter: str, token: int, recall: bool, seen_at: float):
+        # stubbed speaker: record what would be said
+        if recall:
+            self.recalls += 1
+            return
+        key = (counter, token)
+        self.announced[key] = self.announced.get(key, 0) + 1
+        call = (status.get("calls") or {}).get(counter)
+        if call and call.get("called_ts") is not None:
+            self.latency.add((seen_at - (float(call["called_ts"]) - self._offset_s)) * 1000.0)
+
+    async def run(self, stop: asyncio.Event):
+        version = None
+        backoff = 0.5
+        while not stop.is_set():
+            try:
+                t_send = time.time()
+                self.requests += 1
+                code, status = await self.http.request(
+                    "GET", "/api/status/wait",
+                    params={"dept": self.dept, "stage": self.stage, "since": version, "timeout": self.wait_timeout},
+                    timeout=self.wait_timeout + 5,
+                )
+                t_recv = time.time()
+                if code != 200 or not isinstance(status, dict):
+                    raise ConnectionError(f"HTTP {code}")
+                backoff = 0.5
+                version = status.get("version")
+                self._clock(status, t_send, t_recv)
+
+                for counter, token, recall in self.tracker.changes(status):
+                    self._announce(status, counter, token, recall, t_recv)
+                self.ready.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                version = None
+                await asyncio.sleep(random.uniform(0, backoff))
+                backoff = min(backoff * 2, 10.0)
+        await self.http.close()
+
+
+class SimKiosk(SimClient):
+    """Reception kiosk: the reception display logic plus a ticket printer."""
+
+    def __init__(self, name, base, dept, wait_timeout, print_interval: float):
+        super().__init__(name, base, dept, "reception", wait_timeout)
+        self.print_interval = print_interval
+        self.print_http = AsyncHTTP(base)
+        self.issue_ms = Histogram()
+        self.issued = 0
+        self.print_errors = 0
+
+    async def printer(self, stop: asyncio.Event):
+        while not stop.is_set():
+            await asyncio.sleep(random.expovariate(1.0 / self.print_interval))
+            t0 = time.perf_counter()
+            try:
+                code, data = await self.print_http.request(
+                    "POST", "/api/print-token", body={"dept": self.dept, "visit_type": "walkin"},
+                    headers={"Idempotency-Key": uuid.uuid4().hex},
+                )
+                if code != 200 or not (data or {}).get("token_no"):
+                    raise ConnectionError(f"HTTP {code}")
+                self.issued += 1
+                self.issue_ms.add((time.perf_counter() - t0) * 1000.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.print_errors += 1
+        await self.print_http.close()
+
+
+async def counter_loop(base: str, dept: str, stage: str, counter: str, interval: float,
+                       calls: list, stop: asyncio.Event):
+    """A member of staff pressing NEXT; every call made is recorded as ground truth."""
+    http = AsyncHTTP(base)
+    try:
+        while not stop.is_set():
+            await asyncio.sleep(random.uniform(0.5, 1.5) * interval)
+            if stop.is_set():
+                break
+            try:
+                code, data = await http.request(
+                    "POST", "/api/call-next",
+                    body={"dept": dept, "stage": stage, "counter": counter},
+                    headers={"Idempotency-Key": uuid.uuid4().hex},
+                )
+                if code == 200 and (data or {}).get("token_no"):
+                    calls.append((stage, counter, int(data["token_no"])))
+            except Exception:
+                pass
+    finally:
+        await http.close()
+
+
+# ===================== REPORT =====================
+def evaluate(clients: list, calls: list) -> dict:
+    per_client = []
+    total = Histogram()
+    for c in clients:
+        expected = {(counter, token) for stage, counter, token in calls if stage == c.stage}
+        missed = len(expected - set(c.announced))
+        dups = sum(n - 1 for n in c.announced.values() if n > 1)
+        for b, n in enumerate(c.latency.counts):
+            total.counts[b] += n
+        total.count += c.latency.count
+        total.sum_ms += c.latency.sum_ms
+        total.max_ms = max(total.max_ms, c.latency.max_ms)
+
+        row = {
+            "client": c.name,
+            "stage": c.stage,
+            "expected": len(expected),
+            "announced": sum(c.announced.values()),
+            "missed": missed,
+            "duplicated": dups,
+            "recalls": c.recalls,
+            "requests": c.requests,
+            "errors": c.errors,
+            "latency": c.latency.to_dict(),
+        }
+        if isinstance(c, SimKiosk):
+            row.update(issued=c.issued, print_errors=c.print_errors, issue_latency=c.issue_ms.to_dict())
+        per_client.append(row)
+
+    return {
+        "calls": len(calls),
+        "clients": len(clients),
+        "missed": sum(r["missed"] for r in per_client),
+        "duplicated": sum(r["duplicated"] for r in per_client),
+        "errors": sum(r["errors"] for r in per_client),
+        "requests": sum(r["requests"] for r in per_client),
+        "latency": total.to_dict(),
+        "per_client": per_client,
+    }
+
+
+def print_summary(result: dict, duration: float):
+    lat = result["latency"]
+    print(f"\n{result['clients']} clients, {result['calls']} calls in {duration:.0f} s")
+    print(f"  requests:   {result['requests']} ({result['requests'] / max(duration, 1) / max(result['clients'], 1):.2f}/s per client)")
+    print(f"  errors:     {result['errors']}")
+    print(f"  missed:     {result['missed']}")
+    print(f"  duplicated: {result['duplicated']}")
+    print(f"  call → announce ms: p50 {lat['p50_ms']}  p90 {lat['p90_ms']}  p99 {lat['p99_ms']}  max {lat['max_ms']}")
+
+    worst = sorted(result["per_client"], key=lambda r: (r["missed"] + r["duplicated"], r["latency"]["max_ms"]), reverse=True)[:5]
+    print("\n  worst clients:")
+    for r in worst:
+        print(f"    {r['client']:<14}{r['stage']:<11}missed {r['missed']:<4}dup {r['duplicated']:<4}"
+              f"errors {r['errors']:<4}p99 {r['latency']['p99_ms']} ms")
+
+
+# ===================== MAIN =====================
+async def simulate(args):
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    servers = [s.strip() for s in args.server.split(",") if s.strip()]
+    stop = asyncio.Event()
+
+    kiosks = [SimKiosk(f"kiosk{i + 1}", servers[i % len(servers)], args.dept, args.wait_timeout, args.print_interval)
+              for i in range(args.kiosks)]
+    displays = [SimClient(f"display{i + 1}", servers[(args.kiosks + i) % len(servers)], args.dept,
+                          stages[i % len(stages)], args.wait_timeout)
+                for i in range(args.displays)]
+    clients = kiosks + displays
+
+    tasks = [asyncio.create_task(c.run(stop)) for c in clients]
+
+    # every client syncs its baseline before the first call, otherwise early calls count as missed
+    try:
+        await asyncio.wait_for(asyncio.gather(*(c.ready.wait() for c in clients)), 30)
+    except asyncio.TimeoutError:
+        print(f"⚠️ {sum(not c.ready.is_set() for c in clients)} clients never got a status")
+    print(f"▶ {len(clients)} clients connected, running {args.duration:.0f} s")
+
+    calls = []
+    load_stop = asyncio.Event()
+    load = [asyncio.create_task(k.printer(load_stop)) for k in kiosks]
+    counters = [(stage, counter) for stage in stages for counter in COUNTERS.get(stage, [])]
+    load += [
+        asyncio.create_task(counter_loop(servers[i % len(servers)], args.dept, stage, counter,
+                                         args.call_interval, calls, load_stop))
+        for i, (stage, counter) in enumerate(counters)
+    ]
+
+    t0 = time.time()
+    await asyncio.sleep(args.duration)
+    load_stop.set()
+    await asyncio.gather(*load, return_exceptions=True)
+    await asyncio.sleep(args.drain)   # last calls still reaching the displays
+    stop.set()
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return evaluate(clients, calls), time.time() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Headless kiosk/display simulator")
+    ap.add_argument("--server", default="http://127.0.0.1:8032", help="base URL, or several comma separated (cluster)")
+    ap.add_argument("--dept", default="welfare")
+    ap.add_argument("--kiosks", type=int, default=20)
+    ap.add_argument("--displays", type=int, default=30)
+    ap.add_argument("--stages", default="reception,nursing", help="display stages, round robin")
+    ap.add_argument("--duration", type=float, default=60.0, help="seconds of load")
+    ap.add_argument("--call-interval", type=float, default=4.0, help="mean seconds between NEXT per counter")
+    ap.add_argument("--print-interval", type=float, default=10.0, help="mean seconds between tickets per kiosk")
+    ap.add_argument("--wait-timeout", type=float, default=25.0)
+    ap.add_argument("--drain", type=float, default=3.0, help="seconds to wait after the last call")
+    ap.add_argument("--json", help="write the full result here")
+    args = ap.parse_args()
+
+    result, duration = asyncio.run(simulate(args))
+    print_summary(result, duration)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nfull result: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import date
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+# job status values sent with jobStatus
+QUEUED = "queued"
+ISSUING = "issuing"
+PRINTING = "printing"
+RETRYING = "retrying"
+PRINTED = "printed"
+FAILED = "failed"
+
+
+class PrintSpooler(QObject):
+    """
+    Prints tickets on a background thread so the kiosk UI never waits for the
+    server or the printer.
+
+    - bounded: submit() returns None once max_jobs are waiting
+    - every job gets its Idempotency-Key when it is queued; the key and the
+      token number (once issued) are kept in spool_path, so after a restart a
+      job is finished with the SAME token instead of issuing a new one
+    - a token that can't be issued yet (server down, no leased number left)
+      keeps the job spooled; the issue is retried with backoff until the job
+      expires, across restarts too
+    - transient printer errors are retried with backoff
+    - jobStatus(job_id, status, token_no) is emitted for every state change
+      (Qt delivers it on the UI thread)
+    """
+
+    jobStatus = pyqtSignal(str, str, int)
+
+    def __init__(self, issue, print_ticket, spool_path: str, max_jobs: int = 20,
+                 print_retries: int = 3, retry_delay: float = 2.0, max_age_s: float = 600.0,
+                 max_issue_delay: float = 30.0):
+        super().__init__()
+        self._issue = issue                  # (visit_type, idempotency_key) -> token_no
+        self._print_ticket = print_ticket    # token_no -> bool (True = printed)
+        self.spool_path = spool_path
+        self.max_jobs = max_jobs
+        self.print_retries = print_retries
+        self.retry_delay = retry_delay
+        self.max_age_s = max_age_s
+        self.max_issue_delay = max_issue_delay
+
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._load()
+
+    # ------------------ public ------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, visit_type: str) -> str | None:
+        with self._cond:
+            if len(self._jobs) >= self.max_jobs:
+                return None
+            job = {
+                "id": uuid.uuid4().hex,
+                "visit_type": visit_type,
+                "idempotency_key": uuid.uuid4().hex,
+                "token_no": None,
+                "session_date": date.today().isoformat(),
+                "created_at": time.time(),
+            }
+            self._jobs.append(job)
+            self._save()
+            self._cond.notify()
+
+        self.jobStatus.emit(job["id"], QUEUED, 0)
+        return job["id"]
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs)
+
+    # ------------------ worker ------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                job = self._jobs[0]
+
+            done = self._process(job)
+
+            with self._cond:
+                if done and self._jobs and self._jobs[0] is job:
+                    self._jobs.popleft()
+                self._save()
+
+    def _process(self, job) -> bool:
+        """False → no token yet; the job stays first in the spool and is tried again."""
+        if self._expired(job):
+            print(f"[SPOOL] dropped old job {job['id']} (token {job['token_no']})")
+            self.jobStatus.emit(job["id"], FAILED, job["token_no"] or 0)
+            return True
+
+        if not job["token_no"]:
+            attempts = job.get("issue_attempts", 0)
+            self.jobStatus.emit(job["id"], ISSUING if attempts == 0 else RETRYING, 0)
+            try:
+                token_no = self._issue(job["visit_type"], job["idempotency_key"])
+            except Exception as e:
+                print("[SPOOL] could not get a token:", e)
+                token_no = None
+            if not token_no:
+                # same Idempotency-Key next time, so a late server answer isn't a second token
+                with self._cond:
+                    job["issue_attempts"] = attempts + 1
+                    self._save()
+                time.sleep(min(self.retry_delay * 2 ** attempts, self.max_issue_delay))
+                return False
+
+            with self._cond:
+                job["token_no"] = int(token_no)
+                self._save()   # a restart from here reprints this number
+
+        for attempt in range(self.print_retries):
+            self.jobStatus.emit(job["id"], PRINTING if attempt == 0 else RETRYING, job["token_no"])
+            try:
+                if self._print_ticket(job["token_no"]):
+                    self.jobStatus.emit(job["id"], PRINTED, job["token_no"])
+                    return True
+            except Exception as e:
+                print("[SPOOL] print error:", e)
+            if attempt + 1 < self.print_retries:
+                time.sleep(self.retry_delay * (attempt + 1))
+
+        print(f"[SPOOL] giving up on token {job['token_no']}")
+        self.jobStatus.emit(job["id"], FAILED, job["token_no"])
+        return True
+
+    def _expired(self, job) -> bool:
+        return (job.get("session_date") != date.today().isoformat()
+                or time.time() - job.get("created_at", 0) > self.max_age_s)
+
+    # ------------------ persistence ------------------
+
+    def _load(self):
+        try:
+            with open(self.spool_path, "r", encoding="utf-8") as f:
+                jobs = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print("[SPOOL] unreadable spool file, starting empty:", e)
+            return
+
+        for job in jobs:
+            if not self._expired(job):
+                self._jobs.append(job)
+        if self._jobs:
+            print(f"[SPOOL] resuming {len(self._jobs)} job(s) from last run")
+
+    def _save(self):
+        # caller holds self._cond
+        tmp = self.spool_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(list(self._jobs), f)
+            os.replace(tmp, self.spool_path)
+        except Exception as e:
+            print("[SPOOL] could not write spool file:", e)
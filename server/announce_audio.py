@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import threading
+import wave
+
+from audio_engine import ClipCache, ENGINE_CHANNELS, ENGINE_RATE, ENGINE_SAMPWIDTH
+from digit_announcer import DigitAnnouncer
+
+_COUNTER_RE = re.compile(r"^[A-Za-z]+[0-9]{0,2}$")
+
+
+class AnnouncementRenderer:
+    """
+    Builds "ding + Token Number + digits + counter" as ONE WAV on the server,
+    from the assets in static_dir, so a browser display plays a whole
+    announcement with a single request.
+
+    Rendered files live in cache_dir as <token>_<counter>_<assets>.wav, where
+    <assets> changes whenever a recording is replaced. At most max_files are
+    kept (least recently used removed first).
+    """
+
+    def __init__(self, static_dir: str, cache_dir: str, max_files: int = 2000, gap_ms: int = 120):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.gap_ms = gap_ms
+
+        self.clips = ClipCache()
+        self.digits = DigitAnnouncer(static_dir)
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # ------------------ assets ------------------
+
+    def _asset(self, name: str) -> str:
+        return os.path.join(self.static_dir, name)
+
+    def counter_asset(self, counter: str) -> str | None:
+        """
+        Recording that names this counter (None → announcement ends after the digits).
+        Only reception counters ("CounterN") map to CounterN.wav; Lab.wav is optional.
+        """
+        c = counter.lower()
+        if c.startswith("nurs"):
+            return self._asset("Nursing.wav")
+        if c.startswith("lab"):
+            p = self._asset("Lab.wav")
+            return p if os.path.exists(p) else None
+
+        m = re.fullmatch(r"counter(\d+)", c)
+        if not m:
+            return None
+        p = self._asset(f"Counter{int(m.group(1))}.wav")
+        return p if os.path.exists(p) else None
+
+    def _assets_version(self, counter_path: str | None) -> str:
+        h = hashlib.sha1()
+        names = ["ding.wav", "intro.wav"] + [f"{d}.wav" for d in "0123456789"]
+        for p in [self._asset(n) for n in names] + ([counter_path] if counter_path else []):
+            try:
+                st = os.stat(p)
+                h.update(f"{p}:{st.st_size}:{int(st.st_mtime)}|".encode())
+            except OSError:
+                h.update(f"{p}:missing|".encode())
+        return h.hexdigest()[:12]
+
+    # ------------------ public ------------------
+
+    @staticmethod
+    def valid_counter(counter: str) -> bool:
+        return bool(_COUNTER_RE.match(counter or ""))
+
+    def has_counter_audio(self, counter: str) -> bool:
+        """False → the display has to name the counter itself (no recording on the server)."""
+        return self.counter_asset(counter) is not None
+
+    def path_for(self, token_no: int, counter: str) -> str | None:
+        """Path of the rendered WAV (rendered on first request). None if nothing could be decoded."""
+        counter_path = self.counter_asset(counter)
+        version = self._assets_version(counter_path)
+        path = os.path.join(self.cache_dir, f"{int(token_no)}_{counter}_{version}.wav")
+
+        if os.path.exists(path):
+            try:
+                os.utime(path)   # recently used
+            except OSError:
+                pass
+            return path
+
+        with self._lock:
+            if os.path.exists(path):
+                return path
+            if not self._render(path, token_no, counter_path):
+                return None
+            self._trim()
+        return path
+
+    # ------------------ internals ------------------
+
+    def _render(self, path: str, token_no: int, counter_path: str | None) -> bool:
+        pieces = [self.clips.get(self._asset("ding.wav")), self.clips.get(self._asset("intro.wav")),
+                  self.digits.token_clip(int(token_no))]
+        if counter_path:
+            pieces.append(self.clips.get(counter_path))
+        pieces = [p for p in pieces if p is not None]
+        if not pieces:
+            return False
+
+        gap = b"\x00" * (int(ENGINE_RATE * self.gap_ms / 1000) * ENGINE_SAMPWIDTH)
+        tmp = f"{path}.{os.getpid()}.tmp"   # several server workers may render the same file
+        with wave.open(tmp, "wb") as w:
+            w.setnchannels(ENGINE_CHANNELS)
+            w.setsampwidth(ENGINE_SAMPWIDTH)
+            w.setframerate(ENGINE_RATE)
+            for i, clip in enumerate(pieces):
+                if i:
+                    w.writeframes(gap)
+                w.writeframes(clip.pcm)
+        os.replace(tmp, path)
+        return True
+
+    def _trim(self):
+        try:
+            files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".wav")]
+        except OSError:
+            return
+        if len(files) <= self.max_files:
+            return
+
+        files.sort(key=lambda f: os.path.getmtime(f))
+        for f in files[:len(files) - self.max_files]:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
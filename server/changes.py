@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+# Postgres channel; every transaction that changes who is being served (or a
+# recall) sends NOTIFY on it, so all server processes hear about it.
+CHANNEL = "qms_changes"
+
+
+def notify(cur):
+    """Queue a change notification; Postgres delivers it when the transaction commits."""
+    cur.execute(f"NOTIFY {CHANNEL}")
+
+
+class ChangeFeed:
+    """
+    Wakes parked /api/status/wait requests when something changed.
+
+    - version goes up on every change (NOTIFY from any process, or bump()
+      for in-memory state of this process)
+    - wait(seen, timeout) is awaited by async endpoints, so a parked request
+      holds no worker thread and no DB connection
+    - the LISTEN connection lives on its own thread and reconnects by itself
+    """
+
+    def __init__(self, connect, retry_delay: float = 2.0):
+        self._connect = connect
+        self.retry_delay = retry_delay
+
+        self.version = 0
+        self._lock = threading.Lock()
+        self._waiters = set()     # (loop, future)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, daemon=True)
+            self._thread.start()
+
+    def waiting(self) -> int:
+        """Requests parked right now (reported as load to discovery probes)."""
+        with self._lock:
+            return len(self._waiters)
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            waiters, self._waiters = self._waiters, set()
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:
+                pass   # loop already closed
+
+    async def wait(self, seen: int, timeout: float) -> int:
+        """Returns once version != seen or after timeout. Returns the current version."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        waiter = (loop, fut)
+        with self._lock:
+            if self.version != seen:
+                return self.version
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+        return self.version
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                try:
+                    conn.execute(f"LISTEN {CHANNEL}")
+                    print("[CHANGES] listening for status changes")
+                    # anything may have changed while we were not listening
+                    self.bump()
+                    for _ in conn.notifies():
+                        self.bump()
+                finally:
+                    conn.close()
+            except Exception as e:
+                print("[CHANGES] listener failed:", e)
+            time.sleep(self.retry_delay)
+
+
+def _wake(fut):
+    if not fut.done():
+        fut.set_result(None)
@@ -0,0 +1,283 @@
+# check_multiworker.py
+"""
+Checks the state that server workers share through Postgres. Every "worker"
+is a separate OS process running the server's own modules, so nothing is
+shared between them except the database.
+
+    python check_multiworker.py                  # all checks, 4 workers
+    python check_multiworker.py --workers 8
+    python check_multiworker.py idempotency      # migrate + one check
+
+migrate      --workers processes boot at once against an empty database:
+             every step is applied exactly once, every worker ends at LATEST
+idempotency  one Idempotency-Key sent to several workers at once, each
+             request issuing a real token: one token, and every retry gets
+             the first result; a retry that outwaits a slow first attempt
+             gets InProgress (409), never a second token; a failed first
+             attempt is taken over by exactly one retry; a worker that dies
+             mid-request leaves no token behind, and the retry that takes
+             its claim over issues exactly one; the key reused with another
+             body gets KeyMismatch (422)
+recalls      lab and nursing recalls taken on different workers: each stage
+             counts its own seq, the reception seq is untouched
+
+Runs in a scratch database (qms_check_<pid>) that is created next to the
+configured one and dropped at the end, so the configured user needs
+CREATEDB. migrate always runs first: it builds the schema the others use.
+Exit status 1 if any check failed.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+import uuid
+
+import db
+import migrations
+from db import APPT_START, WALKIN_START, LAB_START
+from idempotency import InProgress, KeyMismatch, PgIdempotencyStore
+
+
+def _use(dbname: str):
+    # db.connect() reads PG_DB on every call
+    db.PG_DB = dbname
+
+
+def _admin(sql: str):
+    conn = db.connect()
+    try:
+        conn.autocommit = True
+        conn.execute(sql)
+    finally:
+        conn.close()
+
+
+def _run(target, args_list: list) -> list:
+    """
+    One process per args tuple, started together; returns what each put on the
+    queue (a process that died without reporting adds ("died", exitcode)).
+    """
+    q = mp.Queue()
+    procs = [mp.Process(target=target, args=(q, *args)) for args in args_list]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    out = []
+    while len(out) < len(procs):
+        try:
+            out.append(q.get(timeout=1))
+        except Exception:
+            break
+    out += [("died", p.exitcode) for p in procs if p.exitcode not in (0, None)]
+    return out
+
+
+def _tokens_issued(visit_type: str) -> int:
+    conn = db.connect()
+    try:
+        prio = {"appointment": 1, "walkin": 2, "lab": 3}[visit_type]
+        return conn.execute("SELECT count(*) AS n FROM tokens WHERE priority = %s", (prio,)).fetchone()["n"]
+    finally:
+        conn.close()
+
+
+# ------------------ workers (child processes) ------------------
+
+def _migrate_worker(q, dbname, barrier):
+    _use(dbname)
+    barrier.wait()
+    conn = db.connect()
+    try:
+        applied = migrations.migrate(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
+        q.put(("ok", applied, migrations.current_version(conn)))
+    except Exception as e:
+        q.put(("error", repr(e), None))
+    finally:
+        conn.close()
+
+
+def _idempotency_worker(q, dbname, scope, key, start_delay, work_seconds, fail, wait_timeout, runs,
+                        visit_type="walkin", crash=False, abandon_after=120.0):
+    _use(dbname)
+    store = PgIdempotencyStore(db.connect, wait_timeout=wait_timeout, abandon_after=abandon_after)
+
+    def fn(conn):
+        # a real allocation, left uncommitted like the print-token endpoint does
+        with runs.get_lock():
+            runs.value += 1
+        token_no = db.create_token_atomic(conn, "welfare", visit_type, appt_start=APPT_START,
+                                          walkin_start=WALKIN_START, lab_start=LAB_START, commit=False)
+        time.sleep(work_seconds)
+        if crash:
+            os._exit(1)   # killed between the allocation and its commit
+        if fail:
+            raise RuntimeError("first attempt fails")
+        return {"token_no": token_no, "worker": os.getpid()}
+
+    time.sleep(start_delay)
+    try:
+        q.put(("ok", store.run(scope, key, fn, fingerprint=visit_type)))
+    except InProgress:
+        q.put(("in_progress", None))
+    except KeyMismatch:
+        q.put(("mismatch", None))
+    except RuntimeError as e:
+        q.put(("failed", str(e)))
+
+
+def _recall_worker(q, dbname, stage, counter, times):
+    _use(dbname)
+    conn = db.connect()
+    try:
+        for _ in range(times):
+            db.record_stage_recall(conn, "welfare", stage, LAB_START if stage == "lab" else WALKIN_START, counter)
+        q.put(("ok", stage))
+    except Exception as e:
+        q.put(("error", repr(e)))
+    finally:
+        conn.close()
+
+
+# ------------------ checks (parent) ------------------
+
+def check_migrate(dbname: str, workers: int) -> list[str]:
+    barrier = mp.Barrier(workers)
+    out = _run(_migrate_worker, [(dbname, barrier)] * workers)
+    problems = [f"worker failed: {r[1]}" for r in out if r[0] != "ok"]
+    applied = sum(r[1] for r in out if r[0] == "ok")
+    if applied != len(migrations.MIGRATIONS):
+        problems.append(f"{applied} steps applied in total, expected {len(migrations.MIGRATIONS)}")
+    behind = [r[2] for r in out if r[0] == "ok" and r[2] != migrations.LATEST]
+    if behind:
+        problems.append(f"workers ended at versions {behind}, expected {migrations.LATEST}")
+    return problems
+
+
+def check_idempotency(dbname: str, workers: int) -> list[str]:
+    problems = []
+
+    def issued(before: int, want: int, case: str):
+        n = _tokens_issued("walkin") - before
+        if n != want:
+            problems.append(f"{case}: {n} tokens issued, expected {want}")
+
+    # 1. same key on every worker at once: one token, one result everywhere
+    runs = mp.Value("i", 0)
+    key = uuid.uuid4().hex
+    before = _tokens_issued("walkin")
+    out = _run(_idempotency_worker, [(dbname, "check", key, 0.0, 0.5, False, 10.0, runs)] * workers)
+    results = [r[1] for r in out if r[0] == "ok"]
+    if runs.value != 1:
+        problems.append(f"concurrent retries: fn() ran {runs.value} times")
+    if len(results) != workers or any(r != results[0] for r in results):
+        problems.append(f"concurrent retries: results differ: {out}")
+    issued(before, 1, "concurrent retries")
+
+    # 2. slow first attempt: the retry gives up with InProgress, fn() is not run again
+    runs = mp.Value("i", 0)
+    key = uuid.uuid4().hex
+    before = _tokens_issued("walkin")
+    out = _run(_idempotency_worker, [(dbname, "check", key, 0.0, 3.0, False, 10.0, runs),
+                                     (dbname, "check", key, 0.3, 0.0, False, 1.0, runs)])
+    if runs.value != 1:
+        problems.append(f"slow first attempt: fn() ran {runs.value} times")
+    if sorted(r[0] for r in out) != ["in_progress", "ok"]:
+        problems.append(f"slow first attempt: expected one result and one InProgress, got {out}")
+    issued(before, 1, "slow first attempt")
+
+    # 3. failed first attempt: rolled back, exactly one waiting retry runs fn() again
+    runs = mp.Value("i", 0)
+    key = uuid.uuid4().hex
+    before = _tokens_issued("walkin")
+    out = _run(_idempotency_worker, [(dbname, "check", key, 0.0, 0.5, True, 10.0, runs)] +
+               [(dbname, "check", key, 0.1, 0.3, False, 10.0, runs)] * (workers - 1))
+    results = [r[1] for r in out if r[0] == "ok"]
+    if runs.value != 2:
+        problems.append(f"failed first attempt: fn() ran {runs.value} times, expected 2")
+    if len(results) != workers - 1 or any(r != results[0] for r in results):
+        problems.append(f"failed first attempt: retries got different results: {out}")
+    issued(before, 1, "failed first attempt")
+
+    # 4. worker dies between allocation and commit: nothing committed, one takeover issues the token
+    runs = mp.Value("i", 0)
+    key = uuid.uuid4().hex
+    before = _tokens_issued("walkin")
+    out = _run(_idempotency_worker, [(dbname, "check", key, 0.0, 0.2, False, 10.0, runs, "walkin", True, 1.0),
+                                     (dbname, "check", key, 1.5, 0.0, False, 5.0, runs, "walkin", False, 1.0)])
+    if sorted(r[0] for r in out) != ["died", "ok"]:
+        problems.append(f"crash mid-request: expected one dead worker and one result, got {out}")
+    issued(before, 1, "crash mid-request")
+
+    # 5. same key, different body: refused, nothing issued
+    runs = mp.Value("i", 0)
+    before = _tokens_issued("walkin")
+    out = _run(_idempotency_worker, [(dbname, "check", key, 0.0, 0.0, False, 1.0, runs, "lab")])
+    if [r[0] for r in out] != ["mismatch"] or runs.value != 0:
+        problems.append(f"reused key: expected KeyMismatch without running fn(), got {out}")
+    issued(before, 0, "reused key")
+
+    return problems
+
+
+def check_recalls(dbname: str, workers: int) -> list[str]:
+    conn = db.connect()
+    try:
+        before = {s: r["recall_seq"] for s, r in db.get_recalls(conn).items()}
+        conn.rollback()
+
+        plan = [("lab", "Lab1", 3) if i % 2 else ("nursing", "Nurse1", 2) for i in range(workers)]
+        out = _run(_recall_worker, [(dbname, *p) for p in plan])
+        problems = [f"worker failed: {r[1]}" for r in out if r[0] != "ok"]
+
+        after = {s: r["recall_seq"] for s, r in db.get_recalls(conn).items()}
+        conn.rollback()
+    finally:
+        conn.close()
+
+    for stage in ("lab", "nursing"):
+        want = before.get(stage, 0) + sum(times for s, _, times in plan if s == stage)
+        if after.get(stage, 0) != want:
+            problems.append(f"{stage} recall_seq {after.get(stage, 0)}, expected {want}")
+    if after.get("reception") != before.get("reception"):
+        problems.append(f"reception recall_seq moved {before.get('reception')} -> {after.get('reception')}")
+    return problems
+
+
+CHECKS = {"idempotency": check_idempotency, "recalls": check_recalls}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("checks", nargs="*", help=f"any of {', '.join(CHECKS)} (default: all)")
+    ap.add_argument("--workers", type=int, default=4, help="processes per check (at least 2)")
+    args = ap.parse_args()
+    unknown = [c for c in args.checks if c not in CHECKS]
+    if unknown:
+        ap.error(f"unknown check(s): {', '.join(unknown)}")
+    workers = max(2, args.workers)
+
+    dbname = f"qms_check_{os.getpid()}"
+    _admin(f"CREATE DATABASE {dbname} TEMPLATE template0 ENCODING 'UTF8'")
+    failed = False
+    try:
+        _use(dbname)
+        for name, check in [("migrate", check_migrate)] + [(n, CHECKS[n]) for n in (args.checks or CHECKS)]:
+            t0 = time.perf_counter()
+            problems = check(dbname, workers)
+            print(f"{name:12s} {'ok' if not problems else 'FAILED'} ({time.perf_counter() - t0:.1f}s)")
+            for p in problems:
+                print("    " + p)
+            failed = failed or bool(problems)
+            if name == "migrate" and problems:
+                break
+    finally:
+        _use(db.cfg.get("postgres", "db"))
+        _admin(f"DROP DATABASE IF EXISTS {dbname}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+# Several server nodes (PCs) may serve one LAN against the same database.
+# Each server process writes a heartbeat row to cluster_nodes; a node is
+# healthy while one of its processes has beaten within node_timeout.
+
+
+class Heartbeat:
+    """
+    Keeps this process's cluster_nodes row fresh and a cached list of the
+    healthy nodes, so discovery answers probes without touching the DB.
+
+    - base_url: how clients reach this node, "http://ip:port"
+    - load: callable -> int, this process's current load (parked long-polls)
+    - nodes(): [{"base", "load"}] healthy nodes, least loaded first; load
+      is summed over the worker processes of a node
+    """
+
+    def __init__(self, connect, base_url: str, load=None, interval: float = 3.0, node_timeout: float = 10.0):
+        self._connect = connect
+        self.base_url = base_url
+        self.load = load
+        self.interval = interval
+        self.node_timeout = node_timeout
+
+        self.node_id = f"{base_url}#{os.getpid()}"
+        self._nodes = [{"base": base_url, "load": 0}]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Clean shutdown: drop our row so clients stop being sent here at once."""
+        self._stop.set()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM cluster_nodes WHERE node_id = %s", (self.node_id,))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print("[CLUSTER] could not remove node row:", e)
+
+    def nodes(self) -> list:
+        with self._lock:
+            return [dict(n) for n in self._nodes]
+
+    def node_load(self, base_url: str) -> int:
+        with self._lock:
+            for n in self._nodes:
+                if n["base"] == base_url:
+                    return n["load"]
+        return 0
+
+    def _loop(self):
+        conn = None
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                self._beat(conn)
+                if time.monotonic() - last_purge > 300:
+                    # rows of processes that died without shutdown
+                    conn.execute("DELETE FROM cluster_nodes WHERE heartbeat_at < now() - interval '1 hour'")
+                    conn.commit()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                print("[CLUSTER] heartbeat failed:", e)
+                try:
+                    if conn is not None:
+                        conn.close()
+                except Exception:
+                    pass
+                conn = None
+            self._stop.wait(self.interval)
+
+    def _beat(self, conn):
+        load = int(self.load()) if self.load else 0
+        cur = conn.cursor()
+        # the DB clock decides who is alive, so PCs with skewed clocks agree
+        cur.execute("""
+            INSERT INTO cluster_nodes (node_id, base_url, load)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (node_id) DO UPDATE
+            SET base_url = EXCLUDED.base_url, load = EXCLUDED.load, heartbeat_at = now()
+        """, (self.node_id, self.base_url, load))
+        cur.execute("""
+            SELECT base_url, SUM(load) AS load
+            FROM cluster_nodes
+            WHERE heartbeat_at > now() - make_interval(secs => %s)
+            GROUP BY base_url
+            ORDER BY SUM(load), base_url
+        """, (self.node_timeout,))
+        rows = cur.fetchall()
+        conn.commit()
+
+        nodes = [{"base": r["base_url"], "load": int(r["load"])} for r in rows]
+        if not any(n["base"] == self.base_url for n in nodes):
+            nodes.append({"base": self.base_url, "load": load})
+        with self._lock:
+            before = {n["base"] for n in self._nodes}
+            self._nodes = nodes
+        after = {n["base"] for n in nodes}
+        if after != before:
+            print(f"[CLUSTER] healthy nodes: {', '.join(sorted(after))}")
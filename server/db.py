@@ -5,6 +5,8 @@ import psycopg
 from psycopg.rows import dict_row
 import configparser
 from datetime import date
+import events
+import changes
 
 
 def app_dir():
@@ -25,14 +27,40 @@ PG_DB   = cfg.get("postgres", "db")
 PG_USER = cfg.get("postgres", "user")
 PG_PASS = cfg.get("postgres", "password")
 
+# first token number of each range, every day (server, migrations CLI and checks share these)
+APPT_START = 1001
+WALKIN_START = 2001
+LAB_START = 3001
+
 def vacuum_db(conn: sqlite3.Connection):
     conn.execute("VACUUM")
 
 def wal_checkpoint_truncate(conn: sqlite3.Connection):
     conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
 
+class Connection(psycopg.Connection):
+    """
+    Holds the transaction's token_events (events.record) and writes them with
+    one statement right before COMMIT; ROLLBACK drops them with everything else.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending_events = []
+
+    def commit(self):
+        if self.pending_events:
+            rows, self.pending_events = self.pending_events, []
+            events.write(self.cursor(), rows)
+        super().commit()
+
+    def rollback(self):
+        self.pending_events = []
+        super().rollback()
+
+
 def connect():
-    return psycopg.connect(
+    return Connection.connect(
         hostaddr=PG_HOST,   #  FORCE IPv4, bypass DNS/IPv6
         port=PG_PORT,
         dbname=PG_DB,
@@ -43,65 +71,6 @@ def connect():
     )
 
 
-def init_db(conn, appt_start: int, walkin_start: int, lab_start: int):
-    cur = conn.cursor()
-
-    # ------------------ state table ------------------
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS state (
-        id INTEGER PRIMARY KEY CHECK (id = 1),
-        session_date DATE NOT NULL,
-        recall_seq INTEGER NOT NULL DEFAULT 0,
-        last_recall_counter TEXT,
-        next_appt_token INTEGER NOT NULL,
-        next_walkin_token INTEGER NOT NULL,
-        next_lab_token INTEGER NOT NULL
-    )
-    """)
-
-    # ------------------ tokens table ------------------
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS tokens (
-        id SERIAL PRIMARY KEY,
-        token_no INTEGER NOT NULL,
-        dept TEXT NOT NULL,
-
-        -- NEW: stage pipeline
-        stage TEXT NOT NULL DEFAULT 'reception',   -- reception, nursing (future: doctor, etc.)
-
-        priority INTEGER NOT NULL,      -- 1=appointment, 2=walkin
-        status TEXT NOT NULL,           -- WAITING, CALLED, SERVED
-        created_at TIMESTAMP NOT NULL,
-        called_at TIMESTAMP,
-        called_by TEXT,
-        served_at TIMESTAMP,
-        transferred_at TIMESTAMP
-    )
-    """)
-
-    # ------------------ schema migrations (safe) ------------------
-    # If DB already existed before stages, ensure columns exist.
-    # (Postgres supports ADD COLUMN IF NOT EXISTS)
-    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS stage TEXT NOT NULL DEFAULT 'reception'")
-    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS served_at TIMESTAMP")
-    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS transferred_at TIMESTAMP")
-    cur.execute("ALTER TABLE state ADD COLUMN IF NOT EXISTS next_lab_token INTEGER")
-
-
-    # ------------------ ensure single state row ------------------
-        # ------------------ ensure single state row ------------------
-    cur.execute("SELECT COUNT(*) AS count FROM state WHERE id = 1")
-    row = cur.fetchone()
-    if row["count"] == 0:
-        cur.execute("""
-            INSERT INTO state (id, session_date, next_appt_token, next_walkin_token, next_lab_token)
-            VALUES (1, %s, %s, %s, %s)
-        """, (date.today(), appt_start, walkin_start, lab_start))
-    else:
-        # Backfill for older DBs that don't have lab counter yet
-        cur.execute("UPDATE state SET next_lab_token = COALESCE(next_lab_token, %s) WHERE id = 1", (lab_start,))
-
-    conn.commit()
 
 def daily_cleanup_if_needed(conn, appt_start: int, walkin_start: int, lab_start: int):
     cur = conn.cursor()
@@ -115,7 +84,26 @@ def daily_cleanup_if_needed(conn, appt_start: int, walkin_start: int, lab_start:
 
     # row is a dict because of dict_row
     if row["session_date"] != today:
+        # several servers may notice the new day at once: only the first resets
+        cur.execute("SELECT session_date FROM state WHERE id = 1 FOR UPDATE")
+        if cur.fetchone()["session_date"] == today:
+            conn.commit()
+            return False
+
+        # Reconcile yesterday's leases: numbers handed to kiosks but not reported (yet)
+        cur.execute("""
+            SELECT COUNT(*) AS leases, COALESCE(SUM(end_no - next_no + 1), 0) AS unreported
+            FROM token_leases
+            WHERE session_date = %s AND next_no <= end_no
+        """, (row["session_date"],))
+        lease_row = cur.fetchone()
+        if lease_row["leases"]:
+            print(f"[LEASE] rollover: {lease_row['leases']} leases closed with {lease_row['unreported']} unreported numbers")
+
         cur.execute("DELETE FROM tokens")
+        # yesterday's leases stay one more day, so a kiosk's late report is
+        # still recognised and recorded (report_leased_tokens) instead of lost
+        cur.execute("DELETE FROM token_leases WHERE session_date < %s", (row["session_date"],))
 
         cur.execute("""
             UPDATE state
@@ -126,32 +114,34 @@ def daily_cleanup_if_needed(conn, appt_start: int, walkin_start: int, lab_start:
             WHERE id = 1
         """, (today, appt_start, walkin_start, lab_start))
 
+        changes.notify(cur)
         conn.commit()
         return True
 
     return False
 
-def create_token_atomic(conn, dept, visit_type, appt_start, walkin_start, lab_start):
+def _visit_type_info(visit_type, appt_start, walkin_start, lab_start):
+    """
+    Returns (visit_type, priority, state column, fallback start, stage) for a visit type.
+    """
     vt = (visit_type or "walkin").lower().strip()
     if vt not in ("appointment", "walkin", "lab"):
         vt = "walkin"
 
     if vt == "appointment":
-        priority = 1
-        col = "next_appt_token"
-        fallback_start = appt_start
-        stage = "reception"
-    elif vt == "walkin":
-        priority = 2
-        col = "next_walkin_token"
-        fallback_start = walkin_start
-        stage = "reception"
-    else:
-        # lab = first-come-first-serve within its own range, in LAB stage
-        priority = 3
-        col = "next_lab_token"
-        fallback_start = lab_start
-        stage = "reception"
+        return vt, 1, "next_appt_token", appt_start, "reception"
+    if vt == "walkin":
+        return vt, 2, "next_walkin_token", walkin_start, "reception"
+
+    # lab = first-come-first-serve within its own range, in LAB stage
+    return vt, 3, "next_lab_token", lab_start, "reception"
+
+def create_token_atomic(conn, dept, visit_type, appt_start, walkin_start, lab_start, commit: bool = True):
+    """
+    commit=False (here and in the other allocating calls) leaves the transaction
+    open, so the caller commits it together with the Idempotency-Key result.
+    """
+    vt, priority, col, fallback_start, stage = _visit_type_info(visit_type, appt_start, walkin_start, lab_start)
 
     cur = conn.cursor()
 
@@ -178,10 +168,159 @@ def create_token_atomic(conn, dept, visit_type, appt_start, walkin_start, lab_st
         WHERE id = 1
     """, (next_no + 1,))
 
-    conn.commit()
+    events.record(cur, events.PRINTED, dept, next_no, stage=stage, priority=priority, at=now)
+    if commit:
+        conn.commit()
     return int(next_no)
 
-def call_next_atomic(conn, dept, counter, visit_type=None, stage: str = 'reception'):
+def lease_token_block(conn, dept, kiosk_id, visit_type, count, appt_start, walkin_start, lab_start, commit: bool = True):
+    """
+    Reserves `count` consecutive token numbers for one kiosk by bumping the
+    state counter once (same row lock as create_token_atomic).
+    The kiosk issues them locally and reports them with report_leased_tokens.
+    """
+    vt, _, col, fallback_start, _ = _visit_type_info(visit_type, appt_start, walkin_start, lab_start)
+    count = max(1, int(count))
+
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT session_date, {col}
+        FROM state
+        WHERE id = 1
+        FOR UPDATE
+    """)
+    row = cur.fetchone()
+    start_no = row[col] if row and row[col] is not None else fallback_start
+    end_no = start_no + count - 1
+
+    cur.execute(f"""
+        UPDATE state
+        SET {col} = %s
+        WHERE id = 1
+    """, (end_no + 1,))
+
+    cur.execute("""
+        INSERT INTO token_leases (session_date, dept, kiosk_id, visit_type, start_no, end_no, next_no, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    """, (row["session_date"], dept, kiosk_id, vt, start_no, end_no, start_no, datetime.now()))
+    lease_id = cur.fetchone()["id"]
+
+    if commit:
+
+        conn.commit()
+    return {
+        "lease_id": int(lease_id),
+        "visit_type": vt,
+        "start_no": int(start_no),
+        "end_no": int(end_no),
+        "session_date": row["session_date"].isoformat(),
+    }
+
+def report_leased_tokens(conn, lease_id: int, tokens: list[dict], appt_start, walkin_start, lab_start) -> dict:
+    """
+    Inserts tokens a kiosk issued from its lease as WAITING, in one batch.
+    tokens = [{"token_no": 1005, "issued_at": datetime}, ...]
+    Safe to retry: numbers outside the lease or already inserted are skipped.
+
+    A lease from a day that has rolled over can't queue anything any more (that
+    queue is gone); its tokens are recorded as LATE_REPORTED history so they can
+    be reconciled, and the kiosk gets ok=False with reason "stale_lease".
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT l.id, l.session_date, l.dept, l.visit_type, l.start_no, l.end_no, l.next_no,
+               s.session_date AS state_date
+        FROM token_leases l, state s
+        WHERE l.id = %s AND s.id = 1
+        FOR UPDATE OF l
+    """, (lease_id,))
+    lease = cur.fetchone()
+    if not lease:
+        # lease is older than the previous day (or never existed)
+        conn.commit()
+        return {"ok": False, "reason": "unknown_lease", "inserted": 0}
+
+    _, priority, _, _, stage = _visit_type_info(lease["visit_type"], appt_start, walkin_start, lab_start)
+
+    if lease["session_date"] != lease["state_date"]:
+        return _record_late_report(conn, lease, tokens, stage, priority)
+
+    wanted = {
+        int(t["token_no"]): t.get("issued_at")
+        for t in tokens
+        if lease["start_no"] <= int(t["token_no"]) <= lease["end_no"]
+    }
+    if not wanted:
+        conn.commit()
+        return {"ok": True, "inserted": 0}
+
+    cur.execute("""
+        SELECT token_no
+        FROM tokens
+        WHERE dept=%s AND token_no = ANY(%s)
+    """, (lease["dept"], list(wanted)))
+    for row in cur.fetchall():
+        wanted.pop(int(row["token_no"]), None)
+
+    now = datetime.now()
+    rows = []
+    for token_no, issued_at in sorted(wanted.items()):
+        if issued_at is None:
+            issued_at = now
+        elif issued_at.tzinfo is not None:
+            issued_at = issued_at.astimezone().replace(tzinfo=None)
+        # kiosk clock decides queue order, but never in the future
+        rows.append((token_no, lease["dept"], stage, priority, min(issued_at, now)))
+    if rows:
+        cur.executemany("""
+            INSERT INTO tokens (token_no, dept, stage, priority, status, created_at)
+            VALUES (%s, %s, %s, %s, 'WAITING', %s)
+        """, rows)
+
+        cur.execute("""
+            UPDATE token_leases
+            SET next_no = GREATEST(next_no, %s)
+            WHERE id = %s
+        """, (rows[-1][0] + 1, lease_id))
+        events.record_many(cur, events.PRINTED, lease["dept"], [(r[0], r[4]) for r in rows],
+                           stage=stage, priority=priority)
+
+    conn.commit()
+    return {"ok": True, "inserted": len(rows)}
+
+def _record_late_report(conn, lease, tokens: list[dict], stage: str, priority: int) -> dict:
+    # numbers below next_no were already reported (normally or late): skip on retry
+    late = sorted(
+        (int(t["token_no"]), t.get("issued_at"))
+        for t in tokens
+        if lease["next_no"] <= int(t["token_no"]) <= lease["end_no"]
+    )
+    day_end = datetime.combine(lease["session_date"], datetime.max.time())
+    items = []
+    for token_no, issued_at in late:
+        if issued_at is not None and issued_at.tzinfo is not None:
+            issued_at = issued_at.astimezone().replace(tzinfo=None)
+        if issued_at is None or issued_at.date() != lease["session_date"]:
+            issued_at = day_end   # keeps the event on the lease's day
+        items.append((token_no, issued_at))
+
+    if late:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE token_leases
+            SET next_no = GREATEST(next_no, %s)
+            WHERE id = %s
+        """, (late[-1][0] + 1, lease["id"]))
+        events.record_many(cur, events.LATE_REPORTED, lease["dept"], items, stage=stage, priority=priority)
+    conn.commit()
+
+    if late:
+        print(f"[LEASE] late report for lease {lease['id']} ({lease['session_date']}): "
+              f"{', '.join(str(n) for n, _ in late)} recorded, not queued")
+    return {"ok": False, "reason": "stale_lease", "inserted": 0, "recorded": len(late)}
+
+def call_next_atomic(conn, dept, counter, visit_type=None, stage: str = 'reception', commit: bool = True):
     vt = (visit_type or "auto").lower().strip()
     cur = conn.cursor()
 
@@ -249,21 +388,25 @@ def call_next_atomic(conn, dept, counter, visit_type=None, stage: str = 'recepti
     cur.execute(sql, params)
     row = cur.fetchone()
     if not row:
-        conn.commit()
+        if commit:
+            conn.commit()
         return None
 
     now = datetime.now()
 
     cur.execute("""
         UPDATE tokens
-        SET status='CALLED', called_at=%s, called_by=%s
+        SET status='CALLED', called_at=%s, called_by=%s, call_event_id=nextval('call_event_seq')
         WHERE id=%s
     """, (now, counter, row["id"]))
 
-    conn.commit()
+    events.record(cur, events.CALLED, dept, row["token_no"], stage=stage, counter=counter, at=now)
+    changes.notify(cur)
+    if commit:
+        conn.commit()
     return int(row["token_no"])
 
-def transfer_last_called_to_stage(conn, dept: str, counter: str, from_stage: str, to_stage: str) -> bool:
+def transfer_last_called_to_stage(conn, dept: str, counter: str, from_stage: str, to_stage: str, commit: bool = True) -> bool:
     """
     When Reception clicks NEXT again, we "finish" the previous CALLED token at reception
     and push it to nursing WAITING queue.
@@ -272,7 +415,7 @@ def transfer_last_called_to_stage(conn, dept: str, counter: str, from_stage: str
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT id
+        SELECT id, token_no
         FROM tokens
         WHERE dept=%s AND stage=%s AND status='CALLED'
           AND called_at IS NOT NULL
@@ -284,7 +427,8 @@ def transfer_last_called_to_stage(conn, dept: str, counter: str, from_stage: str
 
     row = cur.fetchone()
     if not row:
-        conn.commit()
+        if commit:
+            conn.commit()
         return False
 
     now = datetime.now()
@@ -299,11 +443,14 @@ def transfer_last_called_to_stage(conn, dept: str, counter: str, from_stage: str
         WHERE id=%s
     """, (to_stage, now, row["id"]))
 
-    conn.commit()
+    events.record(cur, events.TRANSFERRED, dept, row["token_no"], stage=to_stage, counter=counter, at=now)
+    changes.notify(cur)
+    if commit:
+        conn.commit()
     return True
 
 
-def complete_last_called(conn, dept: str, stage: str, counter: str) -> bool:
+def complete_last_called(conn, dept: str, stage: str, counter: str, commit: bool = True) -> bool:
     """
     When Nursing clicks NEXT again, we mark the previous CALLED token as SERVED
     so it disappears from nursing queue.
@@ -311,7 +458,7 @@ def complete_last_called(conn, dept: str, stage: str, counter: str) -> bool:
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT id
+        SELECT id, token_no
         FROM tokens
         WHERE dept=%s AND stage=%s AND status='CALLED'
           AND called_at IS NOT NULL
@@ -323,7 +470,8 @@ def complete_last_called(conn, dept: str, stage: str, counter: str) -> bool:
 
     row = cur.fetchone()
     if not row:
-        conn.commit()
+        if commit:
+            conn.commit()
         return False
 
     now = datetime.now()
@@ -335,17 +483,13 @@ def complete_last_called(conn, dept: str, stage: str, counter: str) -> bool:
         WHERE id=%s
     """, (now, row["id"]))
 
-    conn.commit()
+    events.record(cur, events.SERVED, dept, row["token_no"], stage=stage, counter=counter, at=now)
+    changes.notify(cur)
+    if commit:
+        conn.commit()
     return True
 
     
-def create_indexes(conn):
-    cur = conn.cursor()
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_stage_status_priority_created ON tokens(dept, stage, status, priority, created_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_stage_status_created ON tokens(dept, stage, status, created_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_called_by_called_at ON tokens(dept, called_by, called_at)")
-    conn.commit()
-
 def get_queue(conn, dept: str, stage: str = 'reception'):
     cur = conn.cursor()
     cur.execute("""
@@ -457,7 +601,7 @@ def get_serving_now(conn, dept: str, counters: list[str], stage: str = 'receptio
         result[c] = get_last_called_for_counter(conn, dept, c, stage)
     return result
 
-def record_recall(conn, counter: str):
+def record_recall(conn, dept: str, token_no: int, counter: str):
     cur = conn.cursor()
     cur.execute("""
         UPDATE state
@@ -465,19 +609,49 @@ def record_recall(conn, counter: str):
             last_recall_counter = %s
         WHERE id = 1
     """, (counter,))
+    events.record(cur, events.RECALLED, dept, token_no, stage="reception", counter=counter)
+    changes.notify(cur)
     conn.commit()
 
-def get_last_called_for_counters(conn, dept: str, counters: list[str], stage: str = 'reception') -> dict:
+def record_stage_recall(conn, dept: str, stage: str, token_no: int, counter: str):
+    """Nursing/lab recall: per-stage seq in the DB, so every server worker sees it."""
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO stage_recalls (stage, recall_seq, last_recall_counter)
+        VALUES (%s, 1, %s)
+        ON CONFLICT (stage) DO UPDATE
+        SET recall_seq = stage_recalls.recall_seq + 1,
+            last_recall_counter = EXCLUDED.last_recall_counter
+    """, (stage, counter))
+    events.record(cur, events.RECALLED, dept, token_no, stage=stage, counter=counter)
+    changes.notify(cur)
+    conn.commit()
+
+def get_recalls(conn) -> dict:
     """
-    Returns { "Counter1": 1005, "Counter2": None, ... } for the latest CALLED token per counter.
-    Uses ONE query and then picks the latest row per counter in Python.
+    { "reception": {"recall_seq", "last_recall_counter"}, "nursing": {...}, ... }
+    Reception comes from the state row, the other stages from stage_recalls.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT 'reception' AS stage, recall_seq, last_recall_counter FROM state WHERE id = 1
+        UNION ALL
+        SELECT stage, recall_seq, last_recall_counter FROM stage_recalls
+    """)
+    return {r["stage"]: r for r in cur.fetchall()}
+
+def get_last_calls_for_counters(conn, dept: str, counters: list[str], stage: str = 'reception') -> dict:
+    """
+    Returns { "Counter1": {"token_no": 1005, "event_id": 42, "called_at": datetime}, "Counter2": None, ... }
+    for the latest CALLED token per counter. Uses ONE query and then picks the
+    latest row per counter in Python.
     """
     if not counters:
         return {}
 
     cur = conn.cursor()
     cur.execute("""
-        SELECT called_by, token_no, called_at
+        SELECT called_by, token_no, called_at, call_event_id
         FROM tokens
         WHERE dept=%s
           AND stage=%s
@@ -492,5 +666,71 @@ def get_last_called_for_counters(conn, dept: str, counters: list[str], stage: st
     for row in cur.fetchall():
         c = row["called_by"]
         if c in result and result[c] is None:
-            result[c] = int(row["token_no"])
+            result[c] = {
+                "token_no": int(row["token_no"]),
+                "event_id": row["call_event_id"],
+                "called_at": row["called_at"],
+            }
     return result
+
+def get_last_called_for_counters(conn, dept: str, counters: list[str], stage: str = 'reception') -> dict:
+    """
+    Returns { "Counter1": 1005, "Counter2": None, ... } for the latest CALLED token per counter.
+    """
+    calls = get_last_calls_for_counters(conn, dept, counters, stage=stage)
+    return {c: (call["token_no"] if call else None) for c, call in calls.items()}
+
+def get_token_rows(conn):
+    """Every token of the current session in ONE query (for the per-token status snapshot)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT dept, token_no, stage, status, priority, created_at, called_at, called_by, transferred_at, served_at
+        FROM tokens
+    """)
+    return cur.fetchall()
+
+# ------------------ reporting export ------------------
+
+EXPORT_COLUMNS = (
+    "session_date", "dept", "token_no", "priority",
+    "created_at",
+    "reception_called_at", "reception_counter",
+    "transferred_at", "transferred_to",
+    "stage_called_at", "stage_counter",
+    "served_at",
+    "final_stage", "calls", "recalls",
+)
+
+def iter_token_export(conn, date_from: date, date_to: date, dept: str | None = None, itersize: int = 1000):
+    """
+    Streams one row per token (dict with EXPORT_COLUMNS) for the given days,
+    folded from token_events so past days are available too.
+    Uses a named (server-side) cursor: rows arrive `itersize` at a time, so
+    memory stays flat no matter how many tokens the range has.
+    """
+    with conn.cursor(name="export_tokens") as cur:
+        cur.itersize = itersize
+        cur.execute("""
+            SELECT
+                session_date,
+                dept,
+                token_no,
+                MAX(priority) AS priority,
+                MIN(at) FILTER (WHERE event = 'PRINTED') AS created_at,
+                MIN(at) FILTER (WHERE event = 'CALLED' AND stage = 'reception') AS reception_called_at,
+                (ARRAY_AGG(counter ORDER BY at) FILTER (WHERE event = 'CALLED' AND stage = 'reception'))[1] AS reception_counter,
+                MIN(at) FILTER (WHERE event = 'TRANSFERRED') AS transferred_at,
+                (ARRAY_AGG(stage ORDER BY at) FILTER (WHERE event = 'TRANSFERRED'))[1] AS transferred_to,
+                MIN(at) FILTER (WHERE event = 'CALLED' AND stage <> 'reception') AS stage_called_at,
+                (ARRAY_AGG(counter ORDER BY at) FILTER (WHERE event = 'CALLED' AND stage <> 'reception'))[1] AS stage_counter,
+                MAX(at) FILTER (WHERE event = 'SERVED') AS served_at,
+                (ARRAY_AGG(stage ORDER BY at DESC))[1] AS final_stage,
+                COUNT(*) FILTER (WHERE event = 'CALLED') AS calls,
+                COUNT(*) FILTER (WHERE event = 'RECALLED') AS recalls
+            FROM token_events
+            WHERE session_date BETWEEN %s AND %s
+              AND (%s::text IS NULL OR dept = %s::text)
+            GROUP BY session_date, dept, token_no
+            ORDER BY session_date, created_at, token_no
+        """, (date_from, date_to, dept, dept))
+        yield from cur
@@ -1,8 +1,10 @@
 import socket, json, threading, time
 
-DISCOVERY_PORT = 9999
+DISCOVERY_PORT = 9999   # periodic broadcast beacons (clients listen here)
+PROBE_PORT = 9998       # clients ask "who is there?", servers answer at once
+SERVICE = "Test-QMS"
 
-def _get_local_ip():
+def local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         # doesn't need to be reachable; just used to pick correct interface
@@ -13,11 +15,11 @@ def _get_local_ip():
     finally:
         s.close()
 
-def start_broadcast(http_port: int, interval: float = 3.0):
-    ip = _get_local_ip()
+def start_broadcast(http_port: int, interval: float = 3.0, ip: str | None = None):
+    ip = ip or local_ip()
 
     payload = {
-        "service": "Test-QMS",
+        "service": SERVICE,
         "port": http_port,
         "ip": ip
     }
@@ -36,3 +38,51 @@ def start_broadcast(http_port: int, interval: float = 3.0):
     t = threading.Thread(target=_loop, daemon=True)
     t.start()
     return payload
+
+
+def start_responder(http_port: int, load=None, nodes=None, ip: str | None = None):
+    """
+    Answers probe packets {"service", "probe"} on PROBE_PORT straight to the
+    sender with our address and current load, so a client finds the server
+    in one round trip instead of waiting for the next beacon.
+    load: optional callable -> number (lower = less busy)
+    nodes: optional callable -> [{"base", "load"}], every healthy node of the
+           cluster (clients also learn nodes whose own answer got lost)
+
+    Returns False if another process of this node already answers probes:
+    the port is bound exclusively, so it doubles as a once-per-node lock for
+    uvicorn workers.
+    """
+    ip = ip or local_ip()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(("", PROBE_PORT))
+    except OSError:
+        sock.close()
+        return False
+
+    def _loop():
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+                probe = json.loads(data.decode("utf-8"))
+                if probe.get("service") != SERVICE or "probe" not in probe:
+                    continue
+
+                reply = {
+                    "service": SERVICE,
+                    "ip": ip,
+                    "port": http_port,
+                    "probe": probe["probe"],
+                    "load": load() if load else 0,
+                }
+                if nodes:
+                    reply["nodes"] = nodes()
+                sock.sendto(json.dumps(reply).encode("utf-8"), addr)
+            except Exception:
+                pass
+
+    t = threading.Thread(target=_loop, daemon=True)
+    t.start()
+    return True
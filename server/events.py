@@ -0,0 +1,109 @@
+from datetime import datetime
+
+# Column order used by INSERT/COPY and by replay
+EVENT_COLUMNS = ("session_date", "at", "event", "dept", "token_no", "stage", "priority", "counter")
+
+# Event types
+PRINTED = "PRINTED"          # token created (kiosk print or leased report)
+CALLED = "CALLED"            # counter called the token in `stage`
+RECALLED = "RECALLED"        # counter recalled the token (history only)
+TRANSFERRED = "TRANSFERRED"  # token moved to `stage` and is WAITING there
+SERVED = "SERVED"            # token finished in `stage`
+LATE_REPORTED = "LATE_REPORTED"  # leased token handed out, reported after its day rolled over (never queued)
+
+
+def _row(event: str, dept: str, token_no: int, stage: str | None = None,
+         priority: int | None = None, counter: str | None = None, at: datetime | None = None):
+    at = at or datetime.now()
+    return (at.date(), at, event, dept, int(token_no), stage, priority, counter)
+
+
+# a transaction's events are written with one statement at commit: a multi-row
+# INSERT, or COPY from this many rows on (where it starts to win)
+COPY_MIN_ROWS = 50
+
+
+def record(cur, event: str, dept: str, token_no: int, stage: str | None = None,
+           priority: int | None = None, counter: str | None = None, at: datetime | None = None):
+    """
+    Appends one event to token_events in the same transaction as the state
+    change it describes: both commit or neither does, so the history never
+    misses a transition that happened.
+
+    On a db.connect() connection the row is held until commit, where all of
+    the transaction's events go out together (write()); a rollback drops them.
+    """
+    _add(cur, [_row(event, dept, token_no, stage=stage, priority=priority, counter=counter, at=at)])
+
+
+def record_many(cur, event: str, dept: str, items, stage: str | None = None, priority: int | None = None):
+    """Same as record() for a batch: items = [(token_no, at)]."""
+    _add(cur, [_row(event, dept, token_no, stage=stage, priority=priority, at=at) for token_no, at in items])
+
+
+def _add(cur, rows: list):
+    pending = getattr(cur.connection, "pending_events", None)
+    if pending is None or cur.connection.autocommit:
+        write(cur, rows)   # plain connection: no commit hook, write now
+    else:
+        pending.extend(rows)
+
+
+def write(cur, rows: list):
+    """Writes event rows with one statement (db.Connection.commit calls this)."""
+    if not rows:
+        return
+    if len(rows) >= COPY_MIN_ROWS:
+        with cur.copy(f"COPY token_events ({', '.join(EVENT_COLUMNS)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        return
+
+    values = ", ".join([f"({', '.join(['%s'] * len(EVENT_COLUMNS))})"] * len(rows))
+    cur.execute(
+        f"INSERT INTO token_events ({', '.join(EVENT_COLUMNS)}) VALUES {values}",
+        [v for row in rows for v in row]
+    )
+
+
+def replay(events) -> dict:
+    """
+    Folds events (dicts with EVENT_COLUMNS keys, oldest first) into the current
+    token rows, keyed by (session_date, dept, token_no). Rows have the same
+    columns as the tokens table.
+    """
+    tokens = {}
+
+    for e in events:
+        key = (e["session_date"], e["dept"], e["token_no"])
+        kind = e["event"]
+
+        if kind == PRINTED:
+            tokens[key] = {
+                "token_no": e["token_no"],
+                "dept": e["dept"],
+                "stage": e["stage"] or "reception",
+                "priority": e["priority"],
+                "status": "WAITING",
+                "created_at": e["at"],
+                "called_at": None,
+                "called_by": None,
+                "served_at": None,
+                "transferred_at": None,
+            }
+            continue
+
+        t = tokens.get(key)
+        if t is None:
+            # history before the token was printed isn't available (e.g. log started mid-day)
+            continue
+
+        if kind == CALLED:
+            t.update(stage=e["stage"], status="CALLED", called_at=e["at"], called_by=e["counter"])
+        elif kind == TRANSFERRED:
+            t.update(stage=e["stage"], status="WAITING", called_at=None, called_by=None, transferred_at=e["at"])
+        elif kind == SERVED:
+            t.update(status="SERVED", served_at=e["at"])
+        # RECALLED doesn't change state
+
+    return tokens
@@ -0,0 +1,92 @@
+# export_tokens.py
+"""
+Streams tokens (all timestamps and stages) out for reporting.
+
+    python export_tokens.py                               # today, NDJSON to stdout
+    python export_tokens.py --from 2026-10-01 --to 2026-10-19 --format csv --out october.csv
+
+The same generators back GET /api/export on the server.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date, datetime
+
+import db
+
+FORMATS = ("ndjson", "csv")
+
+
+def _jsonable(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+
+def ndjson_lines(rows):
+    for r in rows:
+        yield json.dumps({c: _jsonable(r[c]) for c in db.EXPORT_COLUMNS}) + "\n"
+
+
+def csv_lines(rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+
+    w.writerow(db.EXPORT_COLUMNS)
+    for r in rows:
+        w.writerow([_jsonable(r[c]) for c in db.EXPORT_COLUMNS])
+        # hand out what's written so far and reuse the buffer (constant memory)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def stream_export(date_from: date, date_to: date, dept: str | None = None, fmt: str = "ndjson", batch_rows: int = 200):
+    """
+    Opens its own connection and yields text chunks of about `batch_rows` rows.
+    The connection is closed when the generator finishes or is closed early
+    (e.g. the HTTP client disconnects).
+    """
+    lines = csv_lines if fmt == "csv" else ndjson_lines
+
+    conn = db.connect()
+    try:
+        chunk = []
+        for line in lines(db.iter_token_export(conn, date_from, date_to, dept)):
+            chunk.append(line)
+            if len(chunk) >= batch_rows:
+                yield "".join(chunk)
+                chunk = []
+        if chunk:
+            yield "".join(chunk)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export tokens as NDJSON or CSV")
+    ap.add_argument("--from", dest="date_from", type=date.fromisoformat, default=date.today())
+    ap.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None)
+    ap.add_argument("--dept", default=None)
+    ap.add_argument("--format", choices=FORMATS, default="ndjson")
+    ap.add_argument("--out", default="-", help="output file (default stdout)")
+    args = ap.parse_args()
+
+    date_to = args.date_to or args.date_from
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8", newline="")
+    try:
+        for chunk in stream_export(args.date_from, date_to, args.dept, args.format):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class InProgress(Exception):
+    """A retry waited wait_timeout for the first request of its key, which is still running."""
+
+    def __init__(self, scope: str, key: str):
+        super().__init__(f"{scope} request {key} is still in progress")
+        self.scope = scope
+        self.key = key
+
+
+class KeyMismatch(Exception):
+    """An Idempotency-Key reused for a different request body."""
+
+    def __init__(self, scope: str, key: str):
+        super().__init__(f"{scope} key {key} was already used for a different request")
+        self.scope = scope
+        self.key = key
+
+
+class _Entry:
+    __slots__ = ("done", "result", "expires_at", "fingerprint")
+
+    def __init__(self, fingerprint: str | None = None):
+        self.done = threading.Event()
+        self.result = None
+        self.expires_at = None
+        self.fingerprint = fingerprint
+
+
+class IdempotencyStore:
+    """
+    Remembers the result of recent requests by (scope, Idempotency-Key) so a client
+    retry returns the original response instead of printing / calling a second token.
+
+    - bounded: oldest keys are dropped once max_entries is reached
+    - time-evicting: keys expire ttl_seconds after the request finished
+    - a retry that arrives while the first request is still running waits for it;
+      if that takes longer than wait_timeout it raises InProgress (never a
+      second fn() next to a slow first one)
+    - if the first request fails it releases the key and exactly one waiting
+      retry takes it over and runs fn()
+    - fingerprint (a hash of the request body) binds the key to its request:
+      the same key with a different body raises KeyMismatch
+    - fn(conn) gets None here: it opens and commits its own connection
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 600.0, wait_timeout: float = 10.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_locked(self, now: float):
+        # entries are kept in insertion order, so expired ones sit at the front
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at is not None and entry.expires_at <= now:
+                self._entries.popitem(last=False)
+            elif len(self._entries) > self.max_entries and entry.done.is_set():
+                self._entries.popitem(last=False)
+            else:
+                break
+
+    def run(self, scope: str, key: str | None, fn, fingerprint: str | None = None):
+        """
+        Runs fn(None) once per (scope, key) and returns its (cached) result.
+        Without a key this is just fn(None).
+        """
+        if not key:
+            return fn(None)
+
+        k = (scope, key)
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_locked(now)
+            entry = self._entries.get(k)
+            owner = entry is None
+            if owner:
+                entry = _Entry(fingerprint)
+                self._entries[k] = entry
+
+        deadline = now + self.wait_timeout
+        while not owner:
+            if fingerprint and entry.fingerprint and entry.fingerprint != fingerprint:
+                raise KeyMismatch(scope, key)
+            if not entry.done.wait(max(0.0, deadline - time.monotonic())):
+                raise InProgress(scope, key)
+            if entry.result is not None:
+                return entry.result
+            # the first attempt failed and released the key: one waiter takes it over
+            with self._lock:
+                current = self._entries.get(k)
+                owner = current is None
+                if owner:
+                    entry = _Entry(fingerprint)
+                    self._entries[k] = entry
+                else:
+                    entry = current   # another waiter was first; wait for it instead
+
+        try:
+            result = fn(None)
+        except Exception:
+            with self._lock:
+                self._entries.pop(k, None)
+            entry.done.set()
+            raise
+
+        with self._lock:
+            entry.result = result
+            entry.expires_at = time.monotonic() + self.ttl_seconds
+        entry.done.set()
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def _json_default(o):
+    return o.isoformat() if hasattr(o, "isoformat") else str(o)
+
+
+class PgIdempotencyStore:
+    """
+    Same contract as IdempotencyStore, kept in the idempotency_keys table so
+    a retry that lands on ANOTHER server worker still gets the first result.
+
+    - the first request inserts (scope, key, request_hash) with result NULL
+      and commits that claim; fn(conn) then does its writes on the same
+      connection WITHOUT committing, and the result is stored in that same
+      transaction: the row has a result exactly when fn's writes committed
+    - a failure rolls fn's writes back and deletes the claim, so a retry
+      runs again
+    - a concurrent retry polls the row until the result is there; after
+      wait_timeout it raises InProgress
+    - when the row disappears (first attempt failed) the waiters INSERT it
+      again and only the one whose INSERT wins runs fn()
+    - a claim still without a result after abandon_after seconds belongs to
+      a worker that died mid-request (nothing of it committed); one waiter
+      takes it over the same way. The old owner, if still alive, can no
+      longer store its result: its transaction is rolled back (InProgress)
+    - a retry whose request_hash differs from the claim's raises KeyMismatch
+    - rows older than ttl_seconds are deleted, at most once a minute
+    """
+
+    def __init__(self, connect, ttl_seconds: float = 600.0, wait_timeout: float = 10.0, poll_interval: float = 0.05,
+                 abandon_after: float = 120.0):
+        self._connect = connect
+        self.ttl_seconds = ttl_seconds
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.abandon_after = abandon_after
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, scope: str, key: str | None, fn, fingerprint: str | None = None):
+        conn = self._connect()
+        try:
+            if not key:
+                result = fn(conn)
+                conn.commit()
+                return result
+
+            self._purge_if_due(conn)
+            cur = conn.cursor()
+            deadline = time.monotonic() + self.wait_timeout
+
+            claimed_at = self._claim(conn, scope, key, fingerprint)
+            while claimed_at is None:
+                cur.execute("""
+                    SELECT result, request_hash,
+                           created_at < now() - make_interval(secs => %s) AS abandoned
+                    FROM idempotency_keys WHERE scope=%s AND key=%s
+                """, (self.abandon_after, scope, key))
+                row = cur.fetchone()
+                conn.commit()
+                if row is not None and fingerprint and row["request_hash"] and row["request_hash"] != fingerprint:
+                    raise KeyMismatch(scope, key)
+                if row is not None and row["result"] is not None:
+                    return row["result"]
+                if row is not None and row["abandoned"]:
+                    claimed_at = self._take_over(conn, scope, key)
+                    if claimed_at is not None:
+                        break
+                if time.monotonic() >= deadline:
+                    raise InProgress(scope, key)
+                if row is not None:
+                    time.sleep(self.poll_interval)
+                # row gone: the first attempt failed, try to claim it (one INSERT wins)
+                claimed_at = self._claim(conn, scope, key, fingerprint) if row is None else None
+
+            try:
+                result = fn(conn)
+            except Exception:
+                conn.rollback()
+                cur.execute("DELETE FROM idempotency_keys WHERE scope=%s AND key=%s AND created_at=%s",
+                            (scope, key, claimed_at))
+                conn.commit()
+                raise
+
+            # only while the claim is still ours: a takeover re-dated it
+            cur.execute("""
+                UPDATE idempotency_keys SET result=%s::jsonb
+                WHERE scope=%s AND key=%s AND created_at=%s AND result IS NULL
+                RETURNING 1 AS owner
+            """, (json.dumps(result, default=_json_default), scope, key, claimed_at))
+            if cur.fetchone() is None:
+                conn.rollback()
+                raise InProgress(scope, key)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _claim(conn, scope: str, key: str, fingerprint: str | None):
+        """created_at of our new claim, or None if the key is already taken."""
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO idempotency_keys (scope, key, request_hash) VALUES (%s, %s, %s)
+            ON CONFLICT (scope, key) DO NOTHING
+            RETURNING created_at
+        """, (scope, key, fingerprint))
+        row = cur.fetchone()
+        conn.commit()
+        return row["created_at"] if row else None
+
+    def _take_over(self, conn, scope: str, key: str):
+        # re-dates the stale claim; the row lock lets exactly one waiter win
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE idempotency_keys SET created_at = clock_timestamp()
+            WHERE scope=%s AND key=%s AND result IS NULL
+              AND created_at < now() - make_interval(secs => %s)
+            RETURNING created_at
+        """, (scope, key, self.abandon_after))
+        row = cur.fetchone()
+        conn.commit()
+        if row:
+            print(f"[IDEMPOTENCY] taking over abandoned {scope} request {key}")
+        return row["created_at"] if row else None
+
+    def _purge_if_due(self, conn):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + 60.0
+        cur = conn.cursor()
+        cur.execute("DELETE FROM idempotency_keys WHERE created_at < now() - make_interval(secs => %s)",
+                    (self.ttl_seconds,))
+        conn.commit()
@@ -0,0 +1,239 @@
+"""
+Versioned schema migrations.
+
+Every schema change is a numbered step in MIGRATIONS; the schema_version
+table records the steps already applied. On boot migrate() does ONE query
+(the current version) and, when the database is current, no DDL at all, so
+a restarting server takes no schema locks while others serve traffic.
+
+Pending steps run in order, each in its own transaction together with its
+schema_version row, under an advisory lock (several servers booting at once
+migrate exactly once).
+
+    python migrations.py            # show version, apply pending steps
+    python migrations.py --status   # only show
+
+Adding a change: append a new step with the next number. Never edit a
+step that has already shipped.
+"""
+import sys
+from datetime import date
+
+import psycopg
+
+# pg_advisory_xact_lock key (any constant unique to this app)
+_LOCK_KEY = 0x514D5301
+
+
+# ------------------ steps ------------------
+
+def _m001_base_schema(cur, opts):
+    # Written with IF NOT EXISTS so it also adopts databases created before
+    # schema_version existed (old init_db).
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        session_date DATE NOT NULL,
+        recall_seq INTEGER NOT NULL DEFAULT 0,
+        last_recall_counter TEXT,
+        next_appt_token INTEGER NOT NULL,
+        next_walkin_token INTEGER NOT NULL,
+        next_lab_token INTEGER NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS tokens (
+        id SERIAL PRIMARY KEY,
+        token_no INTEGER NOT NULL,
+        dept TEXT NOT NULL,
+
+        -- NEW: stage pipeline
+        stage TEXT NOT NULL DEFAULT 'reception',   -- reception, nursing (future: doctor, etc.)
+
+        priority INTEGER NOT NULL,      -- 1=appointment, 2=walkin
+        status TEXT NOT NULL,           -- WAITING, CALLED, SERVED
+        created_at TIMESTAMP NOT NULL,
+        called_at TIMESTAMP,
+        called_by TEXT,
+        served_at TIMESTAMP,
+        transferred_at TIMESTAMP
+    )
+    """)
+
+    # databases from before stages
+    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS stage TEXT NOT NULL DEFAULT 'reception'")
+    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS served_at TIMESTAMP")
+    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS transferred_at TIMESTAMP")
+    cur.execute("ALTER TABLE state ADD COLUMN IF NOT EXISTS next_lab_token INTEGER")
+
+    # every call gets a server event id (for call → announcement latency tracing)
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS call_event_seq")
+    cur.execute("ALTER TABLE tokens ADD COLUMN IF NOT EXISTS call_event_id BIGINT")
+
+    # A kiosk leases a contiguous block [start_no, end_no] and reports tokens as it
+    # issues them. next_no is the first number of the block not reported yet.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS token_leases (
+        id SERIAL PRIMARY KEY,
+        session_date DATE NOT NULL,
+        dept TEXT NOT NULL,
+        kiosk_id TEXT NOT NULL,
+        visit_type TEXT NOT NULL,
+        start_no INTEGER NOT NULL,
+        end_no INTEGER NOT NULL,
+        next_no INTEGER NOT NULL,
+        created_at TIMESTAMP NOT NULL
+    )
+    """)
+
+    # append-only history
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS token_events (
+        id BIGSERIAL PRIMARY KEY,
+        session_date DATE NOT NULL,
+        at TIMESTAMP NOT NULL,
+        event TEXT NOT NULL,            -- PRINTED, CALLED, RECALLED, TRANSFERRED, SERVED
+        dept TEXT NOT NULL,
+        token_no INTEGER NOT NULL,
+        stage TEXT,
+        priority INTEGER,
+        counter TEXT
+    )
+    """)
+
+    # the single state row
+    cur.execute("SELECT COUNT(*) AS count FROM state WHERE id = 1")
+    if cur.fetchone()["count"] == 0:
+        cur.execute("""
+            INSERT INTO state (id, session_date, next_appt_token, next_walkin_token, next_lab_token)
+            VALUES (1, %s, %s, %s, %s)
+        """, (date.today(), opts["appt_start"], opts["walkin_start"], opts["lab_start"]))
+    else:
+        # older DBs that don't have the lab counter yet
+        cur.execute("UPDATE state SET next_lab_token = COALESCE(next_lab_token, %s) WHERE id = 1", (opts["lab_start"],))
+
+
+def _m002_indexes(cur, opts):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_stage_status_priority_created ON tokens(dept, stage, status, priority, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_stage_status_created ON tokens(dept, stage, status, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tokens_dept_called_by_called_at ON tokens(dept, called_by, called_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_token_events_date_token ON token_events(session_date, dept, token_no)")
+
+
+def _m003_shared_state(cur, opts):
+    # recall seq per nursing/lab stage (was a global in one server process)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stage_recalls (
+        stage TEXT PRIMARY KEY,
+        recall_seq INTEGER NOT NULL DEFAULT 0,
+        last_recall_counter TEXT
+    )
+    """)
+
+    # Idempotency-Key results, shared by all server workers
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        result JSONB,                   -- NULL while the first request is running
+        created_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (scope, key)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at)")
+
+
+def _m004_cluster_nodes(cur, opts):
+    # one row per running server process; heartbeat_at says which are alive
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS cluster_nodes (
+        node_id TEXT PRIMARY KEY,       -- base_url + pid (workers of one node share base_url)
+        base_url TEXT NOT NULL,
+        load INTEGER NOT NULL DEFAULT 0,
+        started_at TIMESTAMP NOT NULL DEFAULT now(),
+        heartbeat_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """)
+
+
+def _m005_idempotency_request_hash(cur, opts):
+    # hash of the request body the key was first used with (a reused key with another body → 422)
+    cur.execute("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS request_hash TEXT")
+
+
+# (version, description, step) — append only, in order
+MIGRATIONS = [
+    (1, "base schema (state, tokens, leases, events)", _m001_base_schema),
+    (2, "queue / call / history indexes", _m002_indexes),
+    (3, "per-stage recalls + shared idempotency keys", _m003_shared_state),
+    (4, "cluster node heartbeats", _m004_cluster_nodes),
+    (5, "request hash on idempotency keys", _m005_idempotency_request_hash),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+
+# ------------------ runner ------------------
+
+def current_version(conn) -> int:
+    """The one query a boot with a current schema makes. 0 = never migrated."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+        version = cur.fetchone()["version"]
+    except psycopg.errors.UndefinedTable:
+        version = 0
+    conn.rollback()   # end the read transaction (or the failed one)
+    return version
+
+
+def migrate(conn, appt_start: int, walkin_start: int, lab_start: int) -> int:
+    """Brings the schema to LATEST. Returns the number of steps applied."""
+    if current_version(conn) >= LATEST:
+        return 0
+
+    opts = {"appt_start": appt_start, "walkin_start": walkin_start, "lab_start": lab_start}
+    applied = 0
+    cur = conn.cursor()
+
+    # under the lock too: concurrent CREATE TABLE IF NOT EXISTS can still collide
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_KEY,))
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """)
+    conn.commit()
+
+    for version, description, step in MIGRATIONS:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_KEY,))
+        # re-check under the lock: another server may have just applied it
+        cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+        if cur.fetchone():
+            conn.rollback()
+            continue
+
+        step(cur, opts)
+        cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+        conn.commit()
+        applied += 1
+        print(f"[MIGRATE] {version:03d} {description}")
+
+    return applied
+
+
+if __name__ == "__main__":
+    import db
+    from db import APPT_START, WALKIN_START, LAB_START
+
+    conn = db.connect()
+    try:
+        print(f"schema version {current_version(conn)} (latest {LATEST})")
+        if "--status" not in sys.argv:
+            n = migrate(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
+            print(f"applied {n} step(s)" if n else "nothing to do")
+    finally:
+        conn.close()
@@ -0,0 +1,103 @@
+# replay_events.py
+"""
+Rebuilds token state from the append-only token_events log.
+
+    python replay_events.py                 # compare today's replayed state with `tokens`
+    python replay_events.py --date 2026-10-19
+    python replay_events.py --apply         # rewrite today's `tokens` rows from the log
+    python replay_events.py --apply --force # ...even if some tokens predate the log
+"""
+import argparse
+from datetime import date
+
+import db
+import events
+
+TOKEN_COLUMNS = (
+    "token_no", "dept", "stage", "priority", "status",
+    "created_at", "called_at", "called_by", "served_at", "transferred_at",
+)
+
+
+def iter_events(conn, day: date):
+    # named cursor = server-side, so a busy day is streamed instead of loaded at once
+    with conn.cursor(name="replay_events") as cur:
+        cur.itersize = 2000
+        cur.execute(f"""
+            SELECT {', '.join(events.EVENT_COLUMNS)}
+            FROM token_events
+            WHERE session_date = %s
+            ORDER BY at ASC, id ASC
+        """, (day,))
+        yield from cur
+
+
+def load_tokens(conn) -> dict:
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(TOKEN_COLUMNS)} FROM tokens")
+    return {(r["created_at"].date(), r["dept"], r["token_no"]): r for r in cur.fetchall()}
+
+
+def diff(replayed: dict, current: dict) -> list[str]:
+    out = []
+    for key in sorted(set(replayed) | set(current)):
+        a, b = replayed.get(key), current.get(key)
+        if a is None:
+            out.append(f"{key[1]} {key[2]}: in tokens, missing from log")
+        elif b is None:
+            out.append(f"{key[1]} {key[2]}: in log, missing from tokens")
+        else:
+            changed = [c for c in TOKEN_COLUMNS if a[c] != b[c]]
+            if changed:
+                out.append(f"{key[1]} {key[2]}: " + ", ".join(f"{c} log={a[c]} tokens={b[c]}" for c in changed))
+    return out
+
+
+def apply(conn, replayed: dict):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM tokens")
+    cur.executemany(f"""
+        INSERT INTO tokens ({', '.join(TOKEN_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(TOKEN_COLUMNS))})
+    """, [tuple(r[c] for c in TOKEN_COLUMNS) for r in replayed.values()])
+    conn.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay token_events into token state")
+    ap.add_argument("--date", type=date.fromisoformat, default=date.today(), help="session day (YYYY-MM-DD)")
+    ap.add_argument("--apply", action="store_true", help="replace the tokens table with the replayed rows")
+    ap.add_argument("--force", action="store_true", help="apply even if tokens has rows the log doesn't know")
+    args = ap.parse_args()
+
+    conn = db.connect()
+    try:
+        replayed = events.replay(iter_events(conn, args.date))
+        print(f"Replayed {len(replayed)} tokens for {args.date}")
+
+        if args.apply:
+            if args.date != date.today():
+                print("❌ tokens only holds today's session; --apply needs --date today")
+                return
+            missing = set(load_tokens(conn)) - set(replayed)
+            if missing and not args.force:
+                print(f"❌ {len(missing)} tokens are not in the event log (printed before it existed?); use --force")
+                return
+            apply(conn, replayed)
+            print("✅ tokens rebuilt from event log")
+            return
+
+        if args.date == date.today():
+            problems = diff(replayed, load_tokens(conn))
+            for line in problems:
+                print(" -", line)
+            print("✅ tokens matches the event log" if not problems else f"⚠️  {len(problems)} differences")
+        else:
+            for r in replayed.values():
+                print(r)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
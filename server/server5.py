@@ -1,13 +1,22 @@
 # server5.py
 import configparser
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import db
-import os, sys, threading, time
-from datetime import datetime, timedelta
+from db import APPT_START, WALKIN_START, LAB_START
+import changes
+import cluster
+import migrations
+import asyncio, hashlib, json, os, sys, threading, time
+from datetime import date, datetime, timedelta
 from fastapi.staticfiles import StaticFiles
-from discovery import start_broadcast
+from discovery import local_ip, start_broadcast, start_responder
+from idempotency import IdempotencyStore, InProgress, KeyMismatch, PgIdempotencyStore
+import export_tokens
+from announce_audio import AnnouncementRenderer
+from token_status import TokenStatusSnapshot
 # ------------------ models ------------------
 from pydantic import BaseModel
 from typing import Literal
@@ -24,10 +33,77 @@ cfg.read(os.path.join(app_dir(), "config.ini"))
 HOST = cfg.get("server", "host", fallback="0.0.0.0")
 PORT = cfg.getint("server", "port", fallback=8032)
 TOKEN_START = cfg.getint("qms", "token_start", fallback=1001)
-# ------------------ in-memory nursing recall (no DB change) ------------------
-# Nursing recall must NOT trigger reception tablet audio.
-NURSING_RECALL_SEQ = 0
-LAST_NURSING_RECALL_COUNTER = None
+# uvicorn worker processes; all shared state (recalls, idempotency keys) lives in Postgres
+WORKERS = cfg.getint("server", "workers", fallback=1)
+
+# ------------------ cluster (several nodes, one database) ------------------
+# Every node runs this same server against the same Postgres; writes stay
+# correct through row locks there. Nodes heartbeat into cluster_nodes and
+# discovery answers list all healthy ones, so clients spread across them.
+CLUSTER = cfg.getboolean("cluster", "enabled", fallback=False)
+NODE_IP = cfg.get("cluster", "advertise_host", fallback="").strip() or local_ip()
+NODE_BASE = f"http://{NODE_IP}:{PORT}"
+
+# ------------------ idempotency (safe client retries) ------------------
+# Kiosks/counters send an Idempotency-Key header; a retry with the same key
+# gets the original result instead of a second token / a skipped patient.
+# memory: per process (fastest, one worker) | postgres: shared by all workers
+IDEMPOTENCY_BACKEND = cfg.get("idempotency", "backend", fallback="postgres" if WORKERS > 1 or CLUSTER else "memory")
+if IDEMPOTENCY_BACKEND == "postgres":
+    IDEMPOTENCY = PgIdempotencyStore(
+        db.connect,
+        ttl_seconds=cfg.getfloat("idempotency", "ttl_seconds", fallback=600),
+    )
+else:
+    IDEMPOTENCY = IdempotencyStore(
+        max_entries=cfg.getint("idempotency", "max_entries", fallback=2048),
+        ttl_seconds=cfg.getfloat("idempotency", "ttl_seconds", fallback=600),
+    )
+
+
+def _idempotent(scope: str, key: str | None, body: BaseModel, fn):
+    """
+    fn(conn): conn is the store's connection with the transaction left open (the
+    store commits it together with the key's result), or None → fn commits itself.
+    """
+    fingerprint = hashlib.sha256(body.model_dump_json().encode("utf-8")).hexdigest()
+    try:
+        return IDEMPOTENCY.run(scope, key, fn, fingerprint=fingerprint)
+    except InProgress:
+        # a retry that outwaited a still-running first request: the client tries again
+        raise HTTPException(status_code=409, detail="request with this Idempotency-Key is still in progress",
+                            headers={"Retry-After": "1"})
+    except KeyMismatch:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+# ------------------ token leasing (kiosk-side numbering) ------------------
+LEASE_BLOCK_SIZE = cfg.getint("lease", "block_size", fallback=5)
+LEASE_MAX_BLOCK_SIZE = cfg.getint("lease", "max_block_size", fallback=50)
+
+# ------------------ announcement audio (browser displays) ------------------
+# ding + intro + digits + counter rendered once per token/counter into ONE WAV
+ANNOUNCE_AUDIO = AnnouncementRenderer(
+    os.path.join(app_dir(), "static"),
+    os.path.join(app_dir(), "announce_cache"),
+    max_files=cfg.getint("announce", "max_files", fallback=2000),
+)
+
+# ------------------ per-token status for phones (/t/{token}) ------------------
+TOKEN_STATUS = TokenStatusSnapshot(interval=cfg.getfloat("token_status", "refresh_seconds", fallback=3.0))
+
+# ------------------ long-poll status (/api/status/wait) ------------------
+# Parked requests wake on NOTIFY from the DB (any worker's change);
+# a client waits at most this long before it gets the unchanged status back.
+CHANGES = changes.ChangeFeed(db.connect)
+STATUS_WAIT_MAX = cfg.getfloat("status_wait", "max_seconds", fallback=30.0)
+
+HEARTBEAT = cluster.Heartbeat(
+    db.connect,
+    NODE_BASE,
+    load=CHANGES.waiting,
+    interval=cfg.getfloat("cluster", "heartbeat_seconds", fallback=3.0),
+    node_timeout=cfg.getfloat("cluster", "node_timeout_seconds", fallback=10.0),
+) if CLUSTER else None
 
 # ------------------ app ------------------
 
@@ -47,6 +123,20 @@ class CallNextBody(BaseModel):
     mode: Literal["auto", "appointment", "walkin"] = "auto"
     dest_stage: Literal["nursing", "lab"] | None = None
 
+class LeaseBody(BaseModel):
+    dept: str = "welfare"
+    visit_type: Literal["appointment", "walkin", "lab"] = "walkin"
+    kiosk_id: str = "kiosk"
+    count: int | None = None
+
+class LeasedToken(BaseModel):
+    token_no: int
+    issued_at: datetime | None = None
+
+class ReportTokensBody(BaseModel):
+    lease_id: int
+    tokens: list[LeasedToken]
+
 class RecallBody(BaseModel):
     dept: str = "welfare"
     stage: Literal["reception", "nursing", "lab"] = "reception"
@@ -56,18 +146,40 @@ class RecallBody(BaseModel):
 
 @app.on_event("startup")
 def startup():
-    # autodiscovery broadcast
-    start_broadcast(PORT)
-
-    # ✅ init db once at boot (tables/state/indexes)
+    # autodiscovery broadcast + direct answers to client probes, once per node:
+    # only the worker that got the probe port runs them
+    if HEARTBEAT:
+        discovery = start_responder(PORT, ip=NODE_IP, load=lambda: HEARTBEAT.node_load(NODE_BASE), nodes=HEARTBEAT.nodes)
+    else:
+        discovery = start_responder(PORT, ip=NODE_IP, load=CHANGES.waiting)
+    if discovery:
+        start_broadcast(PORT, ip=NODE_IP)
+        print(f"[DISCOVERY] answering probes (pid {os.getpid()})")
+
+    # phones read token status from memory, refreshed here
+    TOKEN_STATUS.start()
+
+    # wakes /api/status/wait when a call/recall/transfer commits
+    CHANGES.start()
+
+    # ✅ schema: one version query when current, DDL only for pending migrations
+    # (the daily reset runs with the first request of the day)
     conn = db.connect()
     try:
-        db.init_db(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
-        db.create_indexes(conn)   # <-- Step 3 adds this function
-        db.daily_cleanup_if_needed(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
+        migrations.migrate(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
     finally:
         conn.close()
 
+    # after migrate: cluster_nodes exists from migration 004
+    if HEARTBEAT:
+        HEARTBEAT.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    if HEARTBEAT:
+        HEARTBEAT.stop()
+
 
 @app.get("/", response_class=HTMLResponse)
 def root():
@@ -104,13 +216,14 @@ def serving_nursing_page():
         return f.read()
 
 
-APPT_START = 1001
-WALKIN_START = 2001
-LAB_START = 3001
-
 @app.post("/api/print-token")
-def api_print_token(body: PrintBody):
-    conn = db.connect()
+def api_print_token(body: PrintBody, idempotency_key: str | None = Header(default=None)):
+    return _idempotent("print-token", idempotency_key, body, lambda conn: _print_token(body, conn))
+
+
+def _print_token(body: PrintBody, conn=None):
+    own = conn is None
+    conn = conn or db.connect()
     try:
         # init + daily cleanup must reset BOTH counters now
         db.daily_cleanup_if_needed(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
@@ -121,15 +234,81 @@ def api_print_token(body: PrintBody):
             visit_type=body.visit_type,
             appt_start=APPT_START,
             walkin_start=WALKIN_START,
-            lab_start=LAB_START
+            lab_start=LAB_START,
+            commit=own
         )
         return {"token_no": token_no, "dept": body.dept, "visit_type": body.visit_type}
+    finally:
+        if own:
+            conn.close()
+
+
+@app.post("/api/lease-tokens")
+def api_lease_tokens(body: LeaseBody, idempotency_key: str | None = Header(default=None)):
+    """
+    Hands a kiosk a contiguous block of token numbers for one visit type.
+    The kiosk prints from the block without a round trip and reports what it
+    issued via /api/report-tokens. Block size comes from [lease] block_size.
+    """
+    return _idempotent("lease-tokens", idempotency_key, body, lambda conn: _lease_tokens(body, conn))
+
+
+def _lease_tokens(body: LeaseBody, conn=None):
+    count = body.count or LEASE_BLOCK_SIZE
+    count = max(1, min(count, LEASE_MAX_BLOCK_SIZE))
+
+    own = conn is None
+    conn = conn or db.connect()
+    try:
+        db.daily_cleanup_if_needed(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
+        lease = db.lease_token_block(
+            conn,
+            dept=body.dept,
+            kiosk_id=body.kiosk_id,
+            visit_type=body.visit_type,
+            count=count,
+            appt_start=APPT_START,
+            walkin_start=WALKIN_START,
+            lab_start=LAB_START,
+            commit=own
+        )
+        return {"dept": body.dept, **lease}
+    finally:
+        if own:
+            conn.close()
+
+
+@app.post("/api/report-tokens")
+def api_report_tokens(body: ReportTokensBody):
+    """
+    Batch of tokens a kiosk issued from a lease. Idempotent: already reported
+    numbers are skipped, so the kiosk can simply resend on failure.
+    """
+    conn = db.connect()
+    try:
+        db.daily_cleanup_if_needed(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
+        return db.report_leased_tokens(
+            conn,
+            lease_id=body.lease_id,
+            tokens=[t.model_dump() for t in body.tokens],
+            appt_start=APPT_START,
+            walkin_start=WALKIN_START,
+            lab_start=LAB_START
+        )
     finally:
         conn.close()
 
 
 @app.post("/api/call-next")
-def api_call_next(body: CallNextBody):
+def api_call_next(body: CallNextBody, idempotency_key: str | None = Header(default=None)):
+    """
+    A retried request with the same Idempotency-Key returns the first result,
+    so a double-clicked NEXT does not skip a patient.
+    """
+    return _idempotent("call-next", idempotency_key, body, lambda conn: _call_next(body, conn))
+
+
+def _call_next(body: CallNextBody, conn=None):
     """
     Stage behavior:
       - reception: when you click NEXT, we first transfer the *previous* reception token
@@ -137,7 +316,8 @@ def api_call_next(body: CallNextBody):
       - nursing: when you click NEXT, we first mark the *previous* nursing token as SERVED,
         then we CALL the next one from nursing queue.
     """
-    conn = db.connect()
+    own = conn is None
+    conn = conn or db.connect()
     try:
         db.daily_cleanup_if_needed(conn, appt_start=APPT_START, walkin_start=WALKIN_START, lab_start=LAB_START)
 
@@ -157,19 +337,24 @@ def api_call_next(body: CallNextBody):
                 dept=body.dept,
                 counter=body.counter,
                 from_stage="reception",
-                to_stage=to_stage  # ← Auto-routed based on token number
+                to_stage=to_stage,  # ← Auto-routed based on token number
+                commit=False
             )
         else:
             # nursing/lab: finish previous one so it disappears
-            db.complete_last_called(conn, dept=body.dept, stage=body.stage, counter=body.counter)
+            db.complete_last_called(conn, dept=body.dept, stage=body.stage, counter=body.counter, commit=False)
 
-        token_no = db.call_next_atomic(conn, body.dept, body.counter, body.mode, stage=body.stage)
+        token_no = db.call_next_atomic(conn, body.dept, body.counter, body.mode, stage=body.stage, commit=False)
+        # finish + call are one transaction (one events write); with a key the store commits
+        if own:
+            conn.commit()
         if token_no is None:
             return {"token_no": None, "stage": body.stage}
 
         return {"token_no": token_no, "dept": body.dept, "stage": body.stage, "counter": body.counter}
     finally:
-        conn.close()
+        if own:
+            conn.close()
 
 @app.post("/api/recall-last")
 def api_recall_last(body: RecallBody):
@@ -189,12 +374,10 @@ def api_recall_last(body: RecallBody):
 
         if body.stage == "reception":
             # ✅ record recall with counter (used by reception tablet audio)
-            db.record_recall(conn, counter)
+            db.record_recall(conn, body.dept, last["token_no"], counter)
         else:
-            # ✅ nursing recall is LOCAL ONLY (no DB change, no tablet audio)
-            global NURSING_RECALL_SEQ, LAST_NURSING_RECALL_COUNTER
-            NURSING_RECALL_SEQ += 1
-            LAST_NURSING_RECALL_COUNTER = counter
+            # ✅ nursing/lab recall: own per-stage seq (no reception tablet audio)
+            db.record_stage_recall(conn, body.dept, body.stage, last["token_no"], counter)
 
         return {
             "token_no": last["token_no"],
@@ -205,37 +388,176 @@ def api_recall_last(body: RecallBody):
     finally:
         conn.close()
 
+def _stage_status(conn, recalls: dict, dept: str, stage: str):
+    if stage == "nursing":
+        counters = ["Nurse1"]
+    elif stage == "lab":
+        counters = ["Lab1"]
+    else:
+        counters = ["Counter1", "Counter2", "Counter3", "Counter4"]
+
+    calls = db.get_last_calls_for_counters(conn, dept, counters, stage=stage)
+    serving = {c: (call["token_no"] if call else None) for c, call in calls.items()}
+    row = recalls.get("reception")
+    stage_row = recalls.get(stage) if stage in ("nursing", "lab") else None
+
+    return {
+        "ok": True,
+        "stage": stage,
+        "recall_seq": row["recall_seq"] if row else 0,
+        "recall_counter": row["last_recall_counter"] if row else None,
+        # Expose nursing-style recall info for both nursing and lab stages (each its own seq)
+        "nursing_recall_seq": stage_row["recall_seq"] if stage_row else 0,
+        "nursing_recall_counter": stage_row["last_recall_counter"] if stage_row else None,
+        "serving": serving,
+        # call event id + server timestamp per counter (latency tracing on the clients)
+        "calls": {
+            c: {"event_id": call["event_id"], "called_ts": call["called_at"].timestamp()}
+            for c, call in calls.items() if call and call["event_id"] is not None
+        },
+        "server_ts": time.time()
+    }
+
+
+@app.get("/api/cluster")
+def api_cluster():
+    # healthy nodes as seen by this one (clients find them via discovery probes)
+    nodes = HEARTBEAT.nodes() if HEARTBEAT else [{"base": NODE_BASE, "load": CHANGES.waiting()}]
+    return {"node": NODE_BASE, "cluster": CLUSTER, "nodes": nodes}
+
 @app.get("/api/status")
 def api_status(dept: str = "welfare", stage: str = "reception"):
     conn = db.connect()
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT recall_seq, last_recall_counter FROM state WHERE id=1")
-        row = cur.fetchone()
-
-        if stage == "nursing":
-            counters = ["Nurse1"]
-        elif stage == "lab":
-            counters = ["Lab1"]
-        else:
-            counters = ["Counter1", "Counter2", "Counter3", "Counter4"]
+        return _stage_status(conn, db.get_recalls(conn), dept, stage)
+    finally:
+        conn.close()
 
-        serving = db.get_last_called_for_counters(conn, dept, counters, stage=stage)
 
+@app.get("/api/status/wait")
+async def api_status_wait(dept: str = "welfare", stage: str = "reception", since: str | None = None, timeout: float = 25.0):
+    """
+    Long-poll /api/status: returns as soon as the status differs from the
+    `version` the client already has (since), or after timeout seconds.
+    """
+    return await _wait_for_change(("status", dept, stage), lambda: api_status(dept, stage), since, timeout)
+
+
+@app.get("/api/status/all/wait")
+async def api_status_all_wait(dept: str = "welfare", stages: str = "reception,nursing,lab", since: str | None = None, timeout: float = 25.0):
+    """Long-poll /api/status/all (central announcer)."""
+    return await _wait_for_change(("all", dept, stages), lambda: api_status_all(dept, stages), since, timeout)
+
+
+def _status_version(status: dict) -> str:
+    """Fingerprint of everything a poller reacts to (not the clock)."""
+    def strip(d):
+        return {k: (strip(v) if isinstance(v, dict) else v)
+                for k, v in d.items() if k not in ("server_ts", "version", "waited_ms")}
+    raw = json.dumps(strip(status), sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+# (dept, stage...) -> (feed version, started, task): every request woken by the
+# same change shares ONE status read instead of one DB round trip each. A
+# finished read is reused only briefly so server_ts (clock sync) stays fresh.
+_SHARED_READS = {}
+_SHARED_READ_TTL = 0.5
+
+
+async def _read_shared(key, read, seen: int) -> dict:
+    entry = _SHARED_READS.get(key)
+    fresh = entry is not None and entry[0] == seen and (
+        not entry[2].done() or time.monotonic() - entry[1] < _SHARED_READ_TTL)
+    if not fresh:
+        async def _read():
+            status = await run_in_threadpool(read)
+            status["version"] = _status_version(status)
+            return status
+        if len(_SHARED_READS) > 256:
+            _SHARED_READS.clear()   # keys come from query params; keep it bounded
+        entry = (seen, time.monotonic(), asyncio.ensure_future(_read()))
+        _SHARED_READS[key] = entry
+    try:
+        # shield: one caller giving up (client gone) must not cancel the read for the others
+        return dict(await asyncio.shield(entry[2]))
+    except Exception:
+        if _SHARED_READS.get(key) is entry:
+            del _SHARED_READS[key]   # next caller retries
+        raise
+
+
+async def _wait_for_change(key, read, since: str | None, timeout: float):
+    started = time.monotonic()
+    deadline = started + max(0.0, min(timeout, STATUS_WAIT_MAX))
+    while True:
+        seen = CHANGES.version   # before reading, so a change during the read isn't missed
+        read_at = time.monotonic()
+        status = await _read_shared(key, read, seen)
+        # time spent parked; clients take it out of the round trip for clock sync
+        status["waited_ms"] = round((read_at - started) * 1000.0, 1)
+
+        remaining = deadline - time.monotonic()
+        if status["version"] != since or remaining <= 0:
+            return status
+        await CHANGES.wait(seen, remaining)
+
+
+@app.get("/api/status/all")
+def api_status_all(dept: str = "welfare", stages: str = "reception,nursing,lab"):
+    """Status of several stages in one request (used by the central announcer)."""
+    conn = db.connect()
+    try:
+        recalls = db.get_recalls(conn)
+        wanted = [s.strip() for s in stages.split(",") if s.strip()]
         return {
             "ok": True,
-            "stage": stage,
-            "recall_seq": row["recall_seq"] if row else 0,
-            "recall_counter": row["last_recall_counter"] if row else None,
-            # Expose nursing-style recall info for both nursing and lab stages
-            "nursing_recall_seq": (NURSING_RECALL_SEQ if stage in ("nursing", "lab") else 0),
-            "nursing_recall_counter": (LAST_NURSING_RECALL_COUNTER if stage in ("nursing", "lab") else None),
-            "serving": serving
+            "stages": {s: _stage_status(conn, recalls, dept, s) for s in wanted}
         }
     finally:
         conn.close()
 
 
+@app.get("/api/announce/{token_no}/{counter}.wav")
+def api_announce_audio(token_no: int, counter: str):
+    """
+    Whole announcement for a display as one WAV. Built on first request, then
+    served from disk (Range requests + ETag/Last-Modified via FileResponse).
+    """
+    if not (0 < token_no < 100000) or not ANNOUNCE_AUDIO.valid_counter(counter):
+        raise HTTPException(status_code=400, detail="invalid token or counter")
+
+    path = ANNOUNCE_AUDIO.path_for(token_no, counter)
+    if path is None:
+        raise HTTPException(status_code=404, detail="announcement audio not available")
+
+    headers = {
+        "Cache-Control": "public, max-age=86400",
+        # "0" → no recording names this counter (e.g. no Lab.wav); the display speaks it
+        "X-Counter-Audio": "1" if ANNOUNCE_AUDIO.has_counter_audio(counter) else "0",
+    }
+    return FileResponse(path, media_type="audio/wav", headers=headers)
+
+
+@app.get("/t/{token_no}", response_class=HTMLResponse)
+def token_page(token_no: int):
+    with open("web/token.html", "r", encoding="utf-8") as f:
+        return f.read()
+
+
+@app.get("/api/t/{token_no}")
+def api_token_status(token_no: int, dept: str = "welfare"):
+    """One patient's token (position/state) from the in-memory snapshot, never the DB."""
+    body = TOKEN_STATUS.get(dept, token_no)
+    if body is None:
+        raise HTTPException(status_code=404, detail="token not found")
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"Cache-Control": f"public, max-age={int(TOKEN_STATUS.interval)}"}
+    )
+
+
 @app.get("/api/queue")
 def api_queue(dept: str = "welfare", stage: str = "reception"):
     conn = db.connect()
@@ -246,6 +568,29 @@ def api_queue(dept: str = "welfare", stage: str = "reception"):
         conn.close()
 
 
+@app.get("/api/export")
+def api_export(date_from: date | None = None, date_to: date | None = None, dept: str | None = None,
+               fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format")):
+    """
+    Streams tokens with all timestamps/stages as NDJSON (default) or CSV.
+    Dates are YYYY-MM-DD (default: today; a malformed one is a 422). Rows come
+    from a server-side cursor and go out as a chunked response, so memory
+    doesn't grow with the range.
+    """
+    d_from = date_from or datetime.now().date()
+    d_to = date_to or d_from
+    if d_to < d_from:
+        raise HTTPException(status_code=400, detail="date_to is before date_from")
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"tokens_{d_from.isoformat()}_{d_to.isoformat()}.{fmt}"
+    return StreamingResponse(
+        export_tokens.stream_export(d_from, d_to, dept, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
     import logging
@@ -256,9 +601,10 @@ if __name__ == "__main__":
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 
     uvicorn.run(
-        app,
+        "server5:app" if WORKERS > 1 else app,   # workers need an import string
         host=HOST,
         port=PORT,
+        workers=WORKERS,
         log_level="warning",   # 👈 only warnings & errors
         access_log=False       # 👈 disables request logs
     )
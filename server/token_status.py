@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+
+import db
+
+# same order call_next_atomic picks the next WAITING token in
+_QUEUE_ORDER = {
+    "reception": lambda r: (r["priority"], r["created_at"]),
+    "nursing": lambda r: (r["transferred_at"] or r["created_at"],),
+    "lab": lambda r: (r["created_at"],),
+}
+
+
+class TokenStatusSnapshot:
+    """
+    Per-token status for patients' phones (/t/{token}).
+
+    A background thread reads all of today's tokens with ONE query every
+    `interval` seconds and pre-encodes a small JSON body per token, so a
+    request is just a dict lookup; hundreds of phones polling never reach
+    the database.
+    """
+
+    def __init__(self, interval: float = 3.0):
+        self.interval = interval
+        self._bodies = {}        # (dept, token_no) -> bytes
+        self._updated_at = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def get(self, dept: str, token_no: int) -> bytes | None:
+        return self._bodies.get((dept, token_no))
+
+    @property
+    def updated_at(self) -> float:
+        return self._updated_at
+
+    def _loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("[TOKEN-STATUS] refresh failed:", e)
+            time.sleep(self.interval)
+
+    def refresh(self):
+        conn = db.connect()
+        try:
+            rows = db.get_token_rows(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+        now = time.time()
+
+        # positions in each waiting line
+        lines = {}
+        for r in rows:
+            if r["status"] == "WAITING":
+                lines.setdefault((r["dept"], r["stage"]), []).append(r)
+        position = {}
+        for (dept, stage), waiting in lines.items():
+            waiting.sort(key=_QUEUE_ORDER.get(stage, _QUEUE_ORDER["lab"]))
+            for i, r in enumerate(waiting):
+                position[(dept, r["token_no"])] = (i + 1, len(waiting))
+
+        bodies = {}
+        for r in rows:
+            key = (r["dept"], int(r["token_no"]))
+            pos = position.get(key)
+            bodies[key] = json.dumps({
+                "token_no": key[1],
+                "dept": key[0],
+                "stage": r["stage"],
+                "status": r["status"],
+                "position": pos[0] if pos else None,     # 1 = next to be called
+                "waiting": pos[1] if pos else None,
+                "counter": r["called_by"] if r["status"] == "CALLED" else None,
+                "called_at": r["called_at"].isoformat() if r["called_at"] else None,
+                "updated_at": now,
+            }).encode("utf-8")
+
+        # swap in one go: readers see the old or the new map, never a half-built one
+        self._bodies = bodies
+        self._updated_at = now